@@ -1,19 +1,21 @@
 #Importing the required Libraries
-import tensorflow as tf
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import numpy as np
+from fastapi.responses import PlainTextResponse, ORJSONResponse, StreamingResponse
 from PIL import Image
-import uvicorn
-import io
+import asyncio
 import smtplib
 import random
 import string
 import time
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from pydantic import BaseModel, EmailStr
 from typing import Optional
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import sys
 import os
@@ -27,6 +29,49 @@ spec = importlib.util.spec_from_file_location("fingerprint_scanner", scanner_pat
 fingerprint_scanner = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(fingerprint_scanner)
 R307FingerprintCaptureLibrary = fingerprint_scanner.R307FingerprintCaptureLibrary
+# Serial port and baud rates from BIOPRINT_SCANNER_PORT, BIOPRINT_SCANNER_BAUDRATE and BIOPRINT_SCANNER_TARGET_BAUDRATE
+SCANNER_PORT = fingerprint_scanner.SCANNER_PORT
+ENROLL_ERRORS = fingerprint_scanner.ENROLL_ERRORS
+
+# One sensor on one serial port: enrollment, capture (both modes) and search hold this lock while they use it
+scanner_lock = threading.Lock()
+SCANNER_BUSY_MESSAGE = "The fingerprint scanner is in use by another request. Please try again shortly."
+
+class ScannerBusy(Exception):
+    """Another enrollment, capture or search holds the scanner"""
+
+@contextmanager
+def scanner_in_use():
+    """Hold the scanner lock; raises ScannerBusy at once instead of opening the port a second time"""
+    if not scanner_lock.acquire(blocking=False):
+        raise ScannerBusy(SCANNER_BUSY_MESSAGE)
+    try:
+        yield
+    finally:
+        scanner_lock.release()
+
+# Pipeline instrumentation exposed on /metrics
+from metrics import REGISTRY, stage_timer, record_error, record_coalesced
+from tracing import TracingMiddleware, SlowRequestProfiler, current_trace
+from traffic_capture import TrafficCaptureMiddleware, TrafficRecorder
+from audit_log import AuditLog
+from image_store import ImageStore, file_sha256
+from streaming_upload import UploadRejected, read_image_upload, read_image_uploads
+from image_quality import QualityGate, REASONS as QUALITY_REASONS
+from model_loader import load_model
+# Preprocessing shared with the offline tools (rescore.py, benchmarks/evaluate_models.py)
+from preprocessing import CLASS_LABELS, preprocess
+import inference_config
+from tta import MAX_VIEWS as MAX_TTA_VIEWS
+from prediction_service import PredictionService, MetricsHook, InferenceError
+from enrollment_jobs import EnrollmentJobs, EnrollmentBusy, format_sse
+from capture_pipeline import CapturePipeline, CaptureFailed, PipelineFull
+from request_coalescing import RequestCoalescer, IdempotencyConflict, COMPUTED
+from inference_scheduler import InferenceScheduler, INTERACTIVE, BULK
+from embeddings import EmbeddingExtractor
+from embedding_index import EmbeddingIndex
+from concurrency_limiter import AdaptiveConcurrencyLimiter, Overloaded
+import serving
 
 # Create FastAPI app
 app = FastAPI(
@@ -42,14 +87,182 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "Server-Timing", "Idempotent-Replayed"],
+)
+
+# Request tracing; requests slower than the threshold get a stack profile saved to PROFILE_DIR
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get("BIOPRINT_SLOW_REQUEST_MS", "5000"))  # 0 disables profiling
+PROFILE_DIR = os.environ.get("BIOPRINT_PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.environ.get("BIOPRINT_PROFILE_KEEP", "50"))  # Number of profiles kept on disk
+# Path prefixes never profiled: enrollment (including its event streams) and search mostly wait for a finger.
+# /capture-and-predict is profiled; its finger wait is left out of the samples, its serial download is not
+PROFILE_EXCLUDED_PATHS = os.environ.get("BIOPRINT_PROFILE_EXCLUDE", "/enroll-fingerprint,/search-fingerprint").split(",")
+
+slow_request_profiler = SlowRequestProfiler(
+    output_dir=PROFILE_DIR,
+    threshold_ms=SLOW_REQUEST_THRESHOLD_MS,
+    keep=PROFILE_KEEP,
+    exclude_paths=PROFILE_EXCLUDED_PATHS,
+)
+app.add_middleware(TracingMiddleware, profiler=slow_request_profiler)
+
+# Optional live traffic capture in the requests.jsonl replay format (see benchmarks/replay.py)
+CAPTURE_TRAFFIC_PATH = os.environ.get("BIOPRINT_CAPTURE_TRAFFIC", "")  # e.g. "requests.jsonl"; empty disables
+traffic_recorder = TrafficRecorder(CAPTURE_TRAFFIC_PATH) if CAPTURE_TRAFFIC_PATH else None
+if traffic_recorder:
+    app.add_middleware(TrafficCaptureMiddleware, recorder=traffic_recorder)
+
+# Prediction audit log (query with audit_log.py); segments are written by a background thread
+AUDIT_DIR = os.environ.get("BIOPRINT_AUDIT_DIR", "audit_log")  # empty disables the audit log
+AUDIT_FLUSH_ROWS = int(os.environ.get("BIOPRINT_AUDIT_FLUSH_ROWS", "1000"))
+AUDIT_FLUSH_SECONDS = float(os.environ.get("BIOPRINT_AUDIT_FLUSH_SECONDS", "5"))
+audit_log = AuditLog(AUDIT_DIR, AUDIT_FLUSH_ROWS, AUDIT_FLUSH_SECONDS) if AUDIT_DIR else None
+
+# Store for captured fingerprint images: deduplicated, date-sharded, compressed and expired in the background
+IMAGE_STORE_DIR = os.environ.get("BIOPRINT_IMAGE_STORE", "Images/store")
+IMAGE_COMPRESSION = os.environ.get("BIOPRINT_IMAGE_COMPRESSION", "png")  # png, webp or none (all lossless)
+IMAGE_STORE_MAX_MB = float(os.environ.get("BIOPRINT_IMAGE_STORE_MAX_MB", "0"))  # 0 = no size limit
+IMAGE_STORE_MAX_AGE_DAYS = float(os.environ.get("BIOPRINT_IMAGE_STORE_MAX_AGE_DAYS", "0"))  # 0 = keep forever
+image_store = ImageStore(
+    root=IMAGE_STORE_DIR,
+    compression=IMAGE_COMPRESSION,
+    max_bytes=int(IMAGE_STORE_MAX_MB * 1024 * 1024),
+    max_age_days=IMAGE_STORE_MAX_AGE_DAYS,
 )
 
+# Upload limits, enforced while the body streams in (see streaming_upload.py)
+MAX_UPLOAD_MB = float(os.environ.get("BIOPRINT_MAX_UPLOAD_MB", "10"))
+MAX_IMAGE_SIDE = int(os.environ.get("BIOPRINT_MAX_IMAGE_SIDE", "4096"))  # pixels per side
+MAX_BATCH_FILES = int(os.environ.get("BIOPRINT_MAX_BATCH_FILES", "32"))  # images per /predict-batch request
+MAX_BATCH_UPLOAD_MB = float(os.environ.get("BIOPRINT_MAX_BATCH_UPLOAD_MB", "50"))
+
+# Pre-inference quality gate: blank, blurred or partial images are rejected with a 422 before the models run
+QUALITY_GATE_ENABLED = os.environ.get("BIOPRINT_QUALITY_GATE", "1") != "0"
+quality_gate = QualityGate(
+    min_contrast=float(os.environ.get("BIOPRINT_QUALITY_MIN_CONTRAST", "15")),
+    min_sharpness=float(os.environ.get("BIOPRINT_QUALITY_MIN_SHARPNESS", "100")),
+    min_coverage=float(os.environ.get("BIOPRINT_QUALITY_MIN_COVERAGE", "0.3")),
+) if QUALITY_GATE_ENABLED else None
+
+# Pipelined /capture-and-predict: the next capture starts while the previous image is decoded and inferred
+CAPTURE_PIPELINE_ENABLED = os.environ.get("BIOPRINT_CAPTURE_PIPELINE", "0") == "1"
+CAPTURE_QUEUE_SIZE = int(os.environ.get("BIOPRINT_CAPTURE_QUEUE_SIZE", "2"))  # per stage; captures waiting beyond it get a 503
+
+# Idempotency-Key replays and coalescing of identical in-flight predictions (see request_coalescing.py)
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("BIOPRINT_IDEMPOTENCY_TTL_SECONDS", "600"))  # 0 keeps no completed results
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("BIOPRINT_IDEMPOTENCY_MAX_ENTRIES", "1024"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+request_coalescer = RequestCoalescer(IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_TTL_SECONDS)
+
+# Inference runs on one scheduler thread; interactive requests are served ahead of bulk scoring (see inference_scheduler.py)
+SCHEDULER_INTERACTIVE_WEIGHT = int(os.environ.get("BIOPRINT_SCHEDULER_INTERACTIVE_WEIGHT", "8"))
+SCHEDULER_BULK_WEIGHT = int(os.environ.get("BIOPRINT_SCHEDULER_BULK_WEIGHT", "1"))
+SCHEDULER_MAX_BATCH = int(os.environ.get("BIOPRINT_SCHEDULER_MAX_BATCH", "8"))  # images per model batch
+SCHEDULER_PREEMPT = os.environ.get("BIOPRINT_SCHEDULER_PREEMPT", "1") != "0"  # bulk requests yield between batches
+inference_scheduler = InferenceScheduler(
+    predict_many=lambda images, tta_views, source, keys: prediction_service.predict_many(images, tta_views, source, keys),
+    weights={INTERACTIVE: SCHEDULER_INTERACTIVE_WEIGHT, BULK: SCHEDULER_BULK_WEIGHT},
+    max_batch=SCHEDULER_MAX_BATCH,
+    preempt=SCHEDULER_PREEMPT,
+)
+
+# Adaptive limit on requests running inference; the excess gets a 503 with Retry-After (see concurrency_limiter.py)
+concurrency_limiter = AdaptiveConcurrencyLimiter(
+    initial_limit=int(os.environ.get("BIOPRINT_CONCURRENCY_INITIAL_LIMIT", "16")),
+    min_limit=int(os.environ.get("BIOPRINT_CONCURRENCY_MIN_LIMIT", "2")),
+    max_limit=int(os.environ.get("BIOPRINT_CONCURRENCY_MAX_LIMIT", "128")),
+    algorithm=os.environ.get("BIOPRINT_CONCURRENCY_ALGORITHM", "gradient"),  # gradient or aimd
+    tolerance=float(os.environ.get("BIOPRINT_CONCURRENCY_TOLERANCE", "1.5")),  # latency / baseline before backing off
+    enabled=os.environ.get("BIOPRINT_CONCURRENCY_LIMITER", "1") != "0",
+)
+
+# Penultimate-layer embeddings and the similarity index over captures (see embeddings.py, embedding_index.py)
+EMBEDDING_MODEL = os.environ.get("BIOPRINT_EMBEDDING_MODEL", "mobilenetv2")  # model whose embeddings are indexed
+EMBEDDING_INDEX_PATH = os.environ.get("BIOPRINT_EMBEDDING_INDEX", "embeddings/index.npz")  # empty disables the index
+EMBEDDING_INDEX_SAVE_SECONDS = float(os.environ.get("BIOPRINT_EMBEDDING_INDEX_SAVE_SECONDS", "60"))
+NEAR_DUPLICATE_SIMILARITY = float(os.environ.get("BIOPRINT_NEAR_DUPLICATE_SIMILARITY", "0.98"))
+embedding_index = EmbeddingIndex.open(EMBEDDING_INDEX_PATH, EMBEDDING_MODEL) if EMBEDDING_INDEX_PATH else None
+# Captures are added to the index and the index is saved on this thread, never on the inference scheduler's
+embedding_index_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-index")
+embedding_index_saver: Optional[asyncio.Task] = None
+
+# Enrollment runs as a background job per request (see enrollment_jobs.py)
+ENROLL_TIMEOUT = float(os.environ.get("BIOPRINT_ENROLL_TIMEOUT", "10"))  # seconds per step (place, remove, place again)
+ENROLL_JOB_KEEP_SECONDS = float(os.environ.get("BIOPRINT_ENROLL_JOB_KEEP_SECONDS", "600"))  # finished jobs stay queryable
+ENROLL_SSE_HEARTBEAT_SECONDS = 15.0
+
+# Enrollment failure reason -> error type on /metrics, and the status/detail of the blocking /enroll-fingerprint
+ENROLL_ERROR_TYPES = {
+    "hardware_not_detected": "hardware_not_detected",
+    "first_capture_timeout": "enroll_timeout",
+    "finger_not_removed": "enroll_timeout",
+    "second_capture_timeout": "enroll_timeout",
+    "mismatch": "fingerprints_mismatch",
+    "scanner_busy": "scanner_busy",
+}
+ENROLL_ERROR_RESPONSES = {
+    "hardware_not_detected": (503, f"Hardware scanner not detected. Please ensure the fingerprint scanner is connected to {SCANNER_PORT} and try again."),
+    "first_capture_timeout": (400, "Fingerprint enrollment timeout. Please try again."),
+    "finger_not_removed": (400, "Fingerprint enrollment timeout. Please try again."),
+    "second_capture_timeout": (400, "Fingerprint enrollment timeout. Please try again."),
+    "mismatch": (400, "Fingerprints do not match. Please try enrolling again."),
+    "cancelled": (409, "Fingerprint enrollment was cancelled."),
+    "scanner_busy": (409, SCANNER_BUSY_MESSAGE),
+}
+
+@app.on_event("startup")
+async def start_profiler():
+    slow_request_profiler.start()
+    if audit_log:
+        audit_log.start()
+    if traffic_recorder:
+        traffic_recorder.start()
+    image_store.start()
+    global embedding_index_saver
+    if embedding_index is not None:
+        embedding_index_saver = asyncio.create_task(save_embedding_index_periodically())
+
+@app.on_event("shutdown")
+async def flush_audit_log():
+    if audit_log:
+        audit_log.stop()
+    if traffic_recorder:
+        traffic_recorder.stop()
+    active_enrollment = enrollment_jobs.active()
+    if active_enrollment:
+        active_enrollment.cancel()
+    if capture_pipeline:
+        capture_pipeline.stop()
+    inference_scheduler.stop()
+    if embedding_index_saver is not None:
+        embedding_index_saver.cancel()
+    embedding_index_writer.shutdown(wait=True)  # Add the embeddings still queued before the final save
+    if embedding_index is not None and embedding_index.dirty:
+        embedding_index.save(EMBEDDING_INDEX_PATH)
+    image_store.stop()
+
 #Accessing the models
-model1 = tf.keras.models.load_model("VGG16.h5")
-model2 = tf.keras.models.load_model("MobileNetV2.h5")
+model1 = None
+model2 = None
+prediction_service = None
+embedding_extractor = None
+
+def load_models():
+    """Load both models and the prediction service running them into the module globals"""
+    global model1, model2, prediction_service, embedding_extractor
+    # TensorFlow threading and pinning must be set before the first op runs (no-op if serving.py already did)
+    inference_config.configure()
+    model1 = load_model("VGG16.h5")
+    model2 = load_model("MobileNetV2.h5")
+    prediction_service = PredictionService({"vgg16": model1, "mobilenetv2": model2}, hooks=[MetricsHook()])
+    embedding_extractor = EmbeddingExtractor({"vgg16": model1, "mobilenetv2": model2})
+
+# Loaded on import; when run directly, serving.py loads them in each serving process instead
+if __name__ != "__main__":
+    load_models()
 
 # Blood group labels
-class_labels = ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]
+class_labels = CLASS_LABELS
 
 # Email configuration (dummy data - replace with actual values)
 SMTP_SERVER = "smtp.gmail.com"
@@ -73,45 +286,107 @@ class OTPVerify(BaseModel):
     email: EmailStr
     otp: str
 
-# Preprocessing function
-def preprocess(image):
-    image = image.convert("RGB").resize((128, 128))
-    image = np.array(image) / 255.0
-    image = np.expand_dims(image, axis=0)
-    return image
-
 # Prediction function
 def predict(image):
     if image is None:
         return "No image uploaded."
 
     try:
-        processed = preprocess(image)
+        prediction = prediction_service.predict(image)
+    except InferenceError as e:
+        return f"Prediction failed: {str(e)}"
     except Exception as e:
         return f"Image preprocessing failed: {str(e)}"
 
-    try:
-        pred1 = model1.predict(processed)[0]
-        pred2 = model2.predict(processed)[0]
-    except Exception as e:
-        return f"Prediction failed: {str(e)}"
+    result = prediction.model_result("vgg16", 1) + "\n"
+    # result += prediction.model_result("mobilenetv2", 2) + "\n\n"
+    # result += prediction.agreement
+
+    return result
 
-    idx1 = np.argmax(pred1)
-    idx2 = np.argmax(pred2)
+def audit_prediction(source: str, image_hash: str, prediction):
+    """Append a prediction to the audit log with the stage latencies of the current request"""
+    if audit_log is None:
+        return
+    trace = current_trace()
+    audit_log.record(
+        source=source,
+        image_hash=image_hash,
+        vgg16_probs=prediction.probabilities["vgg16"],
+        mobilenetv2_probs=prediction.probabilities["mobilenetv2"],
+        final_prediction=prediction.final_prediction,
+        stage_seconds=trace.stage_durations() if trace else None,
+        request_id=trace.request_id if trace else None,
+        tta_views=prediction.tta_views,
+    )
 
-    label1 = class_labels[idx1]
-    label2 = class_labels[idx2]
+def overloaded_error(endpoint: str, e: Overloaded) -> HTTPException:
+    record_error(endpoint, "overloaded")
+    return HTTPException(status_code=503, detail=f"Server is overloaded: {str(e)}. Please retry shortly.",
+                         headers={"Retry-After": str(e.retry_after)})
 
-    confidence1 = round(pred1[idx1] * 100, 2)
-    confidence2 = round(pred2[idx2] * 100, 2)
+@contextmanager
+def inference_slot(endpoint: str):
+    """A concurrency limiter slot for the request; 503 with Retry-After while the limit is reached"""
+    try:
+        slot = concurrency_limiter.acquire()
+    except Overloaded as e:
+        raise overloaded_error(endpoint, e)
+    try:
+        yield slot
+    finally:
+        concurrency_limiter.release(slot)
 
-    agreement = "✅ Both models agree!" if label1 == label2 else "⚠️ Models disagree."
+def index_capture(image, image_hash: str, path: str):
+    """Add a capture's embedding to the similarity index in the background, at bulk priority"""
+    if embedding_index is None:
+        return
+    if embedding_index.layer is None:
+        embedding_index.layer = embedding_extractor.layer(EMBEDDING_MODEL)
+    future = inference_scheduler.submit([image], source="embedding_index", priority=BULK,
+                                        run=embedding_extractor.runner(EMBEDDING_MODEL))
+    # The callback runs on the scheduler thread; hand the result over so the index lock never stalls inference
+    future.add_done_callback(
+        lambda done: embedding_index_writer.submit(store_capture_embedding, done, image_hash, path)
+    )
 
-    result = f"Model 1 (VGG16): {label1} ({confidence1}%)\n"
-    # result += f"Model 2 (MobileNetV2): {label2} ({confidence2}%)\n\n"
-    # result += agreement
+def store_capture_embedding(future, image_hash: str, path: str):
+    """Add an index_capture embedding to the index (on the index writer thread)"""
+    if future.exception() is not None:
+        record_error("embedding_index", "embedding_failed")
+        return
+    embedding_index.add(image_hash, future.result()[0], path)
 
-    return result
+def save_embedding_index():
+    """Save the index if it changed and the last save is old enough (on the index writer thread)"""
+    try:
+        embedding_index.save_if_due(EMBEDDING_INDEX_PATH, EMBEDDING_INDEX_SAVE_SECONDS)
+    except OSError as e:
+        record_error("embedding_index", "save_failed")
+        print(f"Embedding index save failed: {e}")
+
+async def save_embedding_index_periodically():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(EMBEDDING_INDEX_SAVE_SECONDS)
+        await loop.run_in_executor(embedding_index_writer, save_embedding_index)
+
+def check_image_quality(image, endpoint: str):
+    """Raise a 422 with the reason when the image fails the quality gate"""
+    if quality_gate is None:
+        return
+    with stage_timer("quality_gate"):
+        quality = quality_gate.check(image)
+    if not quality["passed"]:
+        record_error(endpoint, f"low_quality_{quality['reason']}")
+        raise HTTPException(
+            status_code=422,
+            detail={
+                "message": QUALITY_REASONS[quality["reason"]],
+                "reason": quality["reason"],
+                "scores": quality["scores"],
+            },
+        )
 
 # Email and OTP helper functions
 def send_email(to: str, subject: str, body: str) -> bool:
@@ -124,12 +399,13 @@ def send_email(to: str, subject: str, body: str) -> bool:
         
         msg.attach(MIMEText(body, 'plain'))
         
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(SMTP_USERNAME, to, text)
-        server.quit()
+        with stage_timer("smtp_send"):
+            server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+            server.starttls()
+            server.login(SMTP_USERNAME, SMTP_PASSWORD)
+            text = msg.as_string()
+            server.sendmail(SMTP_USERNAME, to, text)
+            server.quit()
         return True
     except Exception as e:
         print(f"Email sending failed: {e}")
@@ -151,74 +427,279 @@ def cleanup_expired_otps():
 async def root():
     return {"message": "Blood Group Prediction API", "status": "running"}
 
-@app.post("/predict")
-async def predict_blood_group(file: UploadFile = File(...)):
+# Query parameter enabling test-time augmentation: number of augmented views averaged per model (1 = off)
+TTA_QUERY = Query(1, ge=1, le=MAX_TTA_VIEWS, description="Test-time augmentation views per model (1 disables TTA)")
+# Optional response detail: k most likely blood groups per model, and the full 8-class probability vectors
+TOP_K_QUERY = Query(1, ge=1, le=len(CLASS_LABELS), description="Most likely blood groups listed per model (1 = top only)")
+PROBABILITIES_QUERY = Query(False, description="Include each model's probability for every blood group")
+PRIORITY_QUERY = Query(None, pattern="^(interactive|bulk)$",
+                       description="Inference queue: interactive (a patient is waiting) or bulk (batch scoring)")
+
+# The upload is parsed by read_image_upload() rather than an UploadFile parameter, so document it explicitly
+IMAGE_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
+
+# Same for the batch endpoint's repeated "files" field
+BATCH_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}},
+                    "required": ["files"],
+                }
+            }
+        },
+    }
+}
+
+async def read_upload(request: Request, endpoint: str):
+    """Stream the uploaded image, turning rejections into HTTP errors"""
+    try:
+        return await read_image_upload(request, "file", int(MAX_UPLOAD_MB * 1024 * 1024), MAX_IMAGE_SIDE)
+    except UploadRejected as e:
+        record_error(endpoint, e.error)
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+def read_idempotency_key(request: Request, endpoint: str) -> Optional[str]:
+    """The request's Idempotency-Key header, if any"""
+    key = request.headers.get("Idempotency-Key")
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        record_error(endpoint, "invalid_idempotency_key")
+        raise HTTPException(status_code=400,
+                            detail=f"Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+    return key
+
+async def coalesce(endpoint: str, key_type: str, key: str, compute, fingerprint: Optional[str] = None,
+                   store: bool = True):
+    """
+    The JSON response of compute(), run once for concurrent requests with the same key and, with store=True,
+    replayed to later ones while it is kept. Shared responses carry Idempotent-Replayed: true.
+    """
+    try:
+        response, outcome = await request_coalescer.run(f"{endpoint}:{key_type}:{key}", compute, fingerprint, store)
+    except IdempotencyConflict as e:
+        record_error(endpoint, "idempotency_key_reused")
+        raise HTTPException(status_code=422, detail=str(e))
+    if outcome == COMPUTED:
+        return ORJSONResponse(response)
+    record_coalesced(endpoint, key_type, outcome)
+    return ORJSONResponse(response, headers={"Idempotent-Replayed": "true"})
+
+@app.post("/predict", openapi_extra=IMAGE_UPLOAD_OPENAPI)
+async def predict_blood_group(request: Request, tta: int = TTA_QUERY, top_k: int = TOP_K_QUERY,
+                              probabilities: bool = PROBABILITIES_QUERY, priority: Optional[str] = PRIORITY_QUERY):
     """
     Predict blood group from fingerprint image.
 
     Upload a fingerprint image (JPG/PNG) to get blood group predictions from both VGG16 and MobileNetV2 models.
+    The upload is decoded while it streams in; oversized or non-image uploads are rejected after the first chunks.
+    With tta > 1 each model averages its predictions over that many augmented views of the image.
+    top_k > 1 lists each model's k most likely blood groups; probabilities=true adds the full probability vectors.
+    Blank, blurred or partial images are rejected with a 422 and the reason before the models run.
+    Concurrent requests for the same image and options share one prediction while it runs. With an
+    Idempotency-Key header the response is also replayed to retries with that key for
+    BIOPRINT_IDEMPOTENCY_TTL_SECONDS.
+    Inference is queued as interactive unless priority=bulk.
     """
     try:
-        # Validate file type
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
+        idempotency_key = read_idempotency_key(request, "predict")
 
-        # Read image file
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
+        # Stream and decode the upload; type, size, format and dimensions are checked as it arrives
+        with stage_timer("upload_read"):
+            upload = await read_upload(request, "predict")
+        image = upload.image
 
-        # Preprocess the image
-        processed_image = preprocess(image)
+        async def compute():
+            # Reject blank, blurred or partial images before spending inference on them
+            check_image_quality(image, "predict")
 
-        # Get predictions from both models
-        try:
-            pred1 = model1.predict(processed_image)[0]  # VGG16
-            pred2 = model2.predict(processed_image)[0]  # MobileNetV2
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Model prediction failed: {str(e)}")
+            # Preprocess, run both models and build the response
+            with inference_slot("predict") as slot:
+                try:
+                    with slot.measure():
+                        prediction = (await inference_scheduler.predict_many(
+                            [image], tta, source="upload", priority=priority or INTERACTIVE
+                        ))[0]
+                except InferenceError as e:
+                    record_error("predict", "model_prediction_failed")
+                    raise HTTPException(status_code=500, detail=f"Model prediction failed: {str(e)}")
 
-        # Get results for both models
-        idx1 = np.argmax(pred1)
-        idx2 = np.argmax(pred2)
+            response = prediction_service.build_response(prediction, top_k, probabilities)
+            audit_prediction("upload", upload.sha256, prediction)
+            return response
 
-        blood_group1 = class_labels[idx1]  # VGG16 prediction
-        blood_group2 = class_labels[idx2]  # MobileNetV2 prediction
+        # Serialized directly with orjson, skipping FastAPI's recursive jsonable_encoder pass
+        options = f"tta={tta}:top_k={top_k}:probabilities={probabilities}"
+        if idempotency_key is not None:
+            # A key reused for another image or other options is rejected with a 422
+            return await coalesce("predict", "idempotency_key", idempotency_key, compute,
+                                  fingerprint=f"{upload.sha256}:{options}")
+        # Without a key identical requests only share a prediction in flight; every later one is audited afresh
+        return await coalesce("predict", "image_hash", f"{upload.sha256}:{options}", compute, store=False)
 
-        confidence1 = round(pred1[idx1] * 100, 2)  # VGG16 confidence
-        confidence2 = round(pred2[idx2] * 100, 2)  # MobileNetV2 confidence
+    except HTTPException:
+        raise
+    except Exception as e:
+        record_error("predict", "prediction_failed")
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+@app.post("/predict-batch", openapi_extra=BATCH_UPLOAD_OPENAPI)
+async def predict_blood_group_batch(request: Request, tta: int = TTA_QUERY, top_k: int = TOP_K_QUERY,
+                                    probabilities: bool = PROBABILITIES_QUERY,
+                                    priority: Optional[str] = PRIORITY_QUERY):
+    """
+    Predict blood groups for several fingerprint images in one request.
+
+    Upload up to BIOPRINT_MAX_BATCH_FILES images in the repeated "files" field. Both models run once on the whole
+    batch. Results are returned in upload order, each shaped like a /predict response plus its filename; images
+    rejected by the quality gate get "success": false with the reason instead.
+    Inference is queued as bulk unless priority=interactive, so it yields to live scanner requests.
+    """
+    try:
+        with stage_timer("upload_read"):
+            try:
+                uploads = await read_image_uploads(
+                    request, "files", MAX_BATCH_FILES, int(MAX_BATCH_UPLOAD_MB * 1024 * 1024),
+                    int(MAX_UPLOAD_MB * 1024 * 1024), MAX_IMAGE_SIDE,
+                )
+            except UploadRejected as e:
+                record_error("predict_batch", e.error)
+                raise HTTPException(status_code=e.status_code, detail=e.detail)
 
-        # Check agreement between models
-        agreement = "✅ Both models agree!" if blood_group1 == blood_group2 else "⚠️ Models disagree."
+        results = [None] * len(uploads)
+        accepted = []
+        for position, upload in enumerate(uploads):
+            try:
+                check_image_quality(upload.image, "predict_batch")
+                accepted.append(position)
+            except HTTPException as e:
+                results[position] = {"filename": upload.filename, "success": False, "status": e.status_code,
+                                     "detail": e.detail}
 
-        # Create formatted results for backward compatibility
-        vgg16_result = f"Model 1 (VGG16): {blood_group1} ({confidence1}%)"
-        mobilenet_result = f"Model 2 (MobileNetV2): {blood_group2} ({confidence2}%)"
-        raw_result = f"{vgg16_result}\n{mobilenet_result}\n\n{agreement}"
+        if accepted:
+            # Holds a slot, but its latency is not sampled: it grows with the number of images
+            try:
+                with inference_slot("predict_batch"):
+                    predictions = await inference_scheduler.predict_many(
+                        [uploads[position].image for position in accepted], tta, source="upload_batch",
+                        priority=priority or BULK,
+                    )
+            except InferenceError as e:
+                record_error("predict_batch", "model_prediction_failed")
+                raise HTTPException(status_code=500, detail=f"Model prediction failed: {str(e)}")
+            for position, prediction in zip(accepted, predictions):
+                upload = uploads[position]
+                results[position] = {"filename": upload.filename,
+                                     **prediction_service.build_response(prediction, top_k, probabilities)}
+                audit_prediction("upload_batch", upload.sha256, prediction)
 
-        return {
-            "success": True,
-            "predictions": {
-                "vgg16": {
-                    "blood_group": blood_group1,
-                    "confidence": confidence1,
-                    "model": "VGG16"
-                },
-                "mobilenetv2": {
-                    "blood_group": blood_group2,
-                    "confidence": confidence2,
-                    "model": "MobileNetV2"
-                },
-                "agreement": agreement,
-                "final_prediction": blood_group1 if blood_group1 == blood_group2 else "Needs verification"
-            },
-            "raw_result": raw_result
-        }
+        return ORJSONResponse({"success": True, "count": len(results), "predicted": len(accepted), "results": results})
 
     except HTTPException:
         raise
     except Exception as e:
+        record_error("predict_batch", "prediction_failed")
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
+EMBEDDING_MODEL_QUERY = Query(EMBEDDING_MODEL, pattern="^(vgg16|mobilenetv2)$",
+                              description="Model whose penultimate layer gives the embedding")
+
+async def embed_upload(upload, model: str, priority: Optional[str], endpoint: str):
+    """Embedding of an uploaded image, computed on the inference scheduler"""
+    try:
+        with inference_slot(endpoint) as slot, slot.measure():
+            return (await inference_scheduler.predict_many(
+                [upload.image], source=endpoint, priority=priority or INTERACTIVE,
+                run=embedding_extractor.runner(model),
+            ))[0]
+    except HTTPException:
+        raise
+    except ValueError as e:
+        record_error(endpoint, "embedding_unavailable")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        record_error(endpoint, "embedding_failed")
+        raise HTTPException(status_code=500, detail=f"Embedding extraction failed: {str(e)}")
+
+@app.post("/embed", openapi_extra=IMAGE_UPLOAD_OPENAPI)
+async def embed_fingerprint(request: Request, model: str = EMBEDDING_MODEL_QUERY,
+                            priority: Optional[str] = PRIORITY_QUERY):
+    """
+    Penultimate-layer embedding of a fingerprint image.
+
+    Returns the L2-normalized input of the model's softmax layer (the dot product of two embeddings is their
+    cosine similarity).
+    """
+    with stage_timer("upload_read"):
+        upload = await read_upload(request, "embed")
+    embedding = await embed_upload(upload, model, priority, "embed")
+    return ORJSONResponse({
+        "success": True,
+        "model": model,
+        "layer": embedding_extractor.layer(model),
+        "dimensions": len(embedding),
+        "image_sha256": upload.sha256,
+        "embedding": embedding.tolist(),
+    })
+
+@app.post("/similar", openapi_extra=IMAGE_UPLOAD_OPENAPI)
+async def similar_fingerprints(request: Request, k: int = Query(5, ge=1, le=100, description="Matches returned"),
+                               mode: str = Query("exact", pattern="^(exact|ivf)$",
+                                                 description="exact (every capture) or ivf (nearest cells only)"),
+                               nprobe: int = Query(8, ge=1, description="IVF cells searched"),
+                               priority: Optional[str] = PRIORITY_QUERY):
+    """
+    Prior captures most similar to a fingerprint image, from the embedding index.
+
+    Captures from /capture-and-predict are indexed in the background. Matches with a similarity of at least
+    BIOPRINT_NEAR_DUPLICATE_SIMILARITY are flagged as near-duplicates. mode=ivf needs an index trained with
+    `python embedding_index.py train` and falls back to exact search otherwise.
+    """
+    if embedding_index is None:
+        record_error("similar", "index_disabled")
+        raise HTTPException(status_code=503, detail="The embedding index is disabled (BIOPRINT_EMBEDDING_INDEX)")
+    with stage_timer("upload_read"):
+        upload = await read_upload(request, "similar")
+    embedding = await embed_upload(upload, embedding_index.model, priority, "similar")
+    with stage_timer("similarity_search"):
+        matches = embedding_index.search(embedding, k, mode, nprobe)
+    results = [
+        {
+            "image_sha256": image_hash,
+            "path": image_store.resolve(image_hash) or path,
+            "similarity": round(similarity, 4),
+            "near_duplicate": similarity >= NEAR_DUPLICATE_SIMILARITY,
+        }
+        for image_hash, path, similarity in matches
+    ]
+    return ORJSONResponse({
+        "success": True,
+        "model": embedding_index.model,
+        "image_sha256": upload.sha256,
+        "indexed_images": len(embedding_index),
+        "mode": mode if embedding_index.centroids is not None else "exact",
+        "near_duplicate": any(result["near_duplicate"] for result in results),
+        "matches": results,
+    })
+
 # New API endpoints for BioPrint system
 
 @app.post("/send-email")
@@ -239,6 +720,7 @@ async def send_email_endpoint(email_data: EmailRequest):
                 "message": "Email sent successfully"
             }
         else:
+            record_error("send_email", "smtp_failed")
             raise HTTPException(status_code=500, detail="Failed to send email")
             
     except Exception as e:
@@ -290,6 +772,7 @@ async def send_otp_endpoint(otp_request: OTPRequest):
             # Remove OTP if email sending failed
             if email in otp_storage:
                 del otp_storage[email]
+            record_error("send_otp", "smtp_failed")
             raise HTTPException(status_code=500, detail="Failed to send OTP")
             
     except HTTPException:
@@ -311,6 +794,7 @@ async def verify_otp_endpoint(verify_data: OTPVerify):
         cleanup_expired_otps()
         
         if email not in otp_storage:
+            record_error("verify_otp", "otp_not_found")
             raise HTTPException(status_code=400, detail="OTP not found or expired")
         
         stored_data = otp_storage[email]
@@ -318,11 +802,13 @@ async def verify_otp_endpoint(verify_data: OTPVerify):
         # Check if OTP is expired
         if time.time() > stored_data["expires_at"]:
             del otp_storage[email]
+            record_error("verify_otp", "otp_expired")
             raise HTTPException(status_code=400, detail="OTP expired")
         
         # Check attempts limit (max 3 attempts)
         if stored_data["attempts"] >= 3:
             del otp_storage[email]
+            record_error("verify_otp", "otp_too_many_attempts")
             raise HTTPException(status_code=400, detail="Too many attempts. OTP has been invalidated.")
         
         # Verify OTP
@@ -336,6 +822,7 @@ async def verify_otp_endpoint(verify_data: OTPVerify):
         else:
             # Increment attempts
             otp_storage[email]["attempts"] += 1
+            record_error("verify_otp", "otp_invalid")
             remaining_attempts = 3 - otp_storage[email]["attempts"]
             if remaining_attempts > 0:
                 raise HTTPException(
@@ -354,26 +841,102 @@ async def verify_otp_endpoint(verify_data: OTPVerify):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def capture_to_store():
+    """One capture saved into the image store (blocking; the pipeline's capture stage or a threadpool call)"""
+    with scanner_in_use():
+        # Initialize fingerprint scanner on the configured port and baud rates
+        capture = R307FingerprintCaptureLibrary(image_store=image_store)
+        return capture.capture_and_save(timeout=10)
+
+def predict_captures(images, tta_views: int):
+    """The capture pipeline's inference stage; one limiter slot per model pass, none during the capture"""
+    with concurrency_limiter.slot() as slot, slot.measure():
+        return inference_scheduler.submit(images, tta_views, source="hardware_scanner").result()
+
+capture_pipeline = CapturePipeline(
+    capture=capture_to_store,
+    predict_many=predict_captures,
+    check=lambda image: check_image_quality(image, "capture_and_predict"),
+    queue_size=CAPTURE_QUEUE_SIZE,
+) if CAPTURE_PIPELINE_ENABLED else None
+
+async def capture_and_predict_pipelined(tta: int, top_k: int, probabilities: bool):
+    """/capture-and-predict through the capture pipeline; waits for the ticket without blocking the server"""
+    try:
+        ticket = capture_pipeline.submit(tta)
+    except PipelineFull as e:
+        record_error("capture_and_predict", "station_busy")
+        raise HTTPException(status_code=503, detail=f"Scanner station is busy: {str(e)}")
+    
+    try:
+        await asyncio.wrap_future(ticket.future)
+    except HTTPException:
+        raise  # Rejected by the quality gate
+    except ScannerBusy as e:
+        record_error("capture_and_predict", "scanner_busy")
+        raise HTTPException(status_code=409, detail=str(e))
+    except Overloaded as e:
+        raise overloaded_error("capture_and_predict", e)
+    except CaptureFailed as e:
+        record_error("capture_and_predict", e.error)
+        raise HTTPException(status_code=400 if e.error == "no_fingerprint" else 500, detail=e.detail)
+    except InferenceError as e:
+        record_error("capture_and_predict", "model_prediction_failed")
+        raise HTTPException(status_code=500, detail=f"Model prediction failed: {str(e)}")
+    except Exception as e:
+        record_error("capture_and_predict", "capture_failed")
+        raise HTTPException(status_code=500, detail=f"Fingerprint capture and prediction failed: {str(e)}")
+    
+    # image_path changes once the store compresses the BMP; image_sha256 resolves it later (GET /images/{hash})
+    image_hash = file_sha256(ticket.filename)
+    response = prediction_service.build_response(
+        ticket.prediction, top_k, probabilities, source="hardware_scanner", image_path=ticket.filename,
+        image_sha256=image_hash,
+    )
+    audit_prediction("hardware_scanner", image_hash, ticket.prediction)
+    index_capture(ticket.image, image_hash, ticket.filename)
+    return response
+
 @app.post("/capture-and-predict")
-async def capture_and_predict_blood_group():
+async def capture_and_predict_blood_group(request: Request, tta: int = TTA_QUERY, top_k: int = TOP_K_QUERY,
+                                          probabilities: bool = PROBABILITIES_QUERY):
     """
     Capture fingerprint from hardware scanner and predict blood group.
     
     This endpoint:
-    1. Connects to the R307S fingerprint scanner (COM7, 57600 baud)
+    1. Connects to the R307S fingerprint scanner (BIOPRINT_SCANNER_PORT, default COM7 at 57600 baud)
     2. Captures fingerprint image (10 second timeout)
-    3. Saves as BMP file
-    4. Processes through VGG16 and MobileNetV2 models
+    3. Saves as BMP file in the image store (deduplicated, compressed losslessly in the background)
+    4. Processes through VGG16 and MobileNetV2 models (averaged over tta augmented views when tta > 1)
     5. Returns blood group predictions
+    
+    With BIOPRINT_CAPTURE_PIPELINE=1 the steps run as pipeline stages (see capture_pipeline.py), so
+    concurrent requests overlap the next capture with the previous prediction.
+    
+    A retry sent with the same Idempotency-Key header gets the first request's result (waiting for it
+    if it is still running) instead of asking for another capture.
     """
+    idempotency_key = read_idempotency_key(request, "capture_and_predict")
+    
+    async def compute():
+        # The limiter slot covers the inference only, not the wait for a finger
+        if capture_pipeline is not None:
+            return await capture_and_predict_pipelined(tta, top_k, probabilities)
+        return await capture_and_predict_sequential(tta, top_k, probabilities)
+    
+    if idempotency_key is None:
+        return ORJSONResponse(await compute())
+    return await coalesce("capture_and_predict", "idempotency_key", idempotency_key, compute,
+                          fingerprint=f"tta={tta}:top_k={top_k}:probabilities={probabilities}")
+
+async def capture_and_predict_sequential(tta: int, top_k: int, probabilities: bool):
+    """/capture-and-predict with capture, decode and inference run one after the other"""
     try:
-        # Initialize fingerprint scanner with hardcoded settings
-        capture = R307FingerprintCaptureLibrary(port='COM7', baudrate=57600)
-        
-        # Capture fingerprint with 10 second timeout
-        filename = capture.capture_and_save(timeout=10)
+        # Capture fingerprint with 10 second timeout, off the event loop
+        filename = await run_in_threadpool(capture_to_store)
         
         if filename is None:
+            record_error("capture_and_predict", "no_fingerprint")
             raise HTTPException(
                 status_code=400, 
                 detail="No fingerprint detected please try again"
@@ -381,6 +944,7 @@ async def capture_and_predict_blood_group():
         
         # Check if file exists
         if not os.path.exists(filename):
+            record_error("capture_and_predict", "image_not_saved")
             raise HTTPException(
                 status_code=500,
                 detail="Fingerprint file was not saved correctly. Please try again."
@@ -388,138 +952,200 @@ async def capture_and_predict_blood_group():
         
         # Read and process the BMP image
         try:
-            image = Image.open(filename)
+            with stage_timer("image_open"):
+                image = Image.open(filename)
         except Exception as e:
+            record_error("capture_and_predict", "image_read_failed")
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to read fingerprint image: {str(e)}"
             )
         
-        # Preprocess the image
-        processed_image = preprocess(image)
+        # Reject blank, smudged or partial captures before spending inference on them
+        check_image_quality(image, "capture_and_predict")
         
-        # Get predictions from both models
+        # Preprocess, run both models and build the response
         try:
-            pred1 = model1.predict(processed_image)[0]  # VGG16
-            pred2 = model2.predict(processed_image)[0]  # MobileNetV2
-        except Exception as e:
+            with inference_slot("capture_and_predict") as slot, slot.measure():
+                prediction = (await inference_scheduler.predict_many([image], tta, source="hardware_scanner"))[0]
+        except InferenceError as e:
+            record_error("capture_and_predict", "model_prediction_failed")
             raise HTTPException(status_code=500, detail=f"Model prediction failed: {str(e)}")
         
-        # Get results for both models
-        idx1 = np.argmax(pred1)
-        idx2 = np.argmax(pred2)
-        
-        blood_group1 = class_labels[idx1]  # VGG16 prediction
-        blood_group2 = class_labels[idx2]  # MobileNetV2 prediction
-        
-        confidence1 = round(pred1[idx1] * 100, 2)  # VGG16 confidence
-        confidence2 = round(pred2[idx2] * 100, 2)  # MobileNetV2 confidence
-        
-        # Check agreement between models
-        agreement = "✅ Both models agree!" if blood_group1 == blood_group2 else "⚠️ Models disagree."
-        
-        # Create formatted results for backward compatibility
-        vgg16_result = f"Model 1 (VGG16): {blood_group1} ({confidence1}%)"
-        mobilenet_result = f"Model 2 (MobileNetV2): {blood_group2} ({confidence2}%)"
-        raw_result = f"{vgg16_result}\n{mobilenet_result}\n\n{agreement}"
-        
-        return {
-            "success": True,
-            "predictions": {
-                "vgg16": {
-                    "blood_group": blood_group1,
-                    "confidence": confidence1,
-                    "model": "VGG16"
-                },
-                "mobilenetv2": {
-                    "blood_group": blood_group2,
-                    "confidence": confidence2,
-                    "model": "MobileNetV2"
-                },
-                "agreement": agreement,
-                "final_prediction": blood_group1 if blood_group1 == blood_group2 else "Needs verification"
-            },
-            "raw_result": raw_result,
-            "source": "hardware_scanner",
-            "image_path": filename
-        }
+        # image_path changes once the store compresses the BMP; image_sha256 resolves it later (GET /images/{hash})
+        image_hash = file_sha256(filename)
+        response = prediction_service.build_response(
+            prediction, top_k, probabilities, source="hardware_scanner", image_path=filename,
+            image_sha256=image_hash,
+        )
+        audit_prediction("hardware_scanner", image_hash, prediction)
+        index_capture(image, image_hash, filename)
+        return response
         
     except HTTPException:
         raise
+    except ScannerBusy as e:
+        record_error("capture_and_predict", "scanner_busy")
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         # Handle hardware connection errors
         error_message = str(e).lower()
         if "no such file or directory" in error_message or "cannot open" in error_message or "com" in error_message.lower():
+            record_error("capture_and_predict", "hardware_not_detected")
             raise HTTPException(
                 status_code=503,
-                detail="Hardware scanner not detected. Please ensure the fingerprint scanner is connected to COM7 and try again."
+                detail=f"Hardware scanner not detected. Please ensure the fingerprint scanner is connected to {SCANNER_PORT} and try again."
             )
         elif "timeout" in error_message.lower():
+            record_error("capture_and_predict", "capture_timeout")
             raise HTTPException(
                 status_code=400,
                 detail="No fingerprint detected please try again"
             )
         else:
+            record_error("capture_and_predict", "capture_failed")
             raise HTTPException(
                 status_code=500, 
                 detail=f"Fingerprint capture and prediction failed: {str(e)}"
             )
 
+@app.get("/images/{image_sha256}")
+async def resolve_stored_image(image_sha256: str):
+    """
+    Current path of a captured image in the image store.
+    
+    The image_path returned by /capture-and-predict points at the BMP, which the store re-encodes
+    (and renames) about a minute after the capture; the image_sha256 returned alongside stays valid.
+    """
+    path = image_store.resolve(image_sha256.lower())
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Image {image_sha256} is not in the image store")
+    return {"image_sha256": image_sha256.lower(), "image_path": path}
+
+def run_enrollment(on_stage, cancel):
+    """Enrollment job body: runs the scanner library's enrollment on the job's worker thread"""
+    try:
+        with scanner_in_use():
+            # Initialize fingerprint scanner on the configured port and baud rates
+            capture = R307FingerprintCaptureLibrary()
+            slot_number = capture.enroll_fingerprint(timeout=ENROLL_TIMEOUT, on_stage=on_stage, cancel=cancel)
+    except ScannerBusy:
+        record_error("enroll_fingerprint", "scanner_busy")
+        return None, "scanner_busy"
+    if slot_number is None and capture.enroll_error != "cancelled":
+        record_error("enroll_fingerprint", ENROLL_ERROR_TYPES.get(capture.enroll_error, "enroll_failed"))
+    return slot_number, capture.enroll_error
+
+enrollment_jobs = EnrollmentJobs(run_enrollment, {**ENROLL_ERRORS, "scanner_busy": SCANNER_BUSY_MESSAGE},
+                                 keep_seconds=ENROLL_JOB_KEEP_SECONDS)
+
+def start_enrollment_job():
+    # Refuse up front while a capture or search holds the scanner (run_enrollment still checks, for races)
+    if scanner_lock.locked() and enrollment_jobs.active() is None:
+        record_error("enroll_fingerprint", "scanner_busy")
+        raise HTTPException(status_code=409, detail=SCANNER_BUSY_MESSAGE)
+    try:
+        return enrollment_jobs.start()
+    except EnrollmentBusy as e:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Another enrollment is in progress on the scanner", "job_id": e.job.id}
+        )
+
+def get_enrollment_job(job_id: str):
+    job = enrollment_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Enrollment job {job_id} not found")
+    return job
+
 @app.post("/enroll-fingerprint")
 async def enroll_fingerprint_endpoint():
     """
     Enroll a new fingerprint in the R307S module.
     
     This endpoint:
-    1. Connects to the fingerprint scanner (COM7, 57600 baud)
+    1. Connects to the fingerprint scanner (BIOPRINT_SCANNER_PORT, default COM7 at 57600 baud)
     2. Captures fingerprint twice for verification
     3. Stores fingerprint in the module
     4. Returns the slot number where fingerprint is stored
+    
+    The enrollment runs as a background job (see /enroll-fingerprint/jobs); this endpoint waits for it
+    without blocking the server. Use the job endpoints for progress events and cancellation.
     """
+    job = start_enrollment_job()
     try:
-        # Initialize fingerprint scanner with hardcoded settings
-        capture = R307FingerprintCaptureLibrary(port='COM7', baudrate=57600)
-        
-        # Enroll fingerprint with 10 second timeout per capture
-        slot_number = capture.enroll_fingerprint(timeout=10)
-        print(slot_number)
-        if slot_number is None:
-            raise HTTPException(
-                status_code=400,
-                detail="Fingerprint enrollment failed. Please ensure the sensor is connected and try again."
-            )
-        
+        await job.wait()
+    except asyncio.CancelledError:
+        # The client went away; free the sensor
+        job.cancel()
+        raise
+    
+    if job.stage == "stored":
         return {
             "success": True,
-            "slot_number": slot_number,
-            "message": f"Fingerprint enrolled successfully in slot {slot_number}"
+            "slot_number": job.slot_number,
+            "message": f"Fingerprint enrolled successfully in slot {job.slot_number}"
         }
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        # Handle hardware connection errors
-        error_message = str(e).lower()
-        if "no such file or directory" in error_message or "cannot open" in error_message or "com" in error_message.lower():
-            raise HTTPException(
-                status_code=503,
-                detail="Hardware scanner not detected. Please ensure the fingerprint scanner is connected to COM7 and try again."
-            )
-        elif "timeout" in error_message.lower():
-            raise HTTPException(
-                status_code=400,
-                detail="Fingerprint enrollment timeout. Please try again."
-            )
-        elif "do not match" in error_message.lower():
-            raise HTTPException(
-                status_code=400,
-                detail="Fingerprints do not match. Please try enrolling again."
-            )
-        else:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Fingerprint enrollment failed: {str(e)}"
-            )
+    
+    status_code, detail = ENROLL_ERROR_RESPONSES.get(
+        job.error, (500, "Fingerprint enrollment failed. Please ensure the sensor is connected and try again.")
+    )
+    raise HTTPException(status_code=status_code, detail=detail)
+
+@app.post("/enroll-fingerprint/jobs", status_code=202)
+async def start_enrollment():
+    """
+    Start an enrollment in the background and return its job id.
+    
+    Follow it with GET /enroll-fingerprint/jobs/{job_id}/events (server-sent events) or by polling
+    GET /enroll-fingerprint/jobs/{job_id}; cancel it with DELETE /enroll-fingerprint/jobs/{job_id}.
+    Only one enrollment runs at a time (409 while another is in progress, or while a capture or search
+    is using the scanner).
+    """
+    job = start_enrollment_job()
+    response = job.to_dict()
+    response["events_url"] = f"/enroll-fingerprint/jobs/{job.id}/events"
+    return response
+
+@app.get("/enroll-fingerprint/jobs/{job_id}")
+async def enrollment_status(job_id: str):
+    """Current stage of an enrollment job"""
+    return get_enrollment_job(job_id).to_dict()
+
+@app.get("/enroll-fingerprint/jobs/{job_id}/events")
+async def enrollment_events(job_id: str, request: Request):
+    """
+    Server-sent events for each stage of an enrollment job, ending with stored, failed or cancelled.
+    
+    Past events are replayed first; reconnecting clients send Last-Event-ID to skip the ones they have.
+    """
+    job = get_enrollment_job(job_id)
+    last_event_id = request.headers.get("last-event-id", "")
+    after = int(last_event_id) if last_event_id.isdigit() else 0
+    
+    async def stream():
+        async for event in job.subscribe(after, heartbeat=ENROLL_SSE_HEARTBEAT_SECONDS):
+            yield format_sse(event)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.delete("/enroll-fingerprint/jobs/{job_id}")
+async def cancel_enrollment(job_id: str):
+    """Cancel an enrollment job; the scanner is released at its next poll"""
+    job = get_enrollment_job(job_id)
+    job.cancel()
+    return job.to_dict()
+
+def search_on_scanner():
+    """One search of the module's database (blocking, holds the scanner)"""
+    with scanner_in_use():
+        # Initialize fingerprint scanner on the configured port and baud rates
+        capture = R307FingerprintCaptureLibrary()
+        return capture.search_fingerprint(timeout=10)
 
 @app.post("/search-fingerprint")
 async def search_fingerprint_endpoint():
@@ -527,17 +1153,16 @@ async def search_fingerprint_endpoint():
     Search for a fingerprint in the R307S module.
     
     This endpoint:
-    1. Connects to the fingerprint scanner (COM7, 57600 baud)
+    1. Connects to the fingerprint scanner (BIOPRINT_SCANNER_PORT, default COM7 at 57600 baud)
     2. Captures fingerprint from sensor
     3. Searches the module's database for a match
     4. Returns the slot number if found
+    
+    409 while an enrollment, capture or other search is using the scanner.
     """
     try:
-        # Initialize fingerprint scanner with hardcoded settings
-        capture = R307FingerprintCaptureLibrary(port='COM7', baudrate=57600)
-        
-        # Search for fingerprint with 10 second timeout
-        slot_number = capture.search_fingerprint(timeout=10)
+        # Search for fingerprint with 10 second timeout, off the event loop
+        slot_number = await run_in_threadpool(search_on_scanner)
         
         if slot_number is None:
             return {
@@ -554,20 +1179,26 @@ async def search_fingerprint_endpoint():
         
     except HTTPException:
         raise
+    except ScannerBusy as e:
+        record_error("search_fingerprint", "scanner_busy")
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         # Handle hardware connection errors
         error_message = str(e).lower()
         if "no such file or directory" in error_message or "cannot open" in error_message or "com" in error_message.lower():
+            record_error("search_fingerprint", "hardware_not_detected")
             raise HTTPException(
                 status_code=503,
-                detail="Hardware scanner not detected. Please ensure the fingerprint scanner is connected to COM7 and try again."
+                detail=f"Hardware scanner not detected. Please ensure the fingerprint scanner is connected to {SCANNER_PORT} and try again."
             )
         elif "timeout" in error_message.lower():
+            record_error("search_fingerprint", "capture_timeout")
             raise HTTPException(
                 status_code=400,
                 detail="Fingerprint capture timeout. Please try again."
             )
         else:
+            record_error("search_fingerprint", "search_failed")
             raise HTTPException(
                 status_code=500,
                 detail=f"Fingerprint search failed: {str(e)}"
@@ -589,8 +1220,26 @@ async def health_check():
         "models_loaded": {
             "vgg16": model1 is not None,
             "mobilenetv2": model2 is not None
-        }
+        },
+        "inference": inference_config.active_config().to_dict() if inference_config.active_config() else None,
+        "image_store": image_store.stats(),
+        "quality_gate": quality_gate.to_dict() if quality_gate else None,
+        "enrollment": enrollment_jobs.stats(),
+        "capture_pipeline": capture_pipeline.stats() if capture_pipeline else None,
+        "idempotency": request_coalescer.stats(),
+        "scheduler": inference_scheduler.stats(),
+        "embedding_index": embedding_index.stats() if embedding_index is not None else None,
+        "concurrency": concurrency_limiter.stats()
     }
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus metrics: per-stage latency histograms, model disagreement and error counters.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Flags: --workers, --intra-op-threads, --inter-op-threads, --pin-cores (see serving.py)
+    success = serving.main(app, load_models)
+    exit(0 if success else 1)
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Prediction audit log for the BioPrint API
+
+Every prediction appends one record: timestamp, request id, source
+(upload/hardware_scanner), SHA-256 of the image, both models' full probability
+vectors, TTA views, per-stage latencies from the request trace and the final
+prediction.
+
+record() only appends to an in-memory buffer. A background thread writes the
+buffer as a columnar segment (one NumPy array per column in an uncompressed .npz)
+every flush_seconds, or sooner once flush_rows records are buffered. Queries load only the columns they need
+and aggregate them with vectorized NumPy, so scanning millions of rows takes well
+under a second once small segments have been merged with `compact`.
+
+Query examples:
+  python audit_log.py summary
+  python audit_log.py disagreement --by hour --since 2024-01-01
+  python audit_log.py confidence --bins 10 --source hardware_scanner
+  python audit_log.py compact
+"""
+
+import argparse
+import glob
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PATTERN = "audit_*.npz"
+# Columns every segment holds; stage latencies are stored as stage_ms (rows x stages) plus stage_names
+COLUMNS = ("timestamp", "request_id", "source", "image_hash", "vgg16_probs", "mobilenetv2_probs",
+           "tta_views", "final_prediction")
+
+
+class AuditLog:
+    """Buffers prediction records and writes them as columnar segments from a background thread"""
+
+    def __init__(self, directory: str, flush_rows: int = 1000, flush_seconds: float = 5.0):
+        self.directory = directory
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._sequence = 0
+
+    def start(self):
+        if self._thread is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the writer and flush what is buffered"""
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def record(self, source: str, image_hash: str, vgg16_probs, mobilenetv2_probs, final_prediction: str,
+               stage_seconds: Optional[Dict[str, float]] = None, request_id: Optional[str] = None,
+               tta_views: int = 1):
+        """Queue one prediction record; never blocks on disk"""
+        entry = {
+            "timestamp": time.time(),
+            "request_id": request_id or "",
+            "source": source,
+            "image_hash": image_hash,
+            "vgg16_probs": vgg16_probs,
+            "mobilenetv2_probs": mobilenetv2_probs,
+            "tta_views": tta_views,
+            "final_prediction": final_prediction,
+            "stage_seconds": stage_seconds or {},
+        }
+        with self._lock:
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.flush_rows
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write audit log segment: {e}")
+
+    def flush(self) -> Optional[str]:
+        """Write buffered records as one segment; returns its path"""
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+            self._sequence += 1
+            sequence = self._sequence
+        if not entries:
+            return None
+
+        stage_names = sorted({name for entry in entries for name in entry["stage_seconds"]})
+        stage_ms = np.full((len(entries), len(stage_names)), np.nan, dtype=np.float32)
+        for row, entry in enumerate(entries):
+            for column, name in enumerate(stage_names):
+                if name in entry["stage_seconds"]:
+                    stage_ms[row, column] = entry["stage_seconds"][name] * 1000
+
+        columns = {
+            "timestamp": np.array([entry["timestamp"] for entry in entries], dtype=np.float64),
+            "request_id": np.array([entry["request_id"] for entry in entries], dtype="U"),
+            "source": np.array([entry["source"] for entry in entries], dtype="U"),
+            "image_hash": np.array([entry["image_hash"] for entry in entries], dtype="U64"),
+            "vgg16_probs": np.array([entry["vgg16_probs"] for entry in entries], dtype=np.float32),
+            "mobilenetv2_probs": np.array([entry["mobilenetv2_probs"] for entry in entries], dtype=np.float32),
+            "tta_views": np.array([entry["tta_views"] for entry in entries], dtype=np.int16),
+            "final_prediction": np.array([entry["final_prediction"] for entry in entries], dtype="U"),
+            "stage_names": np.array(stage_names, dtype="U"),
+            "stage_ms": stage_ms,
+        }
+        stamp = datetime.fromtimestamp(entries[0]["timestamp"]).strftime("%Y%m%d_%H%M%S_%f")
+        return write_segment(self.directory, f"audit_{stamp}_{os.getpid()}_{sequence:06d}.npz", columns)
+
+
+def write_segment(directory: str, filename: str, columns: Dict[str, np.ndarray]) -> str:
+    """Atomically write a segment so readers never see a partial file"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, filename)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        np.savez(f, **columns)
+    os.replace(temporary_path, path)
+    return path
+
+
+def segment_paths(directory: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(directory, SEGMENT_PATTERN)))
+
+
+def load_columns(directory: str, columns: Sequence[str] = COLUMNS, since: Optional[float] = None,
+                 until: Optional[float] = None, source: Optional[str] = None,
+                 paths: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    Concatenate the requested columns of every segment (or of `paths`), optionally filtered by time and source.
+    Requesting "stage_ms" also returns "stage_names"; stages missing from a segment are NaN.
+    """
+    wanted = set(columns) | {"timestamp"}
+    if source:
+        wanted.add("source")
+    with_stages = "stage_ms" in wanted
+    wanted.discard("stage_ms")
+    wanted.discard("stage_names")
+
+    parts: Dict[str, List[np.ndarray]] = {name: [] for name in wanted}
+    stage_parts = []
+    for path in segment_paths(directory) if paths is None else paths:
+        with np.load(path) as segment:
+            timestamps = segment["timestamp"]
+            mask = np.ones(len(timestamps), dtype=bool)
+            if since is not None:
+                mask &= timestamps >= since
+            if until is not None:
+                mask &= timestamps < until
+            if source:
+                mask &= segment["source"] == source
+            if not mask.any():
+                continue
+            for name in wanted:
+                parts[name].append(segment[name][mask])
+            if with_stages:
+                stage_parts.append((list(segment["stage_names"]), segment["stage_ms"][mask]))
+
+    result = {}
+    for name, arrays in parts.items():
+        result[name] = np.concatenate(arrays) if arrays else np.array([])
+    if with_stages:
+        stage_names = sorted({name for names, _ in stage_parts for name in names})
+        index = {name: column for column, name in enumerate(stage_names)}
+        blocks = []
+        for names, values in stage_parts:
+            block = np.full((len(values), len(stage_names)), np.nan, dtype=np.float32)
+            block[:, [index[name] for name in names]] = values
+            blocks.append(block)
+        result["stage_names"] = np.array(stage_names, dtype="U")
+        result["stage_ms"] = np.concatenate(blocks) if blocks else np.empty((0, len(stage_names)), np.float32)
+    return result
+
+
+def disagreement_by_period(data: Dict[str, np.ndarray], by: str = "hour") -> List[Dict]:
+    """Prediction count and model disagreement rate per period (hour, day or local hour-of-day)"""
+    if not len(data["timestamp"]):
+        return []
+    disagree = data["vgg16_probs"].argmax(axis=1) != data["mobilenetv2_probs"].argmax(axis=1)
+    if by == "hour-of-day":
+        # Local hour of day, using the current local UTC offset
+        offset = datetime.now().astimezone().utcoffset().total_seconds()
+        keys = ((data["timestamp"] + offset) // 3600 % 24).astype(np.int64)
+    else:
+        period = 86400 if by == "day" else 3600
+        keys = (data["timestamp"] // period * period).astype(np.int64)
+
+    periods, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse)
+    disagreements = np.bincount(inverse, weights=disagree)
+    rows = []
+    for period, count, disagreements_in_period in zip(periods, counts, disagreements):
+        if by == "hour-of-day":
+            label = f"{int(period):02d}:00"
+        else:
+            label = datetime.fromtimestamp(int(period)).strftime("%Y-%m-%d" if by == "day" else "%Y-%m-%d %H:00")
+        rows.append({
+            "period": label,
+            "predictions": int(count),
+            "disagreement_rate": round(float(disagreements_in_period / count), 4),
+        })
+    return rows
+
+
+def confidence_distribution(data: Dict[str, np.ndarray], bins: int = 10) -> Dict[str, Dict]:
+    """Histogram of the top-class confidence (0-100%) per model"""
+    edges = np.linspace(0, 100, bins + 1)
+    result = {}
+    for model in ("vgg16", "mobilenetv2"):
+        confidence = data[f"{model}_probs"].max(axis=1) * 100 if len(data[f"{model}_probs"]) else np.array([])
+        counts, _ = np.histogram(confidence, bins=edges)
+        result[model] = {
+            "edges": [round(float(edge), 1) for edge in edges],
+            "counts": counts.tolist(),
+            "mean": round(float(confidence.mean()), 2) if len(confidence) else None,
+        }
+    return result
+
+
+def compact(directory: str) -> Optional[str]:
+    """Merge all segments into one, so queries open a single file"""
+    # One snapshot of the segments: merge and remove exactly these, not one the server flushes meanwhile
+    paths = segment_paths(directory)
+    if len(paths) < 2:
+        return None
+    data = load_columns(directory, COLUMNS + ("stage_ms",), paths=paths)
+    order = np.argsort(data["timestamp"], kind="stable")
+    columns = {name: values[order] for name, values in data.items() if name != "stage_names"}
+    columns["stage_names"] = data["stage_names"]
+    stamp = datetime.fromtimestamp(float(data["timestamp"][order[0]])).strftime("%Y%m%d_%H%M%S_%f")
+    merged = write_segment(directory, f"audit_{stamp}_compacted_{int(time.time())}.npz", columns)
+    for path in paths:
+        os.remove(path)
+    return merged
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the BioPrint prediction audit log")
+    parser.add_argument('command', choices=['summary', 'disagreement', 'confidence', 'compact'],
+                        help='Query to run')
+    parser.add_argument('--dir', type=str, default=os.environ.get("BIOPRINT_AUDIT_DIR", "audit_log"),
+                        help='Audit log directory (default: audit_log)')
+    parser.add_argument('--since', type=str, help='Only records at or after this ISO date/time')
+    parser.add_argument('--until', type=str, help='Only records before this ISO date/time')
+    parser.add_argument('--source', type=str, help='Only records from this source (upload, hardware_scanner)')
+    parser.add_argument('--by', choices=['hour', 'day', 'hour-of-day'], default='hour',
+                        help='Disagreement grouping (default: hour)')
+    parser.add_argument('--bins', type=int, default=10,
+                        help='Confidence histogram bins (default: 10)')
+    args = parser.parse_args()
+
+    if args.command == 'compact':
+        start = time.perf_counter()
+        merged = compact(args.dir)
+        if merged:
+            print(f"✅ Compacted into {merged} in {time.perf_counter() - start:.2f} s")
+        else:
+            print("Nothing to compact")
+        return True
+
+    start = time.perf_counter()
+    columns = COLUMNS + ("stage_ms",) if args.command == 'summary' else ("vgg16_probs", "mobilenetv2_probs")
+    data = load_columns(args.dir, columns, _parse_time(args.since), _parse_time(args.until), args.source)
+    rows = len(data["timestamp"])
+    if not rows:
+        print(f"❌ No audit records in {args.dir}")
+        return False
+
+    if args.command == 'summary':
+        disagree = data["vgg16_probs"].argmax(axis=1) != data["mobilenetv2_probs"].argmax(axis=1)
+        print(f"📊 {rows} predictions from {datetime.fromtimestamp(data['timestamp'].min())} "
+              f"to {datetime.fromtimestamp(data['timestamp'].max())}")
+        print(f"  Disagreement rate: {disagree.mean():.2%}")
+        sources, counts = np.unique(data["source"], return_counts=True)
+        print("  Sources: " + ", ".join(f"{source} {count}" for source, count in zip(sources, counts)))
+        finals, counts = np.unique(data["final_prediction"], return_counts=True)
+        print("  Final predictions: " + ", ".join(f"{final} {count}" for final, count in zip(finals, counts)))
+        with np.errstate(all="ignore"):
+            means = np.nanmean(data["stage_ms"], axis=0) if len(data["stage_names"]) else []
+        for name, mean in zip(data["stage_names"], means):
+            print(f"  {name}: mean {mean:.2f} ms")
+    elif args.command == 'disagreement':
+        for row in disagreement_by_period(data, args.by):
+            print(f"  {row['period']}: {row['predictions']} predictions, disagreement {row['disagreement_rate']:.2%}")
+    elif args.command == 'confidence':
+        for model, histogram in confidence_distribution(data, args.bins).items():
+            print(f"  {model} (mean {histogram['mean']}%):")
+            edges = histogram["edges"]
+            for low, high, count in zip(edges, edges[1:], histogram["counts"]):
+                print(f"    {low:5.1f}-{high:5.1f}%: {count}")
+
+    print(f"\n({rows} rows scanned in {time.perf_counter() - start:.3f} s)")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Scanner station throughput: sequential vs pipelined capture-and-predict
+
+Runs --captures back-to-back capture-and-predict cycles against the simulated
+R307S sensor (simulated_sensor.py, with its 57600-baud serial timings) twice:
+- sequential: capture, decode and inference one after the other, as
+  /capture-and-predict does by default
+- pipelined: the same stages on capture_pipeline.CapturePipeline with every
+  capture submitted up front, as a station keeping its next patient queued
+
+and reports captures per minute for both, plus each pipeline stage's
+occupancy (busy fraction) and mean time per item. With the pipeline the
+station's throughput should approach that of its slowest stage.
+
+Run from the repository root (the models are loaded from the working directory):
+  python benchmarks/bench_capture_pipeline.py
+  python benchmarks/bench_capture_pipeline.py --captures 20 --time-scale 0.5
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_utils import ROOT_DIR, write_results
+
+DEFAULT_OUTPUT = os.path.join(ROOT_DIR, "benchmarks", "results", "capture_pipeline.json")
+
+
+def run_sequential(app_module, captures: int) -> float:
+    from PIL import Image
+
+    start = time.perf_counter()
+    for _ in range(captures):
+        filename = app_module.capture_to_store()
+        image = Image.open(filename)
+        image.load()
+        app_module.check_image_quality(image, "capture_and_predict")
+        app_module.prediction_service.predict(image, source="hardware_scanner")
+    return time.perf_counter() - start
+
+
+def run_pipelined(app_module, captures: int, queue_size: int):
+    from capture_pipeline import CapturePipeline, PipelineFull
+
+    pipeline = CapturePipeline(
+        capture=app_module.capture_to_store,
+        predict_many=lambda images, tta_views: app_module.prediction_service.predict_many(images, tta_views),
+        check=lambda image: app_module.check_image_quality(image, "capture_and_predict"),
+        queue_size=queue_size,
+    )
+    start = time.perf_counter()
+    tickets = []
+    for _ in range(captures):
+        # A station submits its next capture as soon as there is room in the queue
+        while True:
+            try:
+                tickets.append(pipeline.submit())
+                break
+            except PipelineFull:
+                time.sleep(0.01)
+    for ticket in tickets:
+        ticket.future.result()
+    seconds = time.perf_counter() - start
+    stats = pipeline.stats()
+    pipeline.stop()
+    return seconds, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sequential vs pipelined capture-and-predict")
+    parser.add_argument('--captures', type=int, default=10,
+                        help='Capture-and-predict cycles per mode (default: 10)')
+    parser.add_argument('--queue-size', type=int, default=2,
+                        help='Pipeline queue size per stage (default: 2)')
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help='Multiplier for the simulated sensor delays (default: 1.0)')
+    parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT,
+                        help='Results JSON path (default: benchmarks/results/capture_pipeline.json)')
+    args = parser.parse_args()
+
+    os.environ["BIOPRINT_SCANNER"] = "simulated"
+    os.environ["BIOPRINT_SIM_TIME_SCALE"] = str(args.time_scale)
+    os.environ.setdefault("BIOPRINT_SIM_SEED", "1")
+    os.environ["BIOPRINT_AUDIT_DIR"] = ""
+    store_dir = tempfile.mkdtemp(prefix="bioprint_capture_bench_")
+    os.environ["BIOPRINT_IMAGE_STORE"] = store_dir
+
+    print("Loading models and app...")
+    import app as app_module
+    # Warm up the models so neither mode pays for the first prediction
+    run_sequential(app_module, 1)
+
+    print(f"Sequential: {args.captures} captures...")
+    sequential_seconds = run_sequential(app_module, args.captures)
+    print(f"Pipelined: {args.captures} captures...")
+    pipelined_seconds, stats = run_pipelined(app_module, args.captures, args.queue_size)
+
+    metrics = {
+        "sequential_captures_per_min": round(args.captures / sequential_seconds * 60, 2),
+        "pipelined_captures_per_min": round(args.captures / pipelined_seconds * 60, 2),
+        "speedup": round(sequential_seconds / pipelined_seconds, 2),
+    }
+    for stage, stage_stats in stats["stages"].items():
+        metrics[f"{stage}.occupancy"] = stage_stats["occupancy"]
+        metrics[f"{stage}.mean_ms"] = stage_stats["mean_ms"]
+        metrics[f"{stage}.blocked_seconds"] = stage_stats["blocked_seconds"]
+
+    write_results(args.output, metrics, {"settings": vars(args)})
+    print(f"\n📊 Results ({args.output}):")
+    for name, value in sorted(metrics.items()):
+        print(f"  {name}: {value}")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Model load time and memory: .h5 versus memory-mapped weight files
+
+Each measurement runs in a fresh Python process that imports TensorFlow, loads one
+model and runs one prediction:
+- h5:   tf.keras.models.load_model on the .h5
+- mmap: model_loader.load_model on the converted .bpw weight file
+
+Reported per model and method (median over --runs): load time, first prediction
+time (memory-mapped pages are read on first use), resident memory and anonymous
+memory after the prediction. Memory-mapped weights are resident but file-backed:
+they are shared with every other process mapping the file and can be reclaimed,
+so anonymous memory is the per-process cost.
+
+Run from the repository root after converting the models:
+  python convert_weights.py
+  python benchmarks/bench_model_load.py
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_utils import ROOT_DIR, memory_usage_mb, write_results
+
+DEFAULT_OUTPUT = os.path.join(ROOT_DIR, "benchmarks", "results", "model_load.json")
+METHODS = ["h5", "mmap"]
+
+
+def measure(method: str, path: str) -> dict:
+    """Runs in the child process"""
+    import tensorflow as tf
+    import model_loader
+
+    before = memory_usage_mb()
+    start = time.perf_counter()
+    if method == "h5":
+        model = tf.keras.models.load_model(path, compile=False)
+    else:
+        model = model_loader.load_model(model_loader.weight_file_for(path))
+    load_seconds = time.perf_counter() - start
+
+    shape = [1] + list(model.inputs[0].shape[1:])
+    start = time.perf_counter()
+    model.predict(np.zeros(shape, dtype=np.float32), verbose=0)
+    first_predict_seconds = time.perf_counter() - start
+
+    after = memory_usage_mb()
+    result = {
+        "load_ms": round(load_seconds * 1000, 1),
+        "first_predict_ms": round(first_predict_seconds * 1000, 1),
+    }
+    for key, value in after.items():
+        result[key] = value
+        if key in before:
+            result[f"{key.replace('_mb', '')}_growth_mb"] = round(value - before[key], 1)
+    return result
+
+
+def run_child(method: str, path: str) -> dict:
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="2")
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), "--child", method, path],
+        env=env, stderr=subprocess.DEVNULL,
+    )
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model load time and memory: .h5 vs memory-mapped weights")
+    parser.add_argument('models', nargs='*', default=['VGG16.h5', 'MobileNetV2.h5'],
+                        help='Models to benchmark (default: VGG16.h5 MobileNetV2.h5)')
+    parser.add_argument('--runs', type=int, default=3,
+                        help='Fresh processes per model and method (default: 3)')
+    parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT,
+                        help='Results JSON path (default: benchmarks/results/model_load.json)')
+    parser.add_argument('--child', nargs=2, metavar=('METHOD', 'MODEL'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(*args.child)))
+        return True
+
+    import model_loader
+
+    metrics = {}
+    for path in args.models:
+        if not model_loader.weight_file_for(path):
+            print(f"❌ No up-to-date weight file for {path}; run python convert_weights.py first")
+            return False
+
+        name = os.path.splitext(os.path.basename(path))[0].lower()
+        for method in METHODS:
+            print(f"Loading {path} via {method} ({args.runs} runs)...")
+            runs = [run_child(method, path) for _ in range(args.runs)]
+            for key in runs[0]:
+                metrics[f"{name}.{method}.{key}"] = round(float(np.median([run[key] for run in runs])), 1)
+
+        h5_ms = metrics[f"{name}.h5.load_ms"]
+        mmap_ms = metrics[f"{name}.mmap.load_ms"]
+        print(f"  {name}: load {h5_ms} ms (h5) vs {mmap_ms} ms (mmap), "
+              f"anonymous memory {metrics.get(f'{name}.h5.anonymous_mb')} MB vs {metrics.get(f'{name}.mmap.anonymous_mb')} MB")
+
+    write_results(args.output, metrics, {"settings": vars(args)})
+    print(f"\n📊 Results ({args.output}):")
+    for name, value in sorted(metrics.items()):
+        print(f"  {name}: {value}")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Interactive latency under bulk load: FIFO vs priority inference scheduling
+
+Keeps --bulk-requests /predict-batch-sized requests (--bulk-size images each)
+queued on an inference_scheduler.InferenceScheduler while single-image
+interactive requests arrive every --interval seconds, and runs the same load
+twice:
+- fifo: every request in one queue, in arrival order (the behaviour without
+  priorities)
+- priority: interactive requests in their own queue, served by weighted
+  round-robin with preemption at batch boundaries
+
+and reports the interactive p50/p95/p99 latency and the bulk images per
+second for both. The models are the ones app.py loads.
+
+Run from the repository root (the models are loaded from the working directory):
+  python benchmarks/bench_scheduler.py
+  python benchmarks/bench_scheduler.py --interactive 50 --bulk-size 32 --max-batch 8
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_utils import ROOT_DIR, find_images, summarize_latencies, write_results
+
+DEFAULT_OUTPUT = os.path.join(ROOT_DIR, "benchmarks", "results", "scheduler.json")
+
+
+def run_load(scheduler, images, args, interactive_priority: str):
+    from inference_scheduler import BULK
+
+    bulk_images = [images[i % len(images)] for i in range(args.bulk_size)]
+    bulk_done = threading.Event()
+    bulk_count = [0]
+
+    def bulk_client():
+        # Keeps bulk_requests requests queued until the interactive requests are done
+        futures = [scheduler.submit(bulk_images, source="bench_bulk", priority=BULK)
+                   for _ in range(args.bulk_requests)]
+        while not bulk_done.is_set():
+            futures.pop(0).result()
+            bulk_count[0] += args.bulk_size
+            futures.append(scheduler.submit(bulk_images, source="bench_bulk", priority=BULK))
+        for future in futures:
+            future.result()
+
+    start = time.perf_counter()
+    thread = threading.Thread(target=bulk_client)
+    thread.start()
+    latencies = []
+    for i in range(args.interactive):
+        time.sleep(args.interval)
+        submitted = time.perf_counter()
+        scheduler.submit([images[i % len(images)]], source="bench_interactive", priority=interactive_priority).result()
+        latencies.append(time.perf_counter() - submitted)
+    bulk_seconds = time.perf_counter() - start
+    bulk_done.set()
+    thread.join()
+    return latencies, bulk_count[0] / bulk_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark interactive latency under bulk load, FIFO vs priority")
+    parser.add_argument('--interactive', type=int, default=30,
+                        help='Interactive single-image requests per mode (default: 30)')
+    parser.add_argument('--interval', type=float, default=0.2,
+                        help='Seconds between interactive requests (default: 0.2)')
+    parser.add_argument('--bulk-requests', type=int, default=2,
+                        help='Bulk requests kept queued (default: 2)')
+    parser.add_argument('--bulk-size', type=int, default=32,
+                        help='Images per bulk request (default: 32)')
+    parser.add_argument('--max-batch', type=int, default=8,
+                        help='Images per model batch (default: 8)')
+    parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT,
+                        help='Results JSON path (default: benchmarks/results/scheduler.json)')
+    args = parser.parse_args()
+
+    os.environ["BIOPRINT_AUDIT_DIR"] = ""
+    from PIL import Image
+    from inference_scheduler import InferenceScheduler, BULK, INTERACTIVE
+
+    print("Loading models and app...")
+    import app as app_module
+    service = app_module.prediction_service
+    images = []
+    for path in find_images()[:16]:
+        image = Image.open(path)
+        image.load()
+        images.append(image)
+    if not images:
+        print("❌ No sample images found")
+        return False
+    service.predict_many(images[:1])  # Warm up
+
+    metrics = {}
+    for mode, priority in (("fifo", BULK), ("priority", INTERACTIVE)):
+        print(f"{mode}: {args.interactive} interactive requests under bulk load...")
+        scheduler = InferenceScheduler(service.predict_many, max_batch=args.max_batch, preempt=True)
+        latencies, bulk_rate = run_load(scheduler, images, args, priority)
+        scheduler.stop()
+        for name, value in summarize_latencies(latencies).items():
+            metrics[f"{mode}.interactive_{name}"] = value
+        metrics[f"{mode}.bulk_images_per_second"] = round(bulk_rate, 2)
+
+    write_results(args.output, metrics, {"settings": vars(args)})
+    print(f"\n📊 Results ({args.output}):")
+    for name, value in sorted(metrics.items()):
+        print(f"  {name}: {value}")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,146 @@
+"""
+Shared helpers for the BioPrint benchmark and load tools
+
+Percentile summaries, peak RSS, sample image discovery and the results/baseline
+JSON format used to catch performance regressions.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Repository root (benchmarks/ lives directly below it)
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DATASET_DIR = os.path.join(ROOT_DIR, "Sample dataset")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def find_images(directory: str = SAMPLE_DATASET_DIR) -> List[str]:
+    """All image files below directory, in a stable order"""
+    images = []
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(os.path.join(dirpath, filename))
+    return sorted(images)
+
+
+def summarize_latencies(seconds: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean in milliseconds for a list of durations in seconds"""
+    if not seconds:
+        return {}
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+    }
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB, if the platform reports it"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS reports bytes
+        divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return round(peak / divisor, 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except Exception:
+        return None
+
+
+def memory_usage_mb() -> Dict[str, float]:
+    """Current resident memory of this process in MB; anonymous_mb excludes file-backed (memory-mapped) pages"""
+    try:
+        usage = {}
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Anonymous"):
+                    usage[key] = int(value.split()[0]) / 1024
+        return {"rss_mb": round(usage["Rss"], 1), "anonymous_mb": round(usage["Anonymous"], 1)}
+    except (OSError, KeyError):
+        pass
+    try:
+        import psutil
+        return {"rss_mb": round(psutil.Process().memory_info().rss / (1024 * 1024), 1)}
+    except Exception:
+        return {}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def environment_info() -> Dict:
+    """Host and library versions recorded next to the results"""
+    info = {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+    }
+    # Only report TensorFlow when the tool already loaded it; importing it here would take seconds
+    tf = sys.modules.get("tensorflow")
+    if tf is not None:
+        info["tensorflow"] = tf.__version__
+    return info
+
+
+def write_results(path: str, metrics: Dict[str, float], extra: Optional[Dict] = None):
+    """Write machine-readable results: {"environment": ..., "metrics": {name: value}}"""
+    results = {"environment": environment_info(), "metrics": metrics}
+    if extra:
+        results.update(extra)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    return results
+
+
+def lower_is_better(metric: str) -> bool:
+    """Latencies and memory regress upwards, throughputs regress downwards"""
+    return not metric.endswith("_per_sec")
+
+
+def compare_to_baseline(metrics: Dict[str, float], baseline_path: str, tolerance: float) -> List[str]:
+    """
+    Compare metrics with a stored baseline.
+    Returns a list of regression messages for metrics worse than baseline by more than tolerance.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f).get("metrics", {})
+
+    regressions = []
+    for name, value in sorted(metrics.items()):
+        reference = baseline.get(name)
+        if reference is None or value is None or not reference:
+            continue
+        change = (value - reference) / reference
+        worse = change > tolerance if lower_is_better(name) else change < -tolerance
+        if worse:
+            regressions.append(f"{name}: {value} vs baseline {reference} ({change:+.1%})")
+    return regressions
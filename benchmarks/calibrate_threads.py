@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+TensorFlow thread calibration for the BioPrint API
+
+Sweeps intra-op/inter-op thread settings. Each setting runs in a fresh process
+(TensorFlow's thread pools can only be sized before its first op), which loads the
+models and serves the Sample dataset/ images to --concurrency concurrent clients.
+Each request goes through the API's inference scheduler, the single thread that
+runs every model pass in the server (merging concurrent requests into batches),
+so the selected setting is tuned for the way the API actually serves.
+
+The selected operating point is the highest throughput among the settings whose
+p95 latency is within --latency-slack of the best p95. With --write it is saved to
+inference_config.json, which the API applies on start (see inference_config.py).
+
+Run from the repository root:
+  python benchmarks/calibrate_threads.py
+  python benchmarks/calibrate_threads.py --concurrency 8 --intra 2 4 8 --inter 1 2 --write
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_utils import ROOT_DIR, SAMPLE_DATASET_DIR, find_images, summarize_latencies, write_results
+from inference_config import CALIBRATION_PATH, available_cpus
+
+DEFAULT_OUTPUT = os.path.join(ROOT_DIR, "benchmarks", "results", "calibration.json")
+
+
+def default_intra_candidates(max_threads: int) -> List[int]:
+    """Powers of two up to max_threads, plus max_threads itself"""
+    candidates = []
+    threads = 1
+    while threads < max_threads:
+        candidates.append(threads)
+        threads *= 2
+    candidates.append(max_threads)
+    return candidates
+
+
+def measure(dataset: str, concurrency: int, rounds: int, warmup: int) -> Dict:
+    """Runs in the child process, with the thread settings in the environment"""
+    from PIL import Image
+    import app as app_module
+
+    images = []
+    for path in find_images(dataset):
+        image = Image.open(path)
+        image.load()
+        images.append(image)
+
+    scheduler = app_module.inference_scheduler
+
+    def request(image):
+        # Queued like a /predict request: preprocessing and both models on the scheduler thread
+        start = time.perf_counter()
+        scheduler.submit([image], source="calibration").result()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(request, images * warmup))
+        start = time.perf_counter()
+        latencies = list(executor.map(request, images * rounds))
+        elapsed = time.perf_counter() - start
+    scheduler.stop()
+
+    result = {"requests_per_sec": round(len(latencies) / elapsed, 2)}
+    result.update(summarize_latencies(latencies))
+    return result
+
+
+def run_candidate(intra: int, inter: int, args) -> Dict:
+    env = dict(
+        os.environ,
+        BIOPRINT_INTRA_OP_THREADS=str(intra),
+        BIOPRINT_INTER_OP_THREADS=str(inter),
+        TF_CPP_MIN_LOG_LEVEL="2",
+    )
+    command = [
+        sys.executable, os.path.abspath(__file__), "--child",
+        "--dataset", args.dataset, "--concurrency", str(args.concurrency),
+        "--rounds", str(args.rounds), "--warmup", str(args.warmup),
+    ]
+    output = subprocess.check_output(command, env=env, stderr=subprocess.DEVNULL)
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    result.update({"intra_op_threads": intra, "inter_op_threads": inter})
+    return result
+
+
+def select(results: List[Dict], latency_slack: float) -> Dict:
+    """Highest throughput among the settings with p95 latency within latency_slack of the best"""
+    best_p95 = min(result["p95_ms"] for result in results)
+    eligible = [result for result in results if result["p95_ms"] <= best_p95 * latency_slack]
+    return max(eligible, key=lambda result: result["requests_per_sec"])
+
+
+def main():
+    cpus = len(available_cpus())
+    parser = argparse.ArgumentParser(description="Calibrate TensorFlow thread settings for this host")
+    parser.add_argument('--dataset', type=str, default=SAMPLE_DATASET_DIR,
+                        help='Directory of calibration images (default: Sample dataset/)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Concurrent clients (default: 4)')
+    parser.add_argument('--intra', type=int, nargs='+', default=default_intra_candidates(cpus),
+                        help=f'Intra-op thread candidates (default: powers of two up to {cpus})')
+    parser.add_argument('--inter', type=int, nargs='+', default=[1, 2],
+                        help='Inter-op thread candidates (default: 1 2)')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='Timed passes over the images per setting (default: 5)')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='Untimed passes over the images per setting (default: 1)')
+    parser.add_argument('--latency-slack', type=float, default=1.25,
+                        help='Accept p95 latency up to this factor of the best p95 for more throughput (default: 1.25)')
+    parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT,
+                        help='Results JSON path (default: benchmarks/results/calibration.json)')
+    parser.add_argument('--write', action='store_true',
+                        help=f'Save the selected setting to {os.path.relpath(CALIBRATION_PATH, ROOT_DIR)}')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.dataset, args.concurrency, args.rounds, args.warmup)))
+        return True
+
+    if not find_images(args.dataset):
+        print(f"❌ No images found in {args.dataset}")
+        return False
+
+    results = []
+    for intra in args.intra:
+        for inter in args.inter:
+            print(f"Measuring intra-op {intra}, inter-op {inter} (concurrency {args.concurrency})...")
+            try:
+                result = run_candidate(intra, inter, args)
+            except subprocess.CalledProcessError as e:
+                print(f"  ⚠️  Failed with exit status {e.returncode}")
+                continue
+            print(f"  {result['requests_per_sec']} req/s, p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms")
+            results.append(result)
+
+    if not results:
+        print("❌ No setting could be measured")
+        return False
+
+    selected = select(results, args.latency_slack)
+    print(f"\n✅ Selected intra-op {selected['intra_op_threads']}, inter-op {selected['inter_op_threads']}: "
+          f"{selected['requests_per_sec']} req/s, p95 {selected['p95_ms']} ms")
+
+    metrics = {key: value for key, value in selected.items() if key.endswith(("_ms", "_per_sec"))}
+    extra = {"selected": selected, "candidates": results, "settings": vars(args)}
+    write_results(args.output, metrics, extra)
+    print(f"📊 All settings written to {args.output}")
+    if args.write:
+        write_results(CALIBRATION_PATH, metrics, extra)
+        print(f"✅ Calibration saved to {CALIBRATION_PATH}; the API applies it on start")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
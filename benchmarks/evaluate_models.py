@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Model evaluation and regression gate for the BioPrint models
+
+Runs one or more model variants (a VGG16 and a MobileNetV2 model each: .h5,
+converted weights or quantized .tflite files) over a labeled folder tree such as
+Sample dataset/, where each image's parent folder names its blood group, and
+reports side by side per variant:
+- accuracy and per-class accuracy of each model
+- expected calibration error (ECE) of each model
+- ensemble agreement rate and accuracy of the final prediction (agreeing models)
+- batched throughput and single-image latency of both models, as /predict runs them
+
+The first variant is the reference. The script exits with status 1 when a
+threshold is breached, either absolute (--min-accuracy, --max-ece...) or relative
+to the reference (--max-accuracy-drop, --max-latency-increase).
+
+Run from the repository root:
+  python benchmarks/evaluate_models.py
+  python benchmarks/evaluate_models.py --variant current=VGG16.h5,MobileNetV2.h5 \\
+      --variant int8=VGG16_int8.tflite,MobileNetV2_int8.tflite --min-accuracy 0.8
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_utils import ROOT_DIR, SAMPLE_DATASET_DIR, find_images, summarize_latencies, write_results
+from preprocessing import CLASS_LABELS, preprocess
+from rescore import folder_label
+
+DEFAULT_OUTPUT = os.path.join(ROOT_DIR, "benchmarks", "results", "evaluation.json")
+MODELS = ("vgg16", "mobilenetv2")
+
+
+def parse_variant(value: str) -> Tuple[str, Dict[str, str]]:
+    """NAME=VGG16_PATH,MOBILENETV2_PATH"""
+    name, _, paths = value.partition("=")
+    paths = paths.split(",")
+    if not name or len(paths) != 2:
+        raise argparse.ArgumentTypeError(f"Expected NAME=VGG16_PATH,MOBILENETV2_PATH, got {value}")
+    return name, dict(zip(MODELS, paths))
+
+
+def load_dataset(directory: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Preprocessed images and their label indices, for the images in blood group folders"""
+    images, labels = [], []
+    for path in find_images(directory):
+        label = folder_label(path)
+        if label:
+            with Image.open(path) as image:
+                images.append(preprocess(image)[0].astype(np.float32))
+            labels.append(CLASS_LABELS.index(label))
+    if not images:
+        return np.empty((0,)), np.empty((0,), dtype=np.intp)
+    return np.stack(images), np.array(labels, dtype=np.intp)
+
+
+def expected_calibration_error(probabilities: np.ndarray, labels: np.ndarray, bins: int = 10) -> float:
+    """Mean |accuracy - confidence| over equal-width confidence bins, weighted by bin size"""
+    confidence = probabilities.max(axis=1)
+    correct = probabilities.argmax(axis=1) == labels
+    bin_index = np.minimum((confidence * bins).astype(np.intp), bins - 1)
+    counts = np.bincount(bin_index, minlength=bins)
+    gap = np.abs(np.bincount(bin_index, weights=correct, minlength=bins)
+                 - np.bincount(bin_index, weights=confidence, minlength=bins))
+    return float(gap.sum() / counts.sum())
+
+
+def classification_metrics(probabilities: np.ndarray, labels: np.ndarray, bins: int) -> Dict[str, float]:
+    predicted = probabilities.argmax(axis=1)
+    correct = predicted == labels
+    metrics = {
+        "accuracy": round(float(correct.mean()), 4),
+        "ece": round(expected_calibration_error(probabilities, labels, bins), 4),
+    }
+    # Per-class accuracy (recall) for the classes present in the dataset
+    totals = np.bincount(labels, minlength=len(CLASS_LABELS))
+    hits = np.bincount(labels, weights=correct, minlength=len(CLASS_LABELS))
+    for index in np.flatnonzero(totals):
+        metrics[f"accuracy.{CLASS_LABELS[index]}"] = round(float(hits[index] / totals[index]), 4)
+    return metrics
+
+
+def evaluate_variant(paths: Dict[str, str], images: np.ndarray, labels: np.ndarray, args) -> Tuple[Dict, Dict]:
+    """Metrics of one variant, and its top-1 predictions per model"""
+    from model_loader import load_model
+
+    metrics = {}
+    start = time.perf_counter()
+    models = {name: load_model(path) for name, path in paths.items()}
+    metrics["load_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    predictions = {}
+    for name, model in models.items():
+        model.predict(images[:args.batch_size], batch_size=args.batch_size, verbose=0)  # Warm up
+        start = time.perf_counter()
+        probabilities = model.predict(images, batch_size=args.batch_size, verbose=0)
+        elapsed = time.perf_counter() - start
+        metrics[f"{name}.images_per_sec"] = round(len(images) / elapsed, 1)
+        for key, value in classification_metrics(probabilities, labels, args.calibration_bins).items():
+            metrics[f"{name}.{key}"] = value
+        predictions[name] = probabilities.argmax(axis=1)
+
+    agree = predictions["vgg16"] == predictions["mobilenetv2"]
+    metrics["ensemble.agreement"] = round(float(agree.mean()), 4)
+    # The API only returns a blood group when both models agree
+    metrics["ensemble.accuracy"] = round(float((agree & (predictions["vgg16"] == labels)).mean()), 4)
+
+    # Single-image latency of both models, as /predict runs them
+    timings = []
+    for round_number in range(args.warmup + args.rounds):
+        for image in images:
+            batch = image[None]
+            start = time.perf_counter()
+            for model in models.values():
+                model.predict(batch, verbose=0)
+            if round_number >= args.warmup:
+                timings.append(time.perf_counter() - start)
+    for key, value in summarize_latencies(timings).items():
+        metrics[f"latency.{key}"] = value
+    return metrics, predictions
+
+
+def check_thresholds(name: str, metrics: Dict, reference: Dict, args) -> List[str]:
+    """Messages for every threshold this variant breaches"""
+    breaches = []
+    for model in MODELS:
+        accuracy = metrics[f"{model}.accuracy"]
+        if args.min_accuracy is not None and accuracy < args.min_accuracy:
+            breaches.append(f"{name} {model} accuracy {accuracy:.2%} < {args.min_accuracy:.2%}")
+        if args.min_class_accuracy is not None:
+            for label in CLASS_LABELS:
+                value = metrics.get(f"{model}.accuracy.{label}")
+                if value is not None and value < args.min_class_accuracy:
+                    breaches.append(f"{name} {model} {label} accuracy {value:.2%} < {args.min_class_accuracy:.2%}")
+        if args.max_ece is not None and metrics[f"{model}.ece"] > args.max_ece:
+            breaches.append(f"{name} {model} ECE {metrics[f'{model}.ece']} > {args.max_ece}")
+        if reference is not metrics and args.max_accuracy_drop is not None:
+            drop = reference[f"{model}.accuracy"] - accuracy
+            if drop > args.max_accuracy_drop:
+                breaches.append(f"{name} {model} accuracy dropped {drop:.2%} from the reference")
+    if args.min_agreement is not None and metrics["ensemble.agreement"] < args.min_agreement:
+        breaches.append(f"{name} agreement {metrics['ensemble.agreement']:.2%} < {args.min_agreement:.2%}")
+    if reference is not metrics and args.max_latency_increase is not None:
+        increase = metrics["latency.p95_ms"] / reference["latency.p95_ms"] - 1
+        if increase > args.max_latency_increase:
+            breaches.append(f"{name} p95 latency {metrics['latency.p95_ms']} ms is {increase:+.1%} over the reference")
+    return breaches
+
+
+def print_table(results: Dict[str, Dict]):
+    names = list(results)
+    keys = sorted({key for metrics in results.values() for key in metrics})
+    width = max(len(key) for key in keys) + 2
+    print("\n" + "".join(f"{text:<{width}}" if i == 0 else f"{text:>14}"
+                         for i, text in enumerate(["metric"] + names)))
+    for key in keys:
+        print(f"{key:<{width}}" + "".join(f"{str(results[name].get(key, '-')):>14}" for name in names))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate BioPrint model variants for accuracy and speed")
+    parser.add_argument('--dataset', type=str, default=SAMPLE_DATASET_DIR,
+                        help='Folder tree of images in blood group folders (default: Sample dataset/)')
+    parser.add_argument('--variant', type=parse_variant, action='append', metavar='NAME=VGG16,MOBILENETV2',
+                        help='Model variant to evaluate, repeatable; the first is the reference '
+                             '(default: current=VGG16.h5,MobileNetV2.h5)')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Batch size of the accuracy/throughput pass (default: 32)')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='Timed single-image passes over the dataset (default: 3)')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='Untimed single-image passes over the dataset (default: 1)')
+    parser.add_argument('--calibration-bins', type=int, default=10,
+                        help='Confidence bins of the calibration error (default: 10)')
+    parser.add_argument('--min-accuracy', type=float, help='Fail when a model is less accurate (0-1)')
+    parser.add_argument('--min-class-accuracy', type=float, help='Fail when a model is less accurate on any class (0-1)')
+    parser.add_argument('--min-agreement', type=float, help='Fail when the models agree less often (0-1)')
+    parser.add_argument('--max-ece', type=float, help='Fail when a model has a higher calibration error (0-1)')
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.02,
+                        help='Fail when a model loses more accuracy than this vs the reference (default: 0.02)')
+    parser.add_argument('--max-latency-increase', type=float, default=0.25,
+                        help='Fail when p95 latency grows by more than this fraction vs the reference (default: 0.25)')
+    parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT,
+                        help='Results JSON path (default: benchmarks/results/evaluation.json)')
+    args = parser.parse_args()
+    variants = dict(args.variant or [parse_variant("current=VGG16.h5,MobileNetV2.h5")])
+
+    images, labels = load_dataset(args.dataset)
+    if not len(images):
+        print(f"❌ No labeled images found in {args.dataset} (expected folders named {', '.join(CLASS_LABELS)})")
+        return False
+    print(f"Evaluating {len(variants)} variant(s) on {len(images)} labeled image(s)")
+
+    import inference_config
+    inference_config.configure()
+
+    results, predictions = {}, {}
+    for name, paths in variants.items():
+        print(f"Evaluating {name} ({paths['vgg16']}, {paths['mobilenetv2']})...")
+        try:
+            results[name], predictions[name] = evaluate_variant(paths, images, labels, args)
+        except (OSError, ValueError) as e:
+            print(f"❌ Could not evaluate {name}: {e}")
+            return False
+
+    # How often each variant's top-1 prediction differs from the reference's
+    reference_name = next(iter(variants))
+    for name in list(variants)[1:]:
+        for model in MODELS:
+            changed = predictions[name][model] != predictions[reference_name][model]
+            results[name][f"{model}.changed_vs_reference"] = round(float(changed.mean()), 4)
+
+    print_table(results)
+
+    breaches = []
+    for name, metrics in results.items():
+        breaches += check_thresholds(name, metrics, results[reference_name], args)
+
+    metrics = {f"{name}.{key}": value for name, values in results.items() for key, value in values.items()}
+    settings = dict(vars(args), variant=variants)
+    write_results(args.output, metrics, {"settings": settings, "breaches": breaches})
+    print(f"\n📊 Results written to {args.output}")
+
+    if breaches:
+        print(f"\n❌ {len(breaches)} threshold(s) breached:")
+        for message in breaches:
+            print(f"  • {message}")
+        return False
+    print("\n✅ All thresholds met")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
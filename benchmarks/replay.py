@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Recorded-traffic replay and closed-loop load generator for the BioPrint API
+
+Reads requests in the requests.jsonl format (see traffic_capture.py), one JSON
+object per line with "t" (seconds), "method", "endpoint" and one of "image",
+"json" or "body_file". Lines without an "endpoint" are ignored.
+
+Requests are sent by a fixed pool of concurrent workers (closed loop: a worker
+sends its next request only after the previous one completed). With a speed-up
+factor > 0 no request is sent before its recorded time divided by the factor;
+with --speedup 0 requests are sent as fast as the workers allow.
+
+Examples:
+  python benchmarks/replay.py requests.jsonl --url http://localhost:8000 --concurrency 4
+  python benchmarks/replay.py requests.jsonl --speedup 10 --repeat 3 --output replay.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_utils import summarize_latencies, write_results
+
+
+def load_traffic(path: str, endpoints: Optional[List[str]] = None) -> List[Dict]:
+    """Parse replayable entries, resolving file references relative to the traffic file"""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                print(f"⚠️  Skipping invalid JSON on line {line_number}")
+                continue
+            if "endpoint" not in entry:
+                continue
+            if endpoints and entry["endpoint"].split("?")[0] not in endpoints:
+                continue
+
+            for key in ("image", "body_file"):
+                if key in entry and not os.path.isabs(entry[key]):
+                    entry[key] = os.path.join(base_dir, entry[key])
+            entry.setdefault("method", "POST")
+            entry.setdefault("t", 0.0)
+            entries.append(entry)
+
+    entries.sort(key=lambda entry: entry["t"])
+    return entries
+
+
+def build_request(entry: Dict, file_cache: Dict[str, bytes]) -> Dict:
+    """httpx request arguments for an entry"""
+    def read(path):
+        if path not in file_cache:
+            with open(path, "rb") as f:
+                file_cache[path] = f.read()
+        return file_cache[path]
+
+    kwargs = {"method": entry["method"], "url": entry["endpoint"]}
+    if "image" in entry:
+        filename = os.path.basename(entry["image"])
+        content_type = "image/bmp" if filename.lower().endswith(".bmp") else "image/jpeg"
+        kwargs["files"] = {"file": (filename, read(entry["image"]), content_type)}
+    elif "json" in entry:
+        kwargs["json"] = entry["json"]
+    elif "body_file" in entry:
+        kwargs["content"] = read(entry["body_file"])
+        kwargs["headers"] = {"content-type": entry.get("content_type", "application/octet-stream")}
+    return kwargs
+
+
+async def replay(entries: List[Dict], url: str, concurrency: int, speedup: float,
+                 repeat: int, timeout: float) -> Dict:
+    import httpx
+
+    # Each repeat is shifted by the duration of the recording
+    span = entries[-1]["t"] - entries[0]["t"] if entries else 0.0
+    schedule = []
+    for iteration in range(repeat):
+        for entry in entries:
+            schedule.append((entry["t"] - entries[0]["t"] + iteration * span, entry))
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in schedule:
+        queue.put_nowait(item)
+
+    results = defaultdict(lambda: {"latencies": [], "errors": 0, "statuses": defaultdict(int)})
+    file_cache: Dict[str, bytes] = {}
+    start = time.perf_counter()
+
+    async def worker(client):
+        while True:
+            try:
+                offset, entry = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if speedup > 0:
+                delay = offset / speedup - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            stats = results[entry["endpoint"].split("?")[0]]
+            request_start = time.perf_counter()
+            try:
+                response = await client.request(**build_request(entry, file_cache))
+                stats["statuses"][str(response.status_code)] += 1
+                if response.status_code >= 400:
+                    stats["errors"] += 1
+            except Exception as e:
+                stats["statuses"][type(e).__name__] += 1
+                stats["errors"] += 1
+            stats["latencies"].append(time.perf_counter() - request_start)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+
+    elapsed = time.perf_counter() - start
+    report = {"elapsed_s": round(elapsed, 3), "requests": len(schedule), "endpoints": {}}
+    for endpoint, stats in sorted(results.items()):
+        count = len(stats["latencies"])
+        summary = {
+            "requests": count,
+            "throughput_per_sec": round(count / elapsed, 3) if elapsed else 0.0,
+            "error_rate": round(stats["errors"] / count, 4) if count else 0.0,
+            "statuses": dict(stats["statuses"]),
+        }
+        summary.update(summarize_latencies(stats["latencies"]))
+        report["endpoints"][endpoint] = summary
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded traffic against a running BioPrint server")
+    parser.add_argument('traffic', nargs='?', default='requests.jsonl',
+                        help='Traffic file in requests.jsonl format (default: requests.jsonl)')
+    parser.add_argument('--url', type=str, default='http://localhost:8000',
+                        help='Server base URL (default: http://localhost:8000)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Concurrent closed-loop workers (default: 4)')
+    parser.add_argument('--speedup', type=float, default=1.0,
+                        help='Replay speed-up factor; 0 sends as fast as possible (default: 1.0)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Replay the recording this many times back to back (default: 1)')
+    parser.add_argument('--endpoint', action='append', dest='endpoints',
+                        help='Only replay this endpoint (may be given several times)')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='Per-request timeout in seconds (default: 60)')
+    parser.add_argument('--output', type=str,
+                        help='Write the report as JSON to this path')
+    args = parser.parse_args()
+
+    entries = load_traffic(args.traffic, args.endpoints)
+    if not entries:
+        print(f"❌ No replayable requests in {args.traffic}")
+        return False
+
+    print(f"Replaying {len(entries)} request(s) x{args.repeat} against {args.url} "
+          f"(concurrency {args.concurrency}, speed-up {args.speedup or 'max'})...")
+    report = asyncio.run(replay(entries, args.url, args.concurrency, args.speedup, args.repeat, args.timeout))
+
+    print(f"\n📊 {report['requests']} requests in {report['elapsed_s']} s")
+    for endpoint, summary in report["endpoints"].items():
+        print(f"  {endpoint}: {summary['requests']} req, {summary['throughput_per_sec']} req/s, "
+              f"errors {summary['error_rate']:.1%}, p50 {summary.get('p50_ms')} ms, "
+              f"p95 {summary.get('p95_ms')} ms, p99 {summary.get('p99_ms')} ms")
+
+    if args.output:
+        metrics = {
+            f"{endpoint}.{key}": value
+            for endpoint, summary in report["endpoints"].items()
+            for key, value in summary.items() if isinstance(value, (int, float))
+        }
+        write_results(args.output, metrics, {"replay": report, "settings": vars(args)})
+        print(f"\n✅ Report written to {args.output}")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Prediction pipeline benchmarks for the BioPrint API
+
+Measures on the Sample dataset/ images:
+- preprocess throughput
+- single-image and batched inference latency per model (p50/p95/p99)
+- test-time augmentation latency (both models) per number of views, and its overhead
+- response post-processing and JSON serialization time for single and batch
+  responses: FastAPI's default path (jsonable_encoder + JSONResponse) vs orjson
+- end-to-end /predict latency through an in-process ASGI client
+- peak RSS
+
+Results are written as JSON and compared against a stored baseline; the script
+exits with status 1 when a metric regresses by more than the tolerance.
+
+Run from the repository root (the models are loaded from the working directory):
+  python benchmarks/run_benchmarks.py
+  python benchmarks/run_benchmarks.py --update-baseline
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_utils import (
+    ROOT_DIR, SAMPLE_DATASET_DIR, find_images, summarize_latencies, peak_rss_mb,
+    write_results, compare_to_baseline,
+)
+from prediction_service import rank_classes
+
+DEFAULT_OUTPUT = os.path.join(ROOT_DIR, "benchmarks", "results", "latest.json")
+DEFAULT_BASELINE = os.path.join(ROOT_DIR, "benchmarks", "baseline.json")
+
+
+def add_summary(metrics: Dict[str, float], prefix: str, seconds: List[float]):
+    for key, value in summarize_latencies(seconds).items():
+        metrics[f"{prefix}.{key}"] = value
+
+
+def bench_preprocess(app_module, images: List[Image.Image], rounds: int) -> Dict[str, float]:
+    """Images per second through app.preprocess"""
+    for image in images:
+        app_module.preprocess(image)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for image in images:
+            app_module.preprocess(image)
+    elapsed = time.perf_counter() - start
+    return {"preprocess.images_per_sec": round(len(images) * rounds / elapsed, 1)}
+
+
+def bench_models(app_module, images: List[Image.Image], rounds: int, warmup: int,
+                 batch_sizes: List[int]) -> Dict[str, float]:
+    """Per-call latency of each model at each batch size"""
+    metrics = {}
+    processed = np.concatenate([app_module.preprocess(image) for image in images])
+    models = {"vgg16": app_module.model1, "mobilenetv2": app_module.model2}
+
+    for name, model in models.items():
+        for batch_size in batch_sizes:
+            # Cycle through the sample images to fill batches larger than the dataset
+            indices = np.arange(batch_size) % len(processed)
+            batch = processed[indices]
+            for _ in range(warmup):
+                model.predict(batch, verbose=0)
+
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                model.predict(batch, verbose=0)
+                timings.append(time.perf_counter() - start)
+
+            prefix = f"{name}.batch_{batch_size}"
+            add_summary(metrics, prefix, timings)
+            metrics[f"{prefix}.images_per_sec"] = round(batch_size * len(timings) / sum(timings), 1)
+    return metrics
+
+
+def bench_tta(app_module, images: List[Image.Image], rounds: int, warmup: int,
+              view_counts: List[int]) -> Dict[str, float]:
+    """Latency of augmentation plus both models per number of TTA views, and the overhead over one view"""
+    from tta import augment, predict
+
+    metrics = {}
+    processed = [app_module.preprocess(image) for image in images]
+    p50 = {}
+    for views in view_counts:
+        def run(image):
+            batch = augment(image, views)
+            predict(app_module.model1, batch)
+            predict(app_module.model2, batch)
+
+        for _ in range(warmup):
+            run(processed[0])
+        timings = []
+        for _ in range(rounds):
+            for image in processed:
+                start = time.perf_counter()
+                run(image)
+                timings.append(time.perf_counter() - start)
+
+        prefix = f"tta.views_{views}"
+        add_summary(metrics, prefix, timings)
+        p50[views] = metrics[f"{prefix}.p50_ms"]
+        if 1 in p50 and views != 1:
+            metrics[f"{prefix}.overhead_x"] = round(p50[views] / p50[1], 2)
+    return metrics
+
+
+def bench_serialization(app_module, images: List[Image.Image], rounds: int,
+                        batch_sizes: List[int]) -> Dict[str, float]:
+    """Post-processing and serialization time per response, for single and batch (/predict-batch) responses"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+
+    service = app_module.prediction_service
+    metrics = {}
+    processed = np.concatenate([app_module.preprocess(image) for image in images])
+    for batch_size in batch_sizes:
+        batch = processed[np.arange(batch_size) % len(processed)]
+        predictions = service.predict_processed(batch)
+        probabilities = {name: np.stack([p.probabilities[name] for p in predictions]) for name in service.models}
+
+        def build():
+            results = [service.build_response(prediction, top_k=3, include_probabilities=True)
+                       for prediction in predictions]
+            return results[0] if batch_size == 1 else {"success": True, "count": batch_size, "results": results}
+
+        content = build()
+        candidates = {
+            "postprocess": lambda: [rank_classes(probs) for probs in probabilities.values()],
+            "response_build": build,
+            "serialize_default": lambda: JSONResponse(jsonable_encoder(content)).body,
+            "serialize_orjson": lambda: ORJSONResponse(content).body,
+        }
+        for name, function in candidates.items():
+            function()
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                function()
+                timings.append(time.perf_counter() - start)
+            add_summary(metrics, f"{name}.batch_{batch_size}", timings)
+    return metrics
+
+
+async def _post_images(app_module, paths: List[str], rounds: int, warmup: int) -> List[float]:
+    import httpx
+
+    payloads = []
+    for path in paths:
+        with open(path, "rb") as f:
+            payloads.append((os.path.basename(path), f.read()))
+
+    transport = httpx.ASGITransport(app=app_module.app)
+    timings = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for round_number in range(warmup + rounds):
+            for filename, data in payloads:
+                start = time.perf_counter()
+                response = await client.post("/predict", files={"file": (filename, data, "image/jpeg")})
+                elapsed = time.perf_counter() - start
+                if response.status_code != 200:
+                    raise RuntimeError(f"/predict returned {response.status_code}: {response.text}")
+                if round_number >= warmup:
+                    timings.append(elapsed)
+    return timings
+
+
+def bench_end_to_end(app_module, paths: List[str], rounds: int, warmup: int) -> Dict[str, float]:
+    """Latency of POST /predict through the full ASGI stack"""
+    metrics = {}
+    timings = asyncio.run(_post_images(app_module, paths, rounds, warmup))
+    add_summary(metrics, "e2e_predict", timings)
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the BioPrint prediction pipeline")
+    parser.add_argument('--dataset', type=str, default=SAMPLE_DATASET_DIR,
+                        help='Directory of benchmark images (default: Sample dataset/)')
+    parser.add_argument('--rounds', type=int, default=20,
+                        help='Timed iterations per measurement (default: 20)')
+    parser.add_argument('--warmup', type=int, default=3,
+                        help='Untimed warmup iterations (default: 3)')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16],
+                        help='Inference batch sizes (default: 1 4 8 16)')
+    parser.add_argument('--tta-views', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='Test-time augmentation view counts (default: 1 2 4 8)')
+    parser.add_argument('--serialization-batch-sizes', type=int, nargs='+', default=[1, 32],
+                        help='Responses per serialization benchmark (default: 1 32)')
+    parser.add_argument('--skip-e2e', action='store_true',
+                        help='Skip the end-to-end /predict benchmark')
+    parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT,
+                        help='Results JSON path (default: benchmarks/results/latest.json)')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE,
+                        help='Baseline JSON to compare against (default: benchmarks/baseline.json)')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Allowed relative regression before failing (default: 0.15)')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Store these results as the new baseline')
+    args = parser.parse_args()
+
+    paths = find_images(args.dataset)
+    if not paths:
+        print(f"❌ No images found in {args.dataset}")
+        return False
+    images = [Image.open(path) for path in paths]
+    for image in images:
+        image.load()
+
+    print(f"Loading models and app ({len(paths)} benchmark images)...")
+    load_start = time.perf_counter()
+    import app as app_module
+    metrics = {"app_import_ms": round((time.perf_counter() - load_start) * 1000, 1)}
+
+    print("Benchmarking preprocess...")
+    metrics.update(bench_preprocess(app_module, images, args.rounds))
+    print("Benchmarking model inference...")
+    metrics.update(bench_models(app_module, images, args.rounds, args.warmup, args.batch_sizes))
+    print("Benchmarking test-time augmentation...")
+    metrics.update(bench_tta(app_module, images, max(1, args.rounds // 4), args.warmup, sorted(args.tta_views)))
+    print("Benchmarking response post-processing and serialization...")
+    metrics.update(bench_serialization(app_module, images, args.rounds * 5, args.serialization_batch_sizes))
+    if not args.skip_e2e:
+        print("Benchmarking end-to-end /predict...")
+        metrics.update(bench_end_to_end(app_module, paths, max(1, args.rounds // 4), 1))
+    metrics["peak_rss_mb"] = peak_rss_mb()
+
+    write_results(args.output, metrics, {"settings": vars(args)})
+    print(f"\n📊 Results ({args.output}):")
+    for name, value in sorted(metrics.items()):
+        print(f"  {name}: {value}")
+
+    if args.update_baseline:
+        write_results(args.baseline, metrics, {"settings": vars(args)})
+        print(f"\n✅ Baseline updated: {args.baseline}")
+        return True
+
+    if not os.path.exists(args.baseline):
+        print(f"\n⚠️  No baseline at {args.baseline}; run with --update-baseline to create one")
+        return True
+
+    regressions = compare_to_baseline(metrics, args.baseline, args.tolerance)
+    if regressions:
+        print(f"\n❌ {len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}:")
+        for message in regressions:
+            print(f"  • {message}")
+        return False
+
+    print(f"\n✅ No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
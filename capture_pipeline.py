@@ -0,0 +1,235 @@
+"""
+Pipelined capture-and-predict for a scanner station
+
+A capture-and-predict request runs three stages: capture (wait for the finger
+and download the image over the serial link, seconds at 57600 baud), decode
+(open the BMP and run the quality gate) and inference (both models). Run
+back to back, a station's throughput is bounded by the sum of the three.
+
+CapturePipeline gives each stage its own worker thread, connected by bounded
+queues:
+
+    submit() -> [capture queue] -> capture -> [decode queue] -> decode -> [inference queue] -> inference
+
+so the sensor starts the next capture as soon as the previous image is
+downloaded, while that image is still being decoded and inferred, and
+throughput is limited by the slowest stage. The inference stage takes every
+image waiting in its queue (up to max_batch) and runs the models on them as
+one batch. Bounded queues give backpressure: a stage blocks when the next
+one falls behind instead of piling up images, and submit() refuses new
+requests with PipelineFull when the capture queue is full.
+
+Each request is a CaptureTicket whose concurrent.futures.Future is resolved
+with the ticket (image path and Prediction) or with the exception raised by
+the stage that failed. stats() reports per stage: items processed, busy
+fraction (occupancy), time spent blocked on a full downstream queue and the
+current queue depth.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image
+
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("capture", "decode", "inference")
+
+
+class PipelineFull(Exception):
+    """The capture queue is full; the station already has queue_size captures waiting"""
+
+
+class CaptureFailed(Exception):
+    """A stage could not produce its output; error is the type recorded on /metrics"""
+
+    def __init__(self, error: str, detail: str):
+        super().__init__(detail)
+        self.error = error
+        self.detail = detail
+
+
+class CaptureTicket:
+    """One capture-and-predict request moving through the pipeline"""
+
+    def __init__(self, tta_views: int = 1):
+        self.tta_views = tta_views
+        self.future: Future = Future()
+        self.filename: Optional[str] = None
+        self.image = None
+        self.prediction = None
+        self.submitted = time.perf_counter()
+        # Per stage: seconds waiting in the stage's queue and seconds being processed
+        self.timings: Dict[str, float] = {}
+
+
+class _StageStats:
+    def __init__(self):
+        self.items = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+
+
+class CapturePipeline:
+    """
+    Capture, decode and inference stages on their own threads with bounded queues between them.
+
+    capture() returns the saved image path or None (no finger), check(image) may raise to reject
+    an image (e.g. the quality gate), and predict_many(images, tta_views) returns one prediction
+    per image.
+    """
+
+    def __init__(self, capture: Callable[[], Optional[str]], predict_many: Callable[[List, int], List],
+                 check: Optional[Callable] = None, queue_size: int = 2, max_batch: int = 8):
+        self.capture = capture
+        self.predict_many = predict_many
+        self.check = check
+        self.queue_size = queue_size
+        self.max_batch = max_batch
+        self.queues = {stage: queue.Queue(maxsize=queue_size) for stage in STAGES}
+        self._stats = {stage: _StageStats() for stage in STAGES}
+        self._stats_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._started = time.perf_counter()
+            for stage in STAGES:
+                thread = threading.Thread(target=self._run_stage, args=(stage,), name=f"capture-pipeline-{stage}",
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        """Let queued captures finish, then stop the stage threads"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if threads:
+            self.queues["capture"].put(None)
+            for thread in threads:
+                thread.join(timeout)
+
+    def submit(self, tta_views: int = 1) -> CaptureTicket:
+        """Queue a capture; the ticket's future resolves once its prediction is ready"""
+        self.start()
+        ticket = CaptureTicket(tta_views)
+        try:
+            self.queues["capture"].put_nowait(ticket)
+        except queue.Full:
+            raise PipelineFull(f"{self.queue_size} captures are already waiting for the scanner")
+        return ticket
+
+    def _capture(self, tickets: List[CaptureTicket]):
+        for ticket in tickets:
+            filename = self.capture()
+            if filename is None:
+                raise CaptureFailed("no_fingerprint", "No fingerprint detected please try again")
+            ticket.filename = filename
+
+    def _decode(self, tickets: List[CaptureTicket]):
+        for ticket in tickets:
+            try:
+                with stage_timer("image_open"):
+                    image = Image.open(ticket.filename)
+                    image.load()
+            except Exception as e:
+                raise CaptureFailed("image_read_failed", f"Failed to read fingerprint image: {str(e)}")
+            if self.check is not None:
+                self.check(image)
+            ticket.image = image
+
+    def _infer(self, tickets: List[CaptureTicket]):
+        # One model pass per TTA setting present in the batch
+        for tta_views in sorted({ticket.tta_views for ticket in tickets}):
+            group = [ticket for ticket in tickets if ticket.tta_views == tta_views]
+            predictions = self.predict_many([ticket.image for ticket in group], tta_views)
+            for ticket, prediction in zip(group, predictions):
+                ticket.prediction = prediction
+
+    def _run_stage(self, stage: str):
+        process = {"capture": self._capture, "decode": self._decode, "inference": self._infer}[stage]
+        inbox = self.queues[stage]
+        outbox = self.queues[STAGES[STAGES.index(stage) + 1]] if stage != STAGES[-1] else None
+        batch_limit = self.max_batch if stage == "inference" else 1
+        stats = self._stats[stage]
+
+        while True:
+            ticket = inbox.get()
+            if ticket is None:
+                if outbox is not None:
+                    outbox.put(None)
+                return
+            tickets = [ticket]
+            stopping = False
+            while len(tickets) < batch_limit:
+                try:
+                    ticket = inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if ticket is None:
+                    stopping = True
+                    break
+                tickets.append(ticket)
+
+            start = time.perf_counter()
+            for ticket in tickets:
+                ticket.timings[f"{stage}_wait"] = start - ticket.timings.pop("_queued", ticket.submitted)
+            try:
+                process(tickets)
+                failed = None
+            except Exception as e:
+                failed = e
+            seconds = time.perf_counter() - start
+            # Captures and decodes are one ticket at a time; a failed inference batch fails all of its tickets
+            for ticket in tickets:
+                ticket.timings[stage] = seconds
+            with self._stats_lock:
+                stats.busy_seconds += seconds
+                stats.items += len(tickets)
+                if failed is not None:
+                    stats.failed += len(tickets)
+
+            for ticket in tickets:
+                if failed is not None:
+                    ticket.future.set_exception(failed)
+                elif outbox is None:
+                    ticket.future.set_result(ticket)
+                else:
+                    ticket.timings["_queued"] = time.perf_counter()
+                    blocked_start = time.perf_counter()
+                    outbox.put(ticket)  # Blocks while the next stage is queue_size items behind
+                    with self._stats_lock:
+                        stats.blocked_seconds += time.perf_counter() - blocked_start
+
+            if stopping:
+                if outbox is not None:
+                    outbox.put(None)
+                return
+
+    def stats(self) -> Dict:
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        with self._stats_lock:
+            stages = {
+                stage: {
+                    "items": stats.items,
+                    "failed": stats.failed,
+                    "busy_seconds": round(stats.busy_seconds, 3),
+                    "occupancy": round(stats.busy_seconds / elapsed, 3) if elapsed else 0.0,
+                    "blocked_seconds": round(stats.blocked_seconds, 3),
+                    "mean_ms": round(stats.busy_seconds / stats.items * 1000, 1) if stats.items else None,
+                    "queue_depth": self.queues[stage].qsize(),
+                }
+                for stage, stats in self._stats.items()
+            }
+        return {"running": bool(self._threads), "queue_size": self.queue_size, "stages": stages}
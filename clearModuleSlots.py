@@ -7,8 +7,9 @@ Clears saved fingerprint slots/templates from the R307S module
 import os
 import sys
 import argparse
-from typing import Optional, List
+from typing import Dict, Iterable, Optional, List, Tuple
 import logging
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,32 +23,54 @@ except ImportError:
     subprocess.check_call([sys.executable, "-m", "pip", "install", "pyfingerprint"])
     from pyfingerprint.pyfingerprint import PyFingerprint
 
+# Sensor backend: "hardware" talks to the R307S over serial, "simulated" uses simulated_sensor.py
+SCANNER_BACKEND = os.environ.get("BIOPRINT_SCANNER", "hardware")
+# Serial link settings shared with the API (see fingerprint-scanner.py)
+SCANNER_PORT = os.environ.get("BIOPRINT_SCANNER_PORT", "COM7")
+SCANNER_BAUDRATE = int(os.environ.get("BIOPRINT_SCANNER_BAUDRATE", "57600"))
+SCANNER_TARGET_BAUDRATE = int(os.environ.get("BIOPRINT_SCANNER_TARGET_BAUDRATE", "0"))
+
+def create_sensor(port: str, baudrate: int, address: int, password: int):
+    """Open the configured sensor backend"""
+    if SCANNER_BACKEND == "simulated":
+        from simulated_sensor import SimulatedPyFingerprint
+        return SimulatedPyFingerprint(port, baudrate, address, password)
+    return PyFingerprint(port, baudrate, address, password)
+
+# Slots per getTemplateIndex page, and the capacity assumed when the module does not report it
+INDEX_PAGE_SIZE = 256
+DEFAULT_CAPACITY = 1000
+
 class R307FingerprintClear:
     """R307S fingerprint sensor database management"""
     
-    def __init__(self, port: str = 'COM7', baudrate: int = 57600, address: int = 0xFFFFFFFF, password: int = 0x00000000):
+    def __init__(self, port: str = SCANNER_PORT, baudrate: int = SCANNER_BAUDRATE, address: int = 0xFFFFFFFF,
+                 password: int = 0x00000000, fallback_baudrates: List[int] = ()):
         self.port = port
         self.baudrate = baudrate
+        # Also tried when the module does not answer at baudrate (e.g. the API switched it to a faster rate)
+        self.fallback_baudrates = [rate for rate in fallback_baudrates if rate and rate != baudrate]
         self.address = address
         self.password = password
         self.fingerprint = None
         
     def connect(self) -> bool:
         """Initialize connection to the sensor"""
-        try:
-            logger.info(f"Connecting to {self.port} at {self.baudrate} baud...")
-            self.fingerprint = PyFingerprint(self.port, self.baudrate, self.address, self.password)
-            
-            if not self.fingerprint.verifyPassword():
-                logger.error("The given fingerprint sensor password is wrong")
-                return False
-            
-            logger.info("✅ Sensor connected and verified successfully!")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to initialize sensor: {e}")
-            return False
+        for baudrate in [self.baudrate] + self.fallback_baudrates:
+            try:
+                logger.info(f"Connecting to {self.port} at {baudrate} baud...")
+                self.fingerprint = create_sensor(self.port, baudrate, self.address, self.password)
+                
+                if not self.fingerprint.verifyPassword():
+                    logger.error("The given fingerprint sensor password is wrong")
+                    return False
+                
+                logger.info("✅ Sensor connected and verified successfully!")
+                return True
+                
+            except Exception as e:
+                logger.error(f"Failed to initialize sensor at {baudrate} baud: {e}")
+        return False
     
     def disconnect(self):
         """Close connection to sensor"""
@@ -67,8 +90,31 @@ class R307FingerprintClear:
             logger.error(f"Failed to get template count: {e}")
             return -1
     
+    def get_capacity(self) -> int:
+        """Number of template slots of the module"""
+        try:
+            return self.fingerprint.getStorageCapacity()
+        except Exception as e:
+            logger.warning(f"Could not read storage capacity ({e}); assuming {DEFAULT_CAPACITY}")
+            return DEFAULT_CAPACITY
+    
     def list_templates(self) -> List[int]:
-        """List all stored template positions"""
+        """List all stored template positions from the module's index table (one command per 256 slots)"""
+        try:
+            capacity = self.get_capacity()
+            templates = []
+            for page in range(-(-capacity // INDEX_PAGE_SIZE)):
+                used = self.fingerprint.getTemplateIndex(page)
+                start = page * INDEX_PAGE_SIZE
+                templates.extend(start + offset for offset, occupied in enumerate(used)
+                                 if occupied and start + offset < capacity)
+            return templates
+        except Exception as e:
+            logger.warning(f"Could not read the template index ({e}); scanning slots one by one")
+            return self._scan_templates()
+    
+    def _scan_templates(self) -> List[int]:
+        """Slow fallback for modules without getTemplateIndex: try to load every slot"""
         try:
             templates = []
             count = self.get_template_count()
@@ -94,6 +140,52 @@ class R307FingerprintClear:
             logger.error(f"Failed to list templates: {e}")
             return []
     
+    def delete_range(self, start: int, count: int) -> bool:
+        """Delete `count` consecutive templates starting at `start` with one command"""
+        try:
+            self.fingerprint.deleteTemplate(start, count)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to delete templates {format_ranges([(start, count)])}: {e}")
+            return False
+    
+    def clear_slots(self, positions: Iterable[int]) -> Dict:
+        """
+        Delete the templates at the given positions over one connection. Contiguous positions are
+        coalesced into one multi-template delete command each. Returns counts and the elapsed time.
+        """
+        start_time = time.perf_counter()
+        result = {"requested": 0, "stored_before": 0, "commands": 0, "failed_ranges": [], "seconds": 0.0}
+        if not self.connect():
+            return None
+        
+        try:
+            capacity = self.get_capacity()
+            wanted = sorted(set(positions))
+            invalid = [position for position in wanted if position < 0 or position >= capacity]
+            if invalid:
+                logger.error(f"Positions outside 0-{capacity - 1}: {format_ranges(coalesce_ranges(invalid))}")
+                return None
+            result["requested"] = len(wanted)
+            
+            stored = set(self.list_templates())
+            result["stored_before"] = len(stored.intersection(wanted))
+            
+            ranges = coalesce_ranges(wanted)
+            logger.info(f"Deleting {len(wanted)} slot(s) in {len(ranges)} command(s): {format_ranges(ranges)}")
+            for start, count in ranges:
+                result["commands"] += 1
+                if not self.delete_range(start, count):
+                    result["failed_ranges"].append((start, count))
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error during slot clearing: {e}")
+            return None
+        finally:
+            self.disconnect()
+            result["seconds"] = time.perf_counter() - start_time
+    
     def delete_template(self, position: int) -> bool:
         """Delete a specific template at given position"""
         try:
@@ -174,28 +266,31 @@ class R307FingerprintClear:
     
     def show_database_status(self):
         """Show current database status"""
+        start_time = time.perf_counter()
         if not self.connect():
             return False
         
         try:
             count = self.get_template_count()
+            capacity = self.get_capacity()
+            templates = self.list_templates() if count > 0 else []
             
             print(f"\n{'='*50}")
             print(f"📊 R307S Database Status")
             print(f"{'='*50}")
-            print(f"Total templates stored: {count}")
+            print(f"Total templates stored: {count} of {capacity} slots")
             
             if count > 0:
-                templates = self.list_templates()
                 if templates:
                     print(f"\nStored template positions:")
-                    for pos in sorted(templates):
-                        print(f"  • Slot {pos}")
+                    for start, length in coalesce_ranges(templates):
+                        print(f"  • Slot {format_ranges([(start, length)])}")
                 else:
                     print("\n⚠️  Could not enumerate template positions")
             else:
                 print("\n✅ Database is empty")
             
+            print(f"\nRead in {time.perf_counter() - start_time:.2f}s")
             print(f"{'='*50}\n")
             
             return True
@@ -206,6 +301,42 @@ class R307FingerprintClear:
         finally:
             self.disconnect()
 
+def coalesce_ranges(positions: Iterable[int]) -> List[Tuple[int, int]]:
+    """Sorted positions as (start, count) runs of consecutive slots"""
+    ranges = []
+    for position in sorted(set(positions)):
+        if ranges and position == ranges[-1][0] + ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + 1)
+        else:
+            ranges.append((position, 1))
+    return ranges
+
+def format_ranges(ranges: List[Tuple[int, int]]) -> str:
+    """(start, count) runs as text such as 10-200, 250"""
+    return ", ".join(str(start) if count == 1 else f"{start}-{start + count - 1}" for start, count in ranges)
+
+def parse_slots(spec: str) -> List[int]:
+    """Slot positions from text such as 10-200, 5,7,9 or a mix like 0-9, 20 30-39"""
+    positions = []
+    for part in spec.replace(",", " ").split():
+        if "-" in part:
+            first, last = part.split("-", 1)
+            first, last = int(first), int(last)
+            if last < first:
+                raise ValueError(f"Invalid range {part}")
+            positions.extend(range(first, last + 1))
+        else:
+            positions.append(int(part))
+    return positions
+
+def read_slots_file(path: str) -> List[int]:
+    """Slot positions listed in a file, in the parse_slots format; text after # is ignored"""
+    positions = []
+    with open(path) as f:
+        for line in f:
+            positions.extend(parse_slots(line.split("#", 1)[0]))
+    return positions
+
 def main():
     """Main function with command line arguments"""
     parser = argparse.ArgumentParser(
@@ -217,13 +348,15 @@ Examples:
   python clearModuleSlots.py --clear-all           # Clear all templates
   python clearModuleSlots.py --clear-slot 5        # Clear template at position 5
   python clearModuleSlots.py --list                # List all stored template positions
+  python clearModuleSlots.py --clear-range 10-200   # Clear templates 10 to 200 (one delete command)
+  python clearModuleSlots.py --clear-slots-from stale_slots.txt   # Clear the positions listed in a file
         """
     )
     
-    parser.add_argument('--port', type=str, default='COM7', 
-                       help='Serial port (default: COM7)')
-    parser.add_argument('--baudrate', type=int, default=57600,
-                       help='Baud rate (default: 57600)')
+    parser.add_argument('--port', type=str, default=SCANNER_PORT, 
+                       help=f'Serial port (default: {SCANNER_PORT})')
+    parser.add_argument('--baudrate', type=int, default=SCANNER_BAUDRATE,
+                       help=f'Baud rate (default: {SCANNER_BAUDRATE}); the BIOPRINT_SCANNER_TARGET_BAUDRATE rate is tried next')
     parser.add_argument('--status', action='store_true',
                        help='Show current database status')
     parser.add_argument('--list', action='store_true',
@@ -232,6 +365,10 @@ Examples:
                        help='Clear all templates from database')
     parser.add_argument('--clear-slot', type=int, metavar='POSITION',
                        help='Clear template at specific position (0-161)')
+    parser.add_argument('--clear-range', type=str, metavar='RANGES',
+                       help='Clear templates in ranges such as 10-200 or "0-9,20,30-39"')
+    parser.add_argument('--clear-slots-from', type=str, metavar='FILE',
+                       help='Clear the template positions listed in FILE (positions or ranges, # comments)')
     parser.add_argument('--yes', action='store_true',
                        help='Skip confirmation prompt for --clear-all')
     
@@ -241,7 +378,8 @@ Examples:
     print("=" * 50)
     
     # Create clear instance
-    clear_tool = R307FingerprintClear(port=args.port, baudrate=args.baudrate)
+    clear_tool = R307FingerprintClear(port=args.port, baudrate=args.baudrate,
+                                      fallback_baudrates=[SCANNER_TARGET_BAUDRATE])
     
     success = False
     
@@ -262,8 +400,8 @@ Examples:
                 templates = clear_tool.list_templates()
                 if templates:
                     print(f"\n📋 Stored template positions:")
-                    for pos in sorted(templates):
-                        print(f"  • Slot {pos}")
+                    for start, length in coalesce_ranges(templates):
+                        print(f"  • Slot {format_ranges([(start, length)])}")
                 else:
                     print("\n⚠️  Could not enumerate template positions")
             else:
@@ -287,6 +425,32 @@ Examples:
             else:
                 print("\n❌ Failed to clear templates")
                 
+        elif args.clear_range is not None or args.clear_slots_from is not None:
+            # Clear ranges/lists of slots over one connection
+            try:
+                if args.clear_range is not None:
+                    positions = parse_slots(args.clear_range)
+                else:
+                    positions = read_slots_file(args.clear_slots_from)
+            except (OSError, ValueError) as e:
+                print(f"❌ Invalid slot list: {e}")
+                return False
+            if not positions:
+                print("❌ No slot positions given")
+                return False
+            
+            result = clear_tool.clear_slots(positions)
+            if result is None:
+                print("\n❌ Failed to clear templates")
+                return False
+            
+            print(f"\n{'✅' if not result['failed_ranges'] else '⚠️ '} Cleared {result['requested']} slot(s) "
+                  f"({result['stored_before']} stored) with {result['commands']} delete command(s) "
+                  f"in {result['seconds']:.2f}s")
+            if result["failed_ranges"]:
+                print(f"   Failed: {format_ranges(result['failed_ranges'])}")
+            success = not result["failed_ranges"]
+            
         elif args.clear_slot is not None:
             # Clear specific slot
             if args.clear_slot < 0 or args.clear_slot > 161:
@@ -311,6 +475,7 @@ Examples:
             print("  python clearModuleSlots.py --list                # List all templates")
             print("  python clearModuleSlots.py --clear-all           # Clear all templates")
             print("  python clearModuleSlots.py --clear-slot 5        # Clear specific slot")
+            print("  python clearModuleSlots.py --clear-range 10-200  # Clear a range of slots")
             
     except KeyboardInterrupt:
         print("\n\n❌ Operation cancelled by user")
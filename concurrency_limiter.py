@@ -0,0 +1,188 @@
+"""
+Adaptive concurrency limit for the inference endpoints
+
+Under a burst every request used to be accepted: the inference queue grew,
+every request slowed down together and clients timed out at once.
+AdaptiveConcurrencyLimiter caps the requests doing inference at a limit that
+follows the observed inference latency, and rejects the excess immediately
+(app.py answers 503 with Retry-After) so the accepted ones stay fast.
+
+Each request holds a slot for its duration and reports the latency of its
+inference (scheduler queue wait plus model time) with slot.observe() or
+slot.measure(). Samples are averaged over windows of about one request
+latency (or `limit` samples, whichever comes first), and the limit is
+updated once per window, like a congestion window once per round trip.
+Two latencies are tracked: a short-term average of the windows and a
+no-load baseline. The baseline drops to any lower short-term latency and
+only rises (slowly) from windows where less than half the limit was in use,
+so a sustained overload cannot drag it up with it. With the limit at L,
+after each window:
+
+- gradient (default): gradient = clamp(tolerance * baseline / short, 0.5, 1),
+  new limit = L * gradient + sqrt(L), smoothed. Latency rising above the
+  baseline shrinks the limit in proportion; the sqrt(L) headroom lets it
+  grow again when latency is at the baseline.
+- aimd: when the sample is above tolerance * baseline the limit is
+  multiplied by backoff, otherwise it grows by 1.
+
+The limit only grows while at least half of it is in use, so an idle server
+does not drift to max_limit. It stays within [min_limit, max_limit].
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+GRADIENT = "gradient"
+AIMD = "aimd"
+ALGORITHMS = (GRADIENT, AIMD)
+
+
+class Overloaded(Exception):
+    """Every slot is taken; retry_after is a hint in whole seconds"""
+
+    def __init__(self, limit: int, retry_after: int):
+        super().__init__(f"{limit} requests are already running inference")
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+class Slot:
+    """One admitted request; its inference latency becomes a sample when it is released"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.latency: Optional[float] = None
+
+    def observe(self, seconds: float) -> None:
+        self.latency = (self.latency or 0.0) + seconds
+
+    @contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class AdaptiveConcurrencyLimiter:
+    """Concurrency limit adapted to inference latency; acquire() raises Overloaded beyond it"""
+
+    def __init__(self, initial_limit: int = 16, min_limit: int = 2, max_limit: int = 128,
+                 algorithm: str = GRADIENT, tolerance: float = 1.5, backoff: float = 0.9, smoothing: float = 0.2,
+                 short_alpha: float = 0.5, long_alpha: float = 0.05, min_window: float = 0.05,
+                 enabled: bool = True):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown algorithm {algorithm!r}; expected one of {', '.join(ALGORITHMS)}")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.algorithm = algorithm
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.short_alpha = short_alpha
+        self.long_alpha = long_alpha
+        self.enabled = enabled
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.in_flight = 0
+        self.short_latency: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+        self.accepted = 0
+        self.rejected = 0
+        self.samples = 0
+        self.min_window = min_window
+        self._window_sum = 0.0
+        self._window_count = 0
+        self._window_peak = 0  # Highest in_flight seen in the window
+        self._window_start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def acquire(self) -> Slot:
+        with self._lock:
+            if self.enabled and self.in_flight >= self.limit:
+                self.rejected += 1
+                raise Overloaded(self.limit, self._retry_after())
+            self.in_flight += 1
+            self.accepted += 1
+        return Slot()
+
+    def release(self, slot: Slot) -> None:
+        with self._lock:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            if slot.latency is not None:
+                self._sample(slot.latency, in_flight)
+
+    @contextmanager
+    def slot(self):
+        """acquire() and release() around a block"""
+        slot = self.acquire()
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def _retry_after(self) -> int:
+        """Seconds until a slot is likely free: the recent latency scaled by the backlog"""
+        latency = self.short_latency or 1.0
+        return max(1, math.ceil(latency * self.in_flight / max(self.limit, 1)))
+
+    def _sample(self, latency: float, in_flight: int):
+        self.samples += 1
+        self._window_sum += latency
+        self._window_count += 1
+        self._window_peak = max(self._window_peak, in_flight)
+        now = time.perf_counter()
+        window = max(self.min_window, self.short_latency or 0.0)
+        if now - self._window_start < window and self._window_count < self._limit:
+            return
+        self._update(self._window_sum / self._window_count, self._window_peak)
+        self._window_sum, self._window_count, self._window_peak = 0.0, 0, 0
+        self._window_start = now
+
+    def _update(self, latency: float, in_flight: int):
+        if self.short_latency is None:
+            self.short_latency = self.baseline_latency = latency
+            return
+        self.short_latency += self.short_alpha * (latency - self.short_latency)
+        can_grow = in_flight * 2 >= self._limit
+        if self.short_latency < self.baseline_latency:
+            self.baseline_latency = self.short_latency
+        elif not can_grow:
+            # Lightly loaded: the latency is close to no-load, so the baseline may follow it up
+            self.baseline_latency += self.long_alpha * (self.short_latency - self.baseline_latency)
+
+        if self.algorithm == GRADIENT:
+            gradient = max(0.5, min(1.0, self.tolerance * self.baseline_latency / self.short_latency))
+            new_limit = self._limit * gradient + (math.sqrt(self._limit) if can_grow else 0.0)
+            if new_limit > self._limit and not can_grow:
+                new_limit = self._limit
+            limit = self._limit * (1 - self.smoothing) + new_limit * self.smoothing
+        elif latency > self.tolerance * self.baseline_latency:
+            limit = self._limit * self.backoff
+        else:
+            limit = self._limit + 1 if can_grow else self._limit
+        self._limit = min(max(limit, self.min_limit), self.max_limit)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "algorithm": self.algorithm,
+                "limit": self.limit,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "in_flight": self.in_flight,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "latency_ms": round(self.short_latency * 1000, 1) if self.short_latency is not None else None,
+                "baseline_latency_ms": (round(self.baseline_latency * 1000, 1)
+                                        if self.baseline_latency is not None else None),
+            }
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Convert Keras .h5 models into flat, memory-mappable weight files
+
+Writes VGG16.bpw next to VGG16.h5 (and so on). The API then memory-maps the weight
+file instead of parsing the .h5 on every start (see model_loader.py). Re-run after
+replacing a .h5 model; weight files older than their .h5 are ignored.
+
+Examples:
+  python convert_weights.py
+  python convert_weights.py VGG16.h5
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from model_loader import WEIGHT_FILE_EXTENSION, read_h5_weights, read_weight_file, write_weight_file
+
+
+def convert(path: str) -> bool:
+    """Convert one model and check the written file against the .h5"""
+    output = os.path.splitext(path)[0] + WEIGHT_FILE_EXTENSION
+
+    start = time.perf_counter()
+    weights = read_h5_weights(path)
+    size = write_weight_file(weights, output)
+    elapsed = time.perf_counter() - start
+
+    converted = read_weight_file(output)
+    if converted.config != weights.config or list(converted.layers) != list(weights.layers):
+        print(f"❌ {output}: model config or layers differ from {path}")
+        return False
+    for layer_name, arrays in weights.layers.items():
+        if not all(np.array_equal(a, b) for a, b in zip(arrays, converted.layers[layer_name])):
+            print(f"❌ {output}: weights of layer {layer_name} differ from {path}")
+            return False
+
+    print(f"✅ {path} -> {output} ({size / (1024 * 1024):.1f} MB, {elapsed:.2f} s)")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert .h5 models into memory-mappable weight files")
+    parser.add_argument('models', nargs='*', default=['VGG16.h5', 'MobileNetV2.h5'],
+                        help='Models to convert (default: VGG16.h5 MobileNetV2.h5)')
+    args = parser.parse_args()
+
+    success = True
+    for path in args.models:
+        if not os.path.exists(path):
+            print(f"❌ Model not found: {path}")
+            success = False
+            continue
+        try:
+            success = convert(path) and success
+        except Exception as e:
+            print(f"❌ Failed to convert {path}: {e}")
+            success = False
+    return success
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
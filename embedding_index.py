@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Similarity index over fingerprint embeddings
+
+EmbeddingIndex keeps the normalized embeddings (embeddings.py) of stored
+captures in one contiguous float32 matrix, keyed by the image's SHA-256, and
+answers "which prior captures look like this one":
+
+- exact: one matrix-vector product over every row (brute force), then a
+  partial sort for the top k; exact and fast up to a few hundred thousand
+  captures
+- ivf: an inverted file. train() clusters the vectors with spherical k-means
+  into n_lists cells; a query scores the cell centroids, then only the rows of
+  its nprobe nearest cells. Approximate (a match in another cell is missed)
+  but touches about nprobe / n_lists of the rows. Vectors added after training
+  are assigned to their nearest cell.
+
+Similarities are cosine similarities (dot products of unit vectors), so 1.0
+is an identical image and near-duplicates score close to it.
+
+The index is saved as a single .npz (vectors, hashes, paths, centroids) and
+written atomically. One index holds embeddings of one model.
+
+Examples:
+  python embedding_index.py build Images/store
+  python embedding_index.py query fingerprint.bmp -k 5
+  python embedding_index.py train --lists 64
+  python embedding_index.py duplicates --threshold 0.98
+  python embedding_index.py stats
+"""
+
+import argparse
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX = "embeddings/index.npz"
+MODEL_FILES = {"vgg16": "VGG16.h5", "mobilenetv2": "MobileNetV2.h5"}
+IMAGE_EXTENSIONS = (".bmp", ".png", ".webp", ".jpg", ".jpeg")
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 256  # Training vectors per cell; the rest are only assigned
+ASSIGN_CHUNK = 65536  # Rows scored against the centroids at a time
+
+_SHA256_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+
+class EmbeddingIndex:
+    """Embeddings of one model by image hash, with exact and IVF search"""
+
+    def __init__(self, model: str, layer: Optional[str] = None):
+        self.model = model
+        self.layer = layer
+        self.ids: List[str] = []
+        self.paths: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._added = np.zeros(0, dtype=np.float64)
+        self.centroids: Optional[np.ndarray] = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists: Optional[List[np.ndarray]] = None
+        self.dirty = False
+        self.saved = time.monotonic()
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()  # One writer at a time; searches only wait for the snapshot
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dimensions(self) -> int:
+        return self._vectors.shape[1]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """The stored (N, D) embeddings (a view; do not modify)"""
+        return self._vectors[:len(self.ids)]
+
+    def add(self, image_id: str, vector: np.ndarray, path: str = "") -> None:
+        """Add or replace the embedding of an image"""
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        with self._lock:
+            if len(self.ids) == 0 and self._vectors.shape[1] != len(vector):
+                self._vectors = np.zeros((0, len(vector)), dtype=np.float32)
+            if len(vector) != self.dimensions:
+                raise ValueError(f"Embedding has {len(vector)} dimensions, the index holds {self.dimensions}")
+
+            row = self._rows.get(image_id)
+            if row is None:
+                row = len(self.ids)
+                self._grow(row + 1)
+                self.ids.append(image_id)
+                self.paths.append(path)
+                self._rows[image_id] = row
+            elif path:
+                self.paths[row] = path
+            self._vectors[row] = vector
+            self._added[row] = time.time()
+            if self.centroids is not None:
+                self._assignments[row] = int(np.argmax(self.centroids @ vector))
+                self._lists = None
+            self.dirty = True
+
+    def _grow(self, size: int):
+        """Capacity doubling, so adding one capture at a time stays amortized O(D)"""
+        if size <= len(self._vectors):
+            return
+        capacity = max(size, 2 * len(self._vectors), 64)
+        for name in ("_vectors", "_added", "_assignments"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def get(self, image_id: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._rows.get(image_id)
+            return self._vectors[row].copy() if row is not None else None
+
+    def train(self, n_lists: int, seed: int = 0) -> None:
+        """Cluster the vectors into n_lists IVF cells (spherical k-means on a sample)"""
+        with self._lock:
+            vectors = self.vectors
+            if len(vectors) < n_lists:
+                raise ValueError(f"Need at least {n_lists} vectors to train {n_lists} lists, have {len(vectors)}")
+            rng = np.random.default_rng(seed)
+            sample_size = min(len(vectors), n_lists * KMEANS_SAMPLE_PER_LIST)
+            sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+            centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+            for _ in range(KMEANS_ITERATIONS):
+                assignments = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignments, sample)
+                counts = np.bincount(assignments, minlength=n_lists)
+                filled = counts > 0  # Empty cells keep their centroid
+                norms = np.linalg.norm(sums[filled], axis=1, keepdims=True)
+                centroids[filled] = sums[filled] / np.maximum(norms, 1e-12)
+            self.centroids = centroids.astype(np.float32)
+            self._assignments[:len(vectors)] = self._assign(vectors)
+            self._lists = None
+            self.dirty = True
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.concatenate([
+            np.argmax(vectors[start:start + ASSIGN_CHUNK] @ self.centroids.T, axis=1)
+            for start in range(0, len(vectors), ASSIGN_CHUNK)
+        ]).astype(np.int32) if len(vectors) else np.zeros(0, dtype=np.int32)
+
+    def _inverted_lists(self) -> List[np.ndarray]:
+        if self._lists is None:
+            assignments = self._assignments[:len(self.ids)]
+            order = np.argsort(assignments, kind="stable")
+            bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        return self._lists
+
+    def search(self, query: np.ndarray, k: int = 5, mode: str = "exact", nprobe: int = 8,
+               exclude: Optional[str] = None) -> List[Tuple[str, str, float]]:
+        """(image hash, path, similarity) of the k most similar stored images, most similar first"""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        with self._lock:
+            if not self.ids:
+                return []
+            if len(query) != self.dimensions:
+                raise ValueError(f"Query has {len(query)} dimensions, the index holds {self.dimensions}")
+            if mode == "ivf" and self.centroids is not None:
+                lists = self._inverted_lists()
+                cells = np.argsort(-(self.centroids @ query))[:nprobe]
+                rows = np.concatenate([lists[cell] for cell in cells])
+            elif mode in ("exact", "ivf"):
+                rows = None
+            else:
+                raise ValueError(f"Unknown search mode {mode!r}; expected exact or ivf")
+
+            candidates = self.vectors if rows is None else self._vectors[rows]
+            scores = candidates @ query
+            excluded = self._rows.get(exclude) if exclude is not None else None
+            if excluded is not None:
+                position = excluded if rows is None else np.flatnonzero(rows == excluded)
+                scores[position] = -np.inf
+            count = min(k, len(scores))
+            if count <= 0:
+                return []
+            top = np.argpartition(-scores, count - 1)[:count]
+            top = top[np.argsort(-scores[top])]
+            matches = []
+            for position in top:
+                if not np.isfinite(scores[position]):
+                    continue  # The excluded image
+                row = int(position) if rows is None else int(rows[position])
+                matches.append((self.ids[row], self.paths[row], float(scores[position])))
+            return matches
+
+    def duplicates(self, threshold: float = 0.98, block: int = 1024) -> List[Tuple[str, str, float]]:
+        """Every pair of stored images with similarity >= threshold (blocked all-pairs products)"""
+        with self._lock:
+            vectors = self.vectors
+            pairs = []
+            for start in range(0, len(vectors), block):
+                scores = vectors[start:start + block] @ vectors[start:].T
+                rows, columns = np.nonzero(scores >= threshold)
+                for row, column in zip(rows, columns):
+                    if column > row:  # Upper triangle only, no self-pairs
+                        pairs.append((self.ids[start + row], self.ids[start + column], float(scores[row, column])))
+            return sorted(pairs, key=lambda pair: -pair[2])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "model": self.model,
+                "layer": self.layer,
+                "images": len(self.ids),
+                "dimensions": self.dimensions,
+                "size_mb": round(self.vectors.nbytes / (1024 * 1024), 2),
+                "ivf_lists": len(self.centroids) if self.centroids is not None else None,
+                "unsaved_changes": self.dirty,
+            }
+
+    def save(self, path: str) -> None:
+        """Write the index to path atomically; the lock is only held while the arrays are copied"""
+        with self._save_lock:
+            with self._lock:
+                count = len(self.ids)
+                arrays = {
+                    "model": np.array(self.model),
+                    "layer": np.array(self.layer or ""),
+                    "ids": np.array(self.ids, dtype=str),
+                    "paths": np.array(self.paths, dtype=str),
+                    "vectors": self.vectors.copy(),
+                    "added": self._added[:count].copy(),
+                    "centroids": (self.centroids.copy() if self.centroids is not None
+                                  else np.zeros((0, self.dimensions), dtype=np.float32)),
+                    "assignments": self._assignments[:count].copy(),
+                }
+                self.dirty = False
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                temporary = path + ".tmp"
+                with open(temporary, "wb") as f:
+                    np.savez(f, **arrays)
+                os.replace(temporary, path)
+            except BaseException:
+                self.dirty = True  # The snapshot's changes are still unsaved
+                raise
+            self.saved = time.monotonic()
+
+    def save_if_due(self, path: str, interval: float) -> bool:
+        """Save when there are changes and the last save is at least interval seconds old"""
+        if self.dirty and time.monotonic() - self.saved >= interval:
+            self.save(path)
+            return True
+        return False
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingIndex":
+        with np.load(path, allow_pickle=False) as data:
+            index = cls(str(data["model"]), str(data["layer"]) or None)
+            index.ids = [str(image_id) for image_id in data["ids"]]
+            index.paths = [str(path) for path in data["paths"]]
+            index._rows = {image_id: row for row, image_id in enumerate(index.ids)}
+            index._vectors = np.array(data["vectors"], dtype=np.float32)
+            index._added = np.array(data["added"], dtype=np.float64)
+            index._assignments = np.array(data["assignments"], dtype=np.int32)
+            if len(data["centroids"]):
+                index.centroids = np.array(data["centroids"], dtype=np.float32)
+        return index
+
+    @classmethod
+    def open(cls, path: str, model: str, layer: Optional[str] = None) -> "EmbeddingIndex":
+        """The index saved at path, or a new empty one; refuses an index built with another model"""
+        if not os.path.exists(path):
+            return cls(model, layer)
+        index = cls.load(path)
+        if index.model != model:
+            raise ValueError(f"{path} holds {index.model} embeddings, not {model}")
+        return index
+
+
+def image_id(path: str) -> str:
+    """SHA-256 of an image file; image store files are already named by it"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if _SHA256_NAME.match(name):
+        return name
+    from image_store import file_sha256
+    return file_sha256(path)
+
+
+def find_images(paths: Sequence[str]) -> List[str]:
+    images = []
+    for path in paths:
+        if os.path.isfile(path):
+            images.append(path)
+            continue
+        for dirpath, _, filenames in os.walk(path):
+            images.extend(os.path.join(dirpath, filename) for filename in filenames
+                          if filename.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(images)
+
+
+def _extractor(model: str):
+    from embeddings import EmbeddingExtractor
+    from model_loader import load_model
+
+    return EmbeddingExtractor({model: load_model(MODEL_FILES[model])})
+
+
+def _open_images(paths: Sequence[str]):
+    from PIL import Image
+
+    images = []
+    for path in paths:
+        image = Image.open(path)
+        image.load()
+        images.append(image)
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the BioPrint fingerprint embedding index")
+    parser.add_argument('command', choices=['build', 'query', 'train', 'duplicates', 'stats'],
+                        help='Action to run')
+    parser.add_argument('paths', nargs='*',
+                        help='build: image files or directories to add; query: image files to look up')
+    parser.add_argument('--index', type=str, default=os.environ.get("BIOPRINT_EMBEDDING_INDEX") or DEFAULT_INDEX,
+                        help=f'Index file (default: {DEFAULT_INDEX})')
+    parser.add_argument('--model', choices=sorted(MODEL_FILES),
+                        default=os.environ.get("BIOPRINT_EMBEDDING_MODEL", "mobilenetv2"),
+                        help='Model whose embeddings the index holds (default: mobilenetv2)')
+    parser.add_argument('-k', '--top-k', type=int, default=5,
+                        help='Matches per query (default: 5)')
+    parser.add_argument('--ivf', action='store_true',
+                        help='Query the IVF cells instead of every vector (needs train)')
+    parser.add_argument('--nprobe', type=int, default=8,
+                        help='IVF cells searched per query (default: 8)')
+    parser.add_argument('--lists', type=int, default=64,
+                        help='IVF cells to train (default: 64)')
+    parser.add_argument('--threshold', type=float, default=0.98,
+                        help='Similarity reported as a near-duplicate (default: 0.98)')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Images embedded per model batch when building (default: 32)')
+    args = parser.parse_args()
+
+    try:
+        index = EmbeddingIndex.open(args.index, args.model)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return False
+
+    if args.command == 'stats':
+        for name, value in index.stats().items():
+            print(f"  {name}: {value}")
+        return True
+
+    if args.command == 'build':
+        images = find_images(args.paths)
+        if not images:
+            print("❌ No images found")
+            return False
+        extractor = _extractor(args.model)
+        index.layer = extractor.layer(args.model)
+        start = time.perf_counter()
+        for offset in range(0, len(images), args.batch_size):
+            batch = images[offset:offset + args.batch_size]
+            for path, vector in zip(batch, extractor.embed(_open_images(batch), args.model)):
+                index.add(image_id(path), vector, path)
+            print(f"  {min(offset + args.batch_size, len(images))}/{len(images)} images")
+        index.save(args.index)
+        print(f"✅ Indexed {len(images)} images in {time.perf_counter() - start:.1f} s "
+              f"({len(index)} in {args.index})")
+        return True
+
+    if not len(index):
+        print(f"❌ The index {args.index} is empty; run build first")
+        return False
+
+    if args.command == 'train':
+        start = time.perf_counter()
+        try:
+            index.train(args.lists)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return False
+        index.save(args.index)
+        print(f"✅ Trained {args.lists} IVF lists over {len(index)} vectors in {time.perf_counter() - start:.1f} s")
+    elif args.command == 'duplicates':
+        start = time.perf_counter()
+        pairs = index.duplicates(args.threshold)
+        for first, second, similarity in pairs:
+            print(f"  {similarity:.4f}  {first}  {second}")
+        print(f"\n📊 {len(pairs)} pairs at similarity >= {args.threshold} among {len(index)} images "
+              f"({time.perf_counter() - start:.2f} s)")
+    elif args.command == 'query':
+        if not args.paths:
+            print("❌ Give the images to look up")
+            return False
+        extractor = _extractor(args.model)
+        mode = "ivf" if args.ivf else "exact"
+        for path, vector in zip(args.paths, extractor.embed(_open_images(args.paths), args.model)):
+            start = time.perf_counter()
+            matches = index.search(vector, args.top_k, mode, args.nprobe)
+            print(f"🔍 {path} ({mode}, {(time.perf_counter() - start) * 1000:.2f} ms):")
+            for match_id, match_path, similarity in matches:
+                marker = " (near-duplicate)" if similarity >= args.threshold else ""
+                print(f"  {similarity:.4f}  {match_id}  {match_path}{marker}")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,104 @@
+"""
+Fingerprint embeddings from the prediction models
+
+Both CNNs end in a small classifier head (pooling, a hidden Dense layer,
+dropout, the 8-way softmax). The input to the softmax layer is a compact
+feature vector of the fingerprint. EmbeddingExtractor runs a model up to that
+layer and returns one L2-normalized vector per image, so cosine similarity is
+a dot product (see embedding_index.py):
+
+    extractor = EmbeddingExtractor({"vgg16": vgg16, "mobilenetv2": mobilenetv2})
+    vectors = extractor.embed(images, "mobilenetv2")  # (N, D) float32
+
+The truncated models share the loaded weights (model_loader.truncated_model),
+so extraction costs no extra memory and skips only the softmax layer.
+"""
+
+import threading
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from metrics import stage_timer
+from model_loader import truncated_model
+from preprocessing import preprocess
+
+DEFAULT_MODEL = "mobilenetv2"
+
+# Layers that are identity at inference and so do not change the embedding
+_PASSTHROUGH_LAYERS = ("Dropout", "SpatialDropout1D", "SpatialDropout2D", "GaussianNoise", "GaussianDropout")
+
+
+def embedding_layer_name(model) -> str:
+    """Name of the layer feeding the model's final (classifier) layer"""
+    layers = model.layers
+    for layer in reversed(layers[:-1]):
+        if type(layer).__name__ not in _PASSTHROUGH_LAYERS:
+            return layer.name
+    raise ValueError(f"Model {getattr(model, 'name', '')} has no layer before its classifier")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Rows scaled to unit length (zero rows stay zero)"""
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingExtractor:
+    """Penultimate-layer embeddings of a set of models, built on first use"""
+
+    def __init__(self, models: Dict[str, object]):
+        self.models = dict(models)
+        self._extractors: Dict[str, object] = {}
+        self._layers: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _extractor(self, name: str):
+        if name not in self.models:
+            raise ValueError(f"Unknown model {name!r}; expected one of {', '.join(self.models)}")
+        with self._lock:
+            if name not in self._extractors:
+                model = self.models[name]
+                self._layers[name] = embedding_layer_name(model)
+                self._extractors[name] = truncated_model(model, self._layers[name])
+            return self._extractors[name]
+
+    def layer(self, name: str = DEFAULT_MODEL) -> str:
+        """Name of the layer the embeddings of model `name` are taken from"""
+        self._extractor(name)
+        return self._layers[name]
+
+    def embed_processed(self, processed: np.ndarray, name: str = DEFAULT_MODEL) -> np.ndarray:
+        """Normalized embeddings of an already preprocessed (N, H, W, C) batch"""
+        extractor = self._extractor(name)
+        with stage_timer(f"{name}_embedding"):
+            return normalize(extractor.predict(processed, verbose=0))
+
+    def embed(self, images: Sequence, name: str = DEFAULT_MODEL) -> np.ndarray:
+        """Normalized embeddings of PIL images, one row per image"""
+        with stage_timer("preprocess"):
+            processed = np.concatenate([preprocess(image) for image in images])
+        return self.embed_processed(processed, name)
+
+    def runner(self, name: str = DEFAULT_MODEL):
+        """embed() for model `name` in the InferenceScheduler run signature (one vector per image)"""
+        self._extractor(name)  # Fail on unknown models when the request is made, not on the scheduler thread
+        return _SchedulerRun(self, name)
+
+
+class _SchedulerRun:
+    """Hashable and comparable, so the scheduler merges queued requests for the same model"""
+
+    def __init__(self, extractor: EmbeddingExtractor, name: str):
+        self.extractor = extractor
+        self.name = name
+
+    def __call__(self, images, tta_views, source, keys) -> List[np.ndarray]:
+        return list(self.extractor.embed(images, self.name))
+
+    def __eq__(self, other):
+        return isinstance(other, _SchedulerRun) and (other.extractor, other.name) == (self.extractor, self.name)
+
+    def __hash__(self):
+        return hash((id(self.extractor), self.name))
@@ -0,0 +1,230 @@
+"""
+Background fingerprint enrollment jobs
+
+An enrollment waits on the user for up to three sensor timeouts (place the
+finger, lift it, place it again), so the API runs it as a job on a worker
+thread instead of inside the request. Each job gets an id and records every
+stage change as an event:
+
+    queued -> place_finger -> remove_finger -> place_again -> storing -> stored
+                                                                       \\-> failed / cancelled
+
+Clients follow a job by polling its state or by subscribing to its events
+(served as server-sent events by app.py); subscribers are asyncio queues fed
+from the worker thread with call_soon_threadsafe, so a stage change reaches
+the client immediately and no thread is held per subscriber. Setting a job's
+cancel event stops the enrollment at the next sensor poll.
+
+The sensor can only run one enrollment at a time, so start() refuses a new
+job while one is active. Finished jobs are kept for keep_seconds.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STAGES = ("stored", "failed", "cancelled")
+
+# run(on_stage, cancel) -> (slot number or None, error reason or None)
+EnrollFunction = Callable[[Callable[[str, str], None], threading.Event], Tuple[Optional[int], Optional[str]]]
+
+
+class EnrollmentBusy(Exception):
+    """An enrollment job is already running on the sensor"""
+
+    def __init__(self, job: "EnrollmentJob"):
+        super().__init__(f"Enrollment job {job.id} is still running")
+        self.job = job
+
+
+class EnrollmentJob:
+    """State and event history of one enrollment"""
+
+    def __init__(self, job_id: str):
+        self.id = job_id
+        self.stage = "queued"
+        self.message = "Waiting for the sensor"
+        self.slot_number: Optional[int] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.events: List[Dict] = []
+        self.cancel_event = threading.Event()
+        self._subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+        self._lock = threading.Lock()
+        self._emit("queued", self.message)
+
+    @property
+    def done(self) -> bool:
+        return self.stage in TERMINAL_STAGES
+
+    def _emit(self, stage: str, message: str, **data) -> None:
+        """Record a stage change and push it to every subscriber"""
+        with self._lock:
+            self.stage = stage
+            self.message = message
+            event = {"seq": len(self.events) + 1, "job_id": self.id, "stage": stage, "message": message,
+                     "time": round(time.time(), 3)}
+            event.update(data)
+            self.events.append(event)
+            for loop, queue in self._subscribers:
+                try:
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+                except RuntimeError:
+                    pass  # The subscriber's event loop has been closed
+
+    def on_stage(self, stage: str, message: str) -> None:
+        """Stage callback passed to R307FingerprintCaptureLibrary.enroll_fingerprint"""
+        if not self.done:
+            self._emit(stage, message)
+
+    def finish(self, slot_number: Optional[int], error: Optional[str], message: str) -> None:
+        self.finished = time.time()
+        if slot_number is not None:
+            self.slot_number = slot_number
+            self._emit("stored", message, slot_number=slot_number)
+        elif error == "cancelled":
+            self.error = error
+            self._emit("cancelled", message)
+        else:
+            self.error = error or "enroll_failed"
+            self._emit("failed", message, error=self.error)
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "stage": self.stage,
+            "message": self.message,
+            "done": self.done,
+            "slot_number": self.slot_number,
+            "error": self.error,
+            "created": round(self.created, 3),
+            "finished": round(self.finished, 3) if self.finished else None,
+        }
+
+    async def subscribe(self, after: int = 0, heartbeat: float = 15.0) -> AsyncIterator[Optional[Dict]]:
+        """
+        Events with seq > after, then new ones as they happen, until the job finishes.
+        Yields None after `heartbeat` seconds without an event (to keep idle connections open).
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            backlog = [event for event in self.events if event["seq"] > after]
+            self._subscribers.append(subscriber)
+        try:
+            last = after
+            for event in backlog:
+                last = event["seq"]
+                yield event
+            while not self.done or last < len(self.events):
+                try:
+                    event = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event["seq"] <= last:
+                    continue  # Already sent from the backlog
+                last = event["seq"]
+                yield event
+        finally:
+            with self._lock:
+                self._subscribers.remove(subscriber)
+
+    async def wait(self) -> "EnrollmentJob":
+        """Wait for the job to finish without blocking the event loop"""
+        async for _ in self.subscribe(len(self.events)):
+            pass
+        return self
+
+
+def format_sse(event: Optional[Dict]) -> str:
+    """A job event as a server-sent event (None gives a keep-alive comment)"""
+    if event is None:
+        return ": keep-alive\n\n"
+    return f"id: {event['seq']}\nevent: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+
+
+class EnrollmentJobs:
+    """Registry running one enrollment job at a time on a worker thread"""
+
+    def __init__(self, enroll: EnrollFunction, error_messages: Optional[Dict[str, str]] = None,
+                 keep_seconds: float = 600.0):
+        self.enroll = enroll
+        self.error_messages = error_messages or {}
+        self.keep_seconds = keep_seconds
+        self._jobs: Dict[str, EnrollmentJob] = {}
+        self._active: Optional[EnrollmentJob] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> EnrollmentJob:
+        """Start a new enrollment; raises EnrollmentBusy while another one is running"""
+        with self._lock:
+            self._prune()
+            if self._active is not None and not self._active.done:
+                raise EnrollmentBusy(self._active)
+            job = EnrollmentJob(uuid.uuid4().hex)
+            self._jobs[job.id] = job
+            self._active = job
+        threading.Thread(target=self._run, args=(job,), name=f"enroll-{job.id[:8]}", daemon=True).start()
+        return job
+
+    def get(self, job_id: str) -> Optional[EnrollmentJob]:
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[EnrollmentJob]:
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def active(self) -> Optional[EnrollmentJob]:
+        with self._lock:
+            return self._active if self._active is not None and not self._active.done else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        active = self.active()
+        return {
+            "active_job": active.id if active else None,
+            "jobs": len(jobs),
+            "stored": sum(job.stage == "stored" for job in jobs),
+            "failed": sum(job.stage == "failed" for job in jobs),
+            "cancelled": sum(job.stage == "cancelled" for job in jobs),
+        }
+
+    def _prune(self):
+        cutoff = time.time() - self.keep_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _run(self, job: EnrollmentJob):
+        try:
+            if job.cancel_event.is_set():
+                slot_number, error = None, "cancelled"
+            else:
+                slot_number, error = self.enroll(job.on_stage, job.cancel_event)
+            message = None
+        except Exception as e:
+            logger.exception("Enrollment job %s failed", job.id)
+            slot_number, error, message = None, "enroll_failed", f"Fingerprint enrollment failed: {e}"
+        if message is None:
+            if slot_number is not None:
+                message = f"Fingerprint enrolled successfully in slot {slot_number}"
+            elif error == "cancelled":
+                message = "Enrollment cancelled"
+            else:
+                message = self.error_messages.get(error, "Fingerprint enrollment failed")
+        job.finish(slot_number, error, message)
@@ -11,13 +11,23 @@ Baudrate - 57600
 
 """
 
+import argparse
 import os
 import sys
 from datetime import datetime
-from typing import Optional
+from typing import Callable, Optional
 import logging
+import tempfile
 import time
 
+from PIL import Image
+
+from metrics import stage_timer
+from tracing import traced
+from sensor_transfer import (
+    IMAGE_BYTES, TransferStats, close_sensor, download_image_into, negotiate_baudrate, serial_port, unpack_image,
+)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -30,25 +40,66 @@ except ImportError:
     subprocess.check_call([sys.executable, "-m", "pip", "install", "pyfingerprint"])
     from pyfingerprint.pyfingerprint import PyFingerprint
 
+# Sensor backend: "hardware" talks to the R307S over serial, "simulated" uses simulated_sensor.py
+SCANNER_BACKEND = os.environ.get("BIOPRINT_SCANNER", "hardware")
+# Serial link: port and the rate the module is configured for, plus an optional faster rate to negotiate
+# (a multiple of 9600 up to 115200; 0 keeps SCANNER_BAUDRATE). See sensor_transfer.py.
+SCANNER_PORT = os.environ.get("BIOPRINT_SCANNER_PORT", "COM7")
+SCANNER_BAUDRATE = int(os.environ.get("BIOPRINT_SCANNER_BAUDRATE", "57600"))
+SCANNER_TARGET_BAUDRATE = int(os.environ.get("BIOPRINT_SCANNER_TARGET_BAUDRATE", "0"))
+
+# Stages reported by enroll_fingerprint(on_stage=...), in order
+ENROLL_STAGES = ["place_finger", "remove_finger", "place_again", "storing"]
+# Reasons left in enroll_error when enroll_fingerprint returns None
+ENROLL_ERRORS = {
+    "hardware_not_detected": "Hardware scanner not detected",
+    "first_capture_timeout": "First capture timeout, no finger was placed on the sensor",
+    "finger_not_removed": "The finger was not removed from the sensor",
+    "second_capture_timeout": "Second capture timeout, the finger was not placed again",
+    "mismatch": "Fingerprints do not match! Please try again.",
+    "store_failed": "The template could not be stored in the module",
+    "cancelled": "Enrollment cancelled",
+    "enroll_failed": "Fingerprint enrollment failed",
+}
+
+def create_sensor(port: str, baudrate: int, address: int, password: int):
+    """Open the configured sensor backend"""
+    if SCANNER_BACKEND == "simulated":
+        from simulated_sensor import SimulatedPyFingerprint
+        return SimulatedPyFingerprint(port, baudrate, address, password)
+    return PyFingerprint(port, baudrate, address, password)
+
+# Baud rate that last worked per port; a module switched to a faster rate may keep it across connections
+_link_baudrates = {}
+
 class R307FingerprintCaptureLibrary:
     """R307S fingerprint sensor capture using PyFingerprint library"""
     
-    def __init__(self, port: str = 'COM7', baudrate: int = 57600, address: int = 0xFFFFFFFF, password: int = 0x00000000):
+    def __init__(self, port: str = SCANNER_PORT, baudrate: int = SCANNER_BAUDRATE, address: int = 0xFFFFFFFF, password: int = 0x00000000,
+                 image_store=None, target_baudrate: Optional[int] = SCANNER_TARGET_BAUDRATE or None,
+                 raw_download: bool = True):
         self.port = port
         self.baudrate = baudrate
+        self.target_baudrate = target_baudrate  # Faster rate to switch the module to after connecting, if reliable
+        self.raw_download = raw_download
+        self.link_baudrate = baudrate  # Rate of the open connection
+        self.last_transfer = None  # sensor_transfer.TransferStats.to_dict() of the last raw image download
+        self._transfer_buffer = bytearray(IMAGE_BYTES)
         self.address = address
         self.password = password
         self.fingerprint = None
+        self.image_store = image_store  # image_store.ImageStore; None saves into Images/ directly
+        self.enroll_error = None  # Reason the last enroll_fingerprint failed, a key of ENROLL_ERRORS
         
     def connect(self) -> bool:
-        """Initialize connection to the sensor"""
+        """Initialize connection to the sensor, at the target baud rate when one is configured"""
         try:
-            logger.info(f"Connecting to {self.port} at {self.baudrate} baud...")
-            self.fingerprint = PyFingerprint(self.port, self.baudrate, self.address, self.password)
-            
-            if not self.fingerprint.verifyPassword():
-                logger.error("The given fingerprint sensor password is wrong")
-                return False
+            with stage_timer("scanner_connect") as span_attributes:
+                self.fingerprint, self.link_baudrate = self._open_link()
+                if self.target_baudrate and self.target_baudrate != self.link_baudrate:
+                    self._negotiate_baudrate()
+                _link_baudrates[self.port] = self.link_baudrate
+                span_attributes["baudrate"] = self.link_baudrate
             
             logger.info("✅ Sensor connected and verified successfully!")
             return True
@@ -57,12 +108,53 @@ class R307FingerprintCaptureLibrary:
             logger.error(f"Failed to initialize sensor: {e}")
             return False
     
+    def _open_link(self):
+        """
+        Open the sensor at the first baud rate that answers: the rate that last worked on this port,
+        then the configured rate, then the target rate (a module left at the target rate by a previous run)
+        """
+        rates = []
+        for rate in (_link_baudrates.get(self.port), self.baudrate, self.target_baudrate):
+            if rate and rate not in rates:
+                rates.append(rate)
+        error = None
+        for rate in rates:
+            logger.info(f"Connecting to {self.port} at {rate} baud...")
+            sensor = None
+            try:
+                sensor = create_sensor(self.port, rate, self.address, self.password)
+                verified = sensor.verifyPassword()
+            except Exception as e:
+                error = e
+                if sensor is not None:
+                    close_sensor(sensor)
+                continue
+            if not verified:
+                raise Exception("The given fingerprint sensor password is wrong")
+            return sensor, rate
+        raise error
+    
+    def _negotiate_baudrate(self):
+        """Switch the link to target_baudrate, keeping the current rate if it is unreliable"""
+        def open_at(rate: int):
+            return create_sensor(self.port, rate, self.address, self.password)
+        
+        try:
+            self.fingerprint, self.link_baudrate = negotiate_baudrate(
+                self.fingerprint, open_at, self.link_baudrate, [self.target_baudrate]
+            )
+        except Exception as e:
+            logger.warning(f"Baud rate negotiation failed ({e}); reconnecting")
+            _link_baudrates.pop(self.port, None)
+            self.fingerprint, self.link_baudrate = self._open_link()
+    
     def disconnect(self):
         """Close connection to sensor"""
         if self.fingerprint:
             try:
-                # PyFingerprint doesn't have explicit disconnect, but we can clear the reference
-                self.fingerprint = None
+                # PyFingerprint has no disconnect; close its serial port so the next user can open it at once
+                sensor, self.fingerprint = self.fingerprint, None
+                close_sensor(sensor)
                 logger.info("Disconnected from sensor")
             except Exception as e:
                 logger.error(f"Error during disconnect: {e}")
@@ -72,13 +164,11 @@ class R307FingerprintCaptureLibrary:
         try:
             logger.info("Place your finger on the sensor...")
             
-            start_time = time.time()
             # Wait for finger to be placed and read image with timeout
-            while not self.fingerprint.readImage():
-                if time.time() - start_time > timeout:
+            with stage_timer("scanner_capture") as span_attributes:
+                if self._wait_for_finger(True, timeout, span_attributes=span_attributes) is not None:
                     logger.error(f"Fingerprint capture timeout after {timeout} seconds")
                     return False
-                time.sleep(0.1)  # Small delay to avoid busy waiting
             
             logger.info("✅ Fingerprint captured successfully!")
             return True
@@ -87,20 +177,67 @@ class R307FingerprintCaptureLibrary:
             logger.error(f"Fingerprint capture failed: {e}")
             return False
     
+    def download_image(self) -> Image.Image:
+        """
+        Transfer the captured image from the module. With raw_download, the data packets are read
+        straight into a preallocated buffer (see sensor_transfer.py) and the timing is left in
+        self.last_transfer; otherwise, or if the raw transfer fails, PyFingerprint's downloadImage is used.
+        """
+        self.last_transfer = None
+        if self.raw_download:
+            start = time.perf_counter()
+            try:
+                if hasattr(self.fingerprint, "download_image_into"):
+                    # Simulated sensor
+                    packets = self.fingerprint.download_image_into(self._transfer_buffer)
+                    stats = TransferStats(len(self._transfer_buffer), packets, time.perf_counter() - start,
+                                          self.link_baudrate)
+                else:
+                    port = serial_port(self.fingerprint)
+                    if port is None:
+                        raise Exception("No serial port to read from")
+                    stats = download_image_into(port, self.address, self._transfer_buffer)
+                self.last_transfer = stats.to_dict()
+                logger.info(f"Image transferred in {stats.seconds * 1000:.0f} ms at {stats.baudrate} baud "
+                            f"({stats.bytes_per_second / 1024:.1f} KB/s, {stats.packets} packets)")
+                return unpack_image(self._transfer_buffer)
+            except Exception as e:
+                logger.warning(f"Raw image transfer failed ({e}); retrying with downloadImage")
+                port = serial_port(self.fingerprint)
+                if port is not None:
+                    port.reset_input_buffer()
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "image.bmp")
+            self.fingerprint.downloadImage(path)
+            with Image.open(path) as image:
+                return image.copy()
+    
     def download_and_save_image(self) -> Optional[str]:
         """Download image data and save as BMP file"""
         try:
             logger.info("Downloading image...")
             
-            # Create Images directory if it doesn't exist
-            os.makedirs('Images', exist_ok=True)
-            
-            # Generate timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"Images/fingerprint_{timestamp}.bmp"
-            
-            # Download image using PyFingerprint library
-            self.fingerprint.downloadImage(filename)
+            if self.image_store is not None:
+                filename = self.image_store.incoming_path(".bmp")
+            else:
+                # Create Images directory if it doesn't exist
+                os.makedirs('Images', exist_ok=True)
+                
+                # Generate timestamp
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                filename = f"Images/fingerprint_{timestamp}.bmp"
+            
+            with stage_timer("scanner_download") as span_attributes:
+                image = self.download_image()
+                span_attributes["baudrate"] = self.link_baudrate
+                if self.last_transfer:
+                    span_attributes.update(self.last_transfer)
+            image.save(filename)
+            
+            if self.image_store is not None:
+                with stage_timer("image_store"):
+                    filename = self.image_store.put_file(filename)
             
             logger.info(f"✅ Fingerprint image saved as {filename}")
             return filename
@@ -109,6 +246,7 @@ class R307FingerprintCaptureLibrary:
             logger.error(f"Failed to download and save image: {e}")
             return None
     
+    @traced()
     def capture_and_save(self, timeout: int = 10) -> Optional[str]:
         """Main method to capture and save fingerprint with timeout"""
         try:
@@ -130,6 +268,7 @@ class R307FingerprintCaptureLibrary:
         finally:
             self.disconnect()
     
+    @traced()
     def find_next_available_slot(self) -> Optional[int]:
         """Find the next available slot number in the module"""
         try:
@@ -182,41 +321,86 @@ class R307FingerprintCaptureLibrary:
             logger.warning("Using slot 0 as fallback")
             return 0
     
-    def enroll_fingerprint(self, timeout: int = 10) -> Optional[int]:
+    def _wait_for_finger(self, present: bool, timeout: float, cancel=None,
+                         span_attributes: Optional[dict] = None) -> Optional[str]:
+        """
+        Poll readImage until a finger is on the sensor (present=True) or lifted off it (present=False).
+        Returns None once it is, otherwise "timeout" or "cancelled". The slow-request profiler treats
+        time in here as idle (tracing.IDLE_CALLS), so keep every finger poll going through it.
+        """
+        start_time = time.time()
+        polls = 1
+        try:
+            while self.fingerprint.readImage() != present:
+                if cancel is not None and cancel.is_set():
+                    return "cancelled"
+                if time.time() - start_time > timeout:
+                    return "timeout"
+                # Waiting on the event makes cancellation take effect within one poll
+                if cancel is not None:
+                    cancel.wait(0.1)
+                else:
+                    time.sleep(0.1)
+                polls += 1
+            return "cancelled" if cancel is not None and cancel.is_set() else None
+        finally:
+            if span_attributes is not None:
+                span_attributes["polls"] = polls
+
+    @traced()
+    def enroll_fingerprint(self, timeout: int = 10, on_stage: Optional[Callable[[str, str], None]] = None,
+                           cancel=None) -> Optional[int]:
         """
         Enroll a new fingerprint in the module.
         Captures fingerprint twice for verification, then stores it.
-        Returns the slot number where fingerprint is stored, or None if failed.
+        Returns the slot number where fingerprint is stored, or None if failed
+        (the reason is left in self.enroll_error, see ENROLL_ERRORS).
+
+        on_stage(stage, message) is called as the enrollment moves through ENROLL_STAGES;
+        setting the threading.Event `cancel` aborts it at the next sensor poll.
         """
+        self.enroll_error = None
+
+        def stage(name: str, message: str):
+            logger.info(message)
+            if on_stage is not None:
+                on_stage(name, message)
+
+        def fail(reason: str) -> None:
+            self.enroll_error = reason
+            if reason == "cancelled":
+                logger.info("Enrollment cancelled")
+            else:
+                logger.error(ENROLL_ERRORS[reason])
+            return None
+
         try:
             # Connect to sensor
             if not self.connect():
-                return None
+                return fail("hardware_not_detected")
             
             logger.info("Starting fingerprint enrollment...")
-            logger.info("Step 1: Place your finger on the sensor...")
+            stage("place_finger", "Step 1: Place your finger on the sensor...")
             
             # First capture
-            start_time = time.time()
-            while not self.fingerprint.readImage():
-                if time.time() - start_time > timeout:
-                    logger.error(f"First capture timeout after {timeout} seconds")
-                    return None
-                time.sleep(0.1)
+            error = self._wait_for_finger(True, timeout, cancel)
+            if error:
+                return fail("first_capture_timeout" if error == "timeout" else error)
             
             logger.info("✅ First capture successful!")
             self.fingerprint.convertImage(0x01)  # Convert to template and store in buffer 1
             
-            logger.info("Step 2: Remove your finger and place it again...")
-            time.sleep(2)  # Give user time to remove finger
+            # Wait for the finger to be lifted instead of sleeping a fixed time
+            stage("remove_finger", "Step 2: Remove your finger from the sensor...")
+            error = self._wait_for_finger(False, timeout, cancel)
+            if error:
+                return fail("finger_not_removed" if error == "timeout" else error)
             
             # Second capture for verification
-            start_time = time.time()
-            while not self.fingerprint.readImage():
-                if time.time() - start_time > timeout:
-                    logger.error(f"Second capture timeout after {timeout} seconds")
-                    return None
-                time.sleep(0.1)
+            stage("place_again", "Step 3: Place the same finger again...")
+            error = self._wait_for_finger(True, timeout, cancel)
+            if error:
+                return fail("second_capture_timeout" if error == "timeout" else error)
             
             logger.info("✅ Second capture successful!")
             self.fingerprint.convertImage(0x02)  # Convert to template and store in buffer 2
@@ -226,8 +410,7 @@ class R307FingerprintCaptureLibrary:
             try:
                 match_score = self.fingerprint.compareCharacteristics()
                 if match_score == 0:
-                    logger.error("Fingerprints do not match! Please try again.")
-                    return None
+                    return fail("mismatch")
                 logger.info(f"✅ Fingerprints match with score: {match_score}")
             except AttributeError:
                 # If compareCharacteristics doesn't exist, try alternative method
@@ -235,15 +418,14 @@ class R307FingerprintCaptureLibrary:
                     # Some versions use matchTemplate() or other methods
                     if hasattr(self.fingerprint, 'matchTemplate'):
                         if not self.fingerprint.matchTemplate():
-                            logger.error("Fingerprints do not match! Please try again.")
-                            return None
+                            return fail("mismatch")
                     else:
                         # Skip comparison if method doesn't exist (less secure but will work)
                         logger.warning("Template comparison method not available, proceeding without verification")
                 except Exception as e:
                     logger.warning(f"Could not compare templates: {e}, proceeding anyway")
             
-            logger.info("✅ Creating template...")
+            stage("storing", "✅ Creating template...")
             self.fingerprint.createTemplate()  # Combine both templates into CharBuffer1
             
             # Find next available slot - try simple approach first
@@ -288,14 +470,16 @@ class R307FingerprintCaptureLibrary:
                         return 0
                     except Exception as e3:
                         logger.error(f"Error storing in slot 0: {e3}")
-                        return None
+                        return fail("store_failed")
             
         except Exception as e:
             logger.error(f"Error during fingerprint enrollment: {e}")
+            self.enroll_error = "enroll_failed"
             return None
         finally:
             self.disconnect()
     
+    @traced()
     def search_fingerprint(self, timeout: int = 10) -> Optional[int]:
         """
         Search for a fingerprint in the module.
@@ -311,12 +495,9 @@ class R307FingerprintCaptureLibrary:
             logger.info("Place your finger on the sensor...")
             
             # Capture fingerprint
-            start_time = time.time()
-            while not self.fingerprint.readImage():
-                if time.time() - start_time > timeout:
-                    logger.error(f"Fingerprint capture timeout after {timeout} seconds")
-                    return None
-                time.sleep(0.1)
+            if self._wait_for_finger(True, timeout) is not None:
+                logger.error(f"Fingerprint capture timeout after {timeout} seconds")
+                return None
             
             logger.info("✅ Fingerprint captured!")
             self.fingerprint.convertImage(0x01)  # Convert to template and store in buffer 1
@@ -344,17 +525,38 @@ class R307FingerprintCaptureLibrary:
 
 def main():
     """Main function"""
+    parser = argparse.ArgumentParser(description="Capture a fingerprint from the R307S sensor and save it as BMP")
+    parser.add_argument('--port', type=str, default=SCANNER_PORT,
+                        help=f'Serial port (default: {SCANNER_PORT})')
+    parser.add_argument('--baudrate', type=int, default=SCANNER_BAUDRATE,
+                        help=f'Baud rate the module is configured for (default: {SCANNER_BAUDRATE})')
+    parser.add_argument('--target-baudrate', type=int, default=SCANNER_TARGET_BAUDRATE,
+                        help='Faster baud rate to negotiate, falling back if the link is unreliable (default: none)')
+    parser.add_argument('--pyfingerprint-download', action='store_true',
+                        help="Download with PyFingerprint's downloadImage instead of the raw transfer")
+    parser.add_argument('--timeout', type=int, default=10,
+                        help='Seconds to wait for a finger (default: 10)')
+    args = parser.parse_args()
+    
     print("R307S Fingerprint Capture Script (Library Version)")
     print("=" * 55)
     
     # Create capture instance
-    capture = R307FingerprintCaptureLibrary(port='COM7', baudrate=57600)
+    capture = R307FingerprintCaptureLibrary(port=args.port, baudrate=args.baudrate,
+                                            target_baudrate=args.target_baudrate or None,
+                                            raw_download=not args.pyfingerprint_download)
     
     # Capture and save fingerprint
-    result = capture.capture_and_save()
+    start = time.perf_counter()
+    result = capture.capture_and_save(timeout=args.timeout)
     
     if result:
         print(f"\n✅ Success! Fingerprint saved as: {result}")
+        print(f"   Link: {capture.link_baudrate} baud, capture took {time.perf_counter() - start:.2f}s")
+        if capture.last_transfer:
+            transfer = capture.last_transfer
+            print(f"   Image transfer: {transfer['transfer_ms']} ms, {transfer['bytes_per_second']} bytes/s "
+                  f"({transfer['link_efficiency']:.0%} of the line rate)")
         return True
     else:
         print("\n❌ Failed to capture fingerprint")
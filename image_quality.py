@@ -0,0 +1,80 @@
+"""
+Pre-inference fingerprint image quality gate
+
+Blank, smudged or partial captures are rejected before they reach the CNNs.
+The image is converted to grayscale at the model input size and scored with a
+few vectorized NumPy measures:
+- contrast: standard deviation of the pixel intensities (0 for a blank capture)
+- sharpness: variance of the Laplacian (ridges smeared by a smudge or a moving
+  finger leave little high-frequency detail)
+- coverage: fraction of 8x8 blocks with ridge texture, i.e. intensity standard
+  deviation above RIDGE_BLOCK_STD (a partial print leaves most blocks flat)
+
+Default thresholds sit well below the scores of the Sample dataset/ images and
+of R307S captures and well above those of blank, blurred or mostly empty ones.
+"""
+
+from typing import Dict, Optional
+
+import numpy as np
+
+from preprocessing import IMAGE_SIZE
+
+BLOCK_SIZE = 8
+RIDGE_BLOCK_STD = 10.0
+
+DEFAULT_MIN_CONTRAST = 15.0
+DEFAULT_MIN_SHARPNESS = 100.0
+DEFAULT_MIN_COVERAGE = 0.3
+
+REASONS = {
+    "low_contrast": "The image is almost uniform; no fingerprint was captured. Place the finger on the sensor and try again.",
+    "blurry": "The fingerprint is smudged or blurred. Clean the sensor, hold the finger still and try again.",
+    "partial": "Too little of the fingerprint was captured. Cover the whole sensor with the finger and try again.",
+}
+
+
+def quality_scores(image) -> Dict[str, float]:
+    """Contrast, sharpness and ridge coverage of a PIL image"""
+    gray = np.asarray(image.convert("L").resize(IMAGE_SIZE), dtype=np.float32)
+
+    laplacian = (gray[1:-1, :-2] + gray[1:-1, 2:] + gray[:-2, 1:-1] + gray[2:, 1:-1]) - 4 * gray[1:-1, 1:-1]
+
+    rows, cols = gray.shape[0] // BLOCK_SIZE, gray.shape[1] // BLOCK_SIZE
+    blocks = gray[:rows * BLOCK_SIZE, :cols * BLOCK_SIZE].reshape(rows, BLOCK_SIZE, cols, BLOCK_SIZE)
+    block_std = blocks.std(axis=(1, 3))
+
+    return {
+        "contrast": round(float(gray.std()), 2),
+        "sharpness": round(float(laplacian.var()), 2),
+        "coverage": round(float((block_std > RIDGE_BLOCK_STD).mean()), 3),
+    }
+
+
+class QualityGate:
+    """Thresholds on quality_scores(); check() returns the scores and the reason for rejecting, if any"""
+
+    def __init__(self, min_contrast: float = DEFAULT_MIN_CONTRAST, min_sharpness: float = DEFAULT_MIN_SHARPNESS,
+                 min_coverage: float = DEFAULT_MIN_COVERAGE):
+        self.min_contrast = min_contrast
+        self.min_sharpness = min_sharpness
+        self.min_coverage = min_coverage
+
+    def check(self, image) -> Dict:
+        scores = quality_scores(image)
+        reason: Optional[str] = None
+        # Checked in this order: a blank image is also blurry, and a blurred one has fewer ridge blocks
+        if scores["contrast"] < self.min_contrast:
+            reason = "low_contrast"
+        elif scores["sharpness"] < self.min_sharpness:
+            reason = "blurry"
+        elif scores["coverage"] < self.min_coverage:
+            reason = "partial"
+        return {"passed": reason is None, "reason": reason, "scores": scores}
+
+    def to_dict(self) -> Dict:
+        return {
+            "min_contrast": self.min_contrast,
+            "min_sharpness": self.min_sharpness,
+            "min_coverage": self.min_coverage,
+        }
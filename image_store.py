@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Captured fingerprint image store
+
+Images are stored once per content hash (SHA-256) in date-sharded directories:
+
+  <root>/2024/01/31/<sha256>.bmp   (.png/.webp once compressed)
+
+An SQLite index (<root>/index.sqlite) maps each hash to its current file, size,
+format and first/last capture time. Storing an image is a hash, a rename and one
+index write; lossless compression and retention run in a background thread:
+- BMPs older than compress_delay seconds are re-encoded as lossless PNG or WebP
+  (the delay leaves the capturing request time to read the BMP)
+- records older than max_age_days are deleted, then the least recently seen images
+  are deleted until the store fits in max_bytes
+
+Because compression changes the file extension, callers that keep a reference
+should keep the hash and look the current path up with resolve().
+
+Maintenance examples:
+  python image_store.py stats
+  python image_store.py import Images/
+  python image_store.py maintain --max-mb 2048 --max-age-days 365
+"""
+
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_FORMATS = {"png": ("PNG", ".png", {"compress_level": 6}), "webp": ("WEBP", ".webp", {"lossless": True})}
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageStore:
+    """Content-addressed, date-sharded image store with background compression and retention"""
+
+    def __init__(self, root: str = "Images/store", compression: str = "png", compress_delay: float = 60.0,
+                 max_bytes: int = 0, max_age_days: float = 0, maintenance_interval: float = 30.0):
+        if compression not in ("none", *COMPRESSION_FORMATS):
+            raise ValueError(f"Unsupported image compression: {compression}")
+        self.root = root
+        self.compression = compression
+        self.compress_delay = compress_delay
+        self.max_bytes = max_bytes  # 0 = no size limit
+        self.max_age_days = max_age_days  # 0 = keep forever
+        self.maintenance_interval = maintenance_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        os.makedirs(os.path.join(root, "incoming"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"), timeout=30, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                "hash TEXT PRIMARY KEY, path TEXT NOT NULL, format TEXT NOT NULL, size INTEGER NOT NULL, "
+                "original_size INTEGER NOT NULL, created REAL NOT NULL, last_seen REAL NOT NULL, "
+                "captures INTEGER NOT NULL DEFAULT 1)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS images_last_seen ON images(last_seen)")
+
+    def incoming_path(self, suffix: str = ".bmp") -> str:
+        """Temporary path to write a new image to before put_file()"""
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        return os.path.join(self.root, "incoming", f"{stamp}_{os.getpid()}_{threading.get_ident()}{suffix}")
+
+    def put_file(self, source: str, keep_source: bool = False) -> str:
+        """Store a file (moved unless keep_source) and return the stored path; duplicates are not stored twice"""
+        digest = file_sha256(source)
+        extension = os.path.splitext(source)[1].lower() or ".bmp"
+        now = time.time()
+
+        with self._lock, self._db:
+            row = self._db.execute("SELECT path FROM images WHERE hash = ?", (digest,)).fetchone()
+            if row:
+                self._db.execute(
+                    "UPDATE images SET last_seen = ?, captures = captures + 1 WHERE hash = ?", (now, digest)
+                )
+                if not keep_source:
+                    os.remove(source)
+                return os.path.join(self.root, row[0])
+
+            relative_path = os.path.join(datetime.fromtimestamp(now).strftime("%Y/%m/%d"), digest + extension)
+            destination = os.path.join(self.root, relative_path)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            if keep_source:
+                with open(source, "rb") as src, open(destination + ".tmp", "wb") as dst:
+                    dst.write(src.read())
+                os.replace(destination + ".tmp", destination)
+            else:
+                os.replace(source, destination)
+            size = os.path.getsize(destination)
+            self._db.execute(
+                "INSERT INTO images (hash, path, format, size, original_size, created, last_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (digest, relative_path, extension.lstrip("."), size, size, now, now),
+            )
+        return destination
+
+    def resolve(self, digest: str) -> Optional[str]:
+        """Current path of a stored image"""
+        with self._lock:
+            row = self._db.execute("SELECT path FROM images WHERE hash = ?", (digest,)).fetchone()
+        return os.path.join(self.root, row[0]) if row else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count, size, original_size, captures = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(original_size), 0), "
+                "COALESCE(SUM(captures), 0) FROM images"
+            ).fetchone()
+            pending = self._db.execute("SELECT COUNT(*) FROM images WHERE format = 'bmp'").fetchone()[0]
+        return {
+            "images": count,
+            "captures": captures,
+            "size_mb": round(size / (1024 * 1024), 2),
+            "original_size_mb": round(original_size / (1024 * 1024), 2),
+            "pending_compression": pending if self.compression != "none" else 0,
+        }
+
+    def compress_pending(self, min_age: Optional[float] = None) -> int:
+        """Losslessly re-encode stored BMPs older than min_age seconds; returns the number compressed"""
+        if self.compression == "none":
+            return 0
+        from PIL import Image
+
+        pil_format, extension, options = COMPRESSION_FORMATS[self.compression]
+        cutoff = time.time() - (self.compress_delay if min_age is None else min_age)
+        with self._lock:
+            pending = self._db.execute(
+                "SELECT hash, path FROM images WHERE format = 'bmp' AND created <= ?", (cutoff,)
+            ).fetchall()
+
+        compressed = 0
+        for digest, relative_path in pending:
+            with self._lock, self._db:
+                # Claim the image so other processes sharing the store skip it
+                claimed = self._db.execute(
+                    "UPDATE images SET format = 'compressing' WHERE hash = ? AND format = 'bmp'", (digest,)
+                ).rowcount
+            if not claimed:
+                continue
+
+            source = os.path.join(self.root, relative_path)
+            new_relative_path = os.path.splitext(relative_path)[0] + extension
+            destination = os.path.join(self.root, new_relative_path)
+            try:
+                with Image.open(source) as image:
+                    image.save(destination + ".tmp", format=pil_format, **options)
+                os.replace(destination + ".tmp", destination)
+                with self._lock, self._db:
+                    self._db.execute(
+                        "UPDATE images SET path = ?, format = ?, size = ? WHERE hash = ?",
+                        (new_relative_path, self.compression, os.path.getsize(destination), digest),
+                    )
+                os.remove(source)
+                compressed += 1
+            except Exception as e:
+                logger.error(f"Failed to compress {source}: {e}")
+                with self._lock, self._db:
+                    self._db.execute("UPDATE images SET format = 'bmp' WHERE hash = ?", (digest,))
+        return compressed
+
+    def enforce_retention(self) -> int:
+        """Delete images past max_age_days, then least recently seen ones above max_bytes; returns deletions"""
+        doomed = []
+        with self._lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                doomed += self._db.execute(
+                    "SELECT hash, path FROM images WHERE last_seen < ?", (cutoff,)
+                ).fetchall()
+            if self.max_bytes:
+                total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+                total -= sum(self._size_of(digest) for digest, _ in doomed)
+                if total > self.max_bytes:
+                    already = {digest for digest, _ in doomed}
+                    for digest, relative_path, size in self._db.execute(
+                        "SELECT hash, path, size FROM images ORDER BY last_seen"
+                    ):
+                        if total <= self.max_bytes:
+                            break
+                        if digest in already:
+                            continue
+                        doomed.append((digest, relative_path))
+                        total -= size
+
+        for digest, relative_path in doomed:
+            try:
+                os.remove(os.path.join(self.root, relative_path))
+            except FileNotFoundError:
+                pass
+            with self._lock, self._db:
+                self._db.execute("DELETE FROM images WHERE hash = ?", (digest,))
+        if doomed:
+            logger.info(f"Image store retention deleted {len(doomed)} image(s)")
+        return len(doomed)
+
+    def _size_of(self, digest: str) -> int:
+        row = self._db.execute("SELECT size FROM images WHERE hash = ?", (digest,)).fetchone()
+        return row[0] if row else 0
+
+    def maintain(self):
+        self.compress_pending()
+        self.enforce_retention()
+
+    def start(self):
+        """Run compression and retention in a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="image-store-maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.maintenance_interval):
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.error(f"Image store maintenance failed: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the captured fingerprint image store")
+    parser.add_argument('command', choices=['stats', 'import', 'maintain'],
+                        help='stats, import a directory of images, or compress and apply retention now')
+    parser.add_argument('directory', nargs='?', help='Directory to import (import only)')
+    parser.add_argument('--root', type=str, default=os.environ.get("BIOPRINT_IMAGE_STORE", "Images/store"),
+                        help='Store root (default: Images/store)')
+    parser.add_argument('--compression', choices=['none', 'png', 'webp'],
+                        default=os.environ.get("BIOPRINT_IMAGE_COMPRESSION", "png"),
+                        help='Lossless compression format (default: png)')
+    parser.add_argument('--max-mb', type=float, default=0,
+                        help='Evict least recently seen images above this size (default: no limit)')
+    parser.add_argument('--max-age-days', type=float, default=0,
+                        help='Delete images not seen for this many days (default: keep forever)')
+    parser.add_argument('--move', action='store_true',
+                        help='Move imported files into the store instead of copying them')
+    args = parser.parse_args()
+
+    store = ImageStore(args.root, args.compression, max_bytes=int(args.max_mb * 1024 * 1024),
+                       max_age_days=args.max_age_days)
+
+    if args.command == 'import':
+        if not args.directory:
+            print("❌ import needs a directory")
+            return False
+        paths = sorted(glob.glob(os.path.join(args.directory, "*.bmp")))
+        start = time.perf_counter()
+        for path in paths:
+            store.put_file(path, keep_source=not args.move)
+        print(f"✅ Imported {len(paths)} image(s) in {time.perf_counter() - start:.2f} s")
+    elif args.command == 'maintain':
+        start = time.perf_counter()
+        compressed = store.compress_pending(min_age=0)
+        deleted = store.enforce_retention()
+        print(f"✅ Compressed {compressed}, deleted {deleted} image(s) in {time.perf_counter() - start:.2f} s")
+
+    print(f"📊 {store.stats()}")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
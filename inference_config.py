@@ -0,0 +1,140 @@
+"""
+TensorFlow CPU threading and core pinning for inference
+
+By default TensorFlow sizes its thread pools to every core of the host, so
+concurrent requests (or several workers) oversubscribe the CPU and tail latency
+suffers. The inference configuration sets:
+- intra-op threads: threads a single op (a convolution) is split across
+- inter-op threads: independent ops run at the same time
+- cpus: CPU ids the process is pinned to (Linux only)
+
+Values come from, in increasing precedence: the calibration file written by
+benchmarks/calibrate_threads.py (inference_config.json), the environment
+(BIOPRINT_INTRA_OP_THREADS, BIOPRINT_INTER_OP_THREADS, BIOPRINT_PIN_CPUS such as
+"0-3,8") and command line flags (see serving.py). 0 keeps TensorFlow's default.
+
+The configuration must be applied before TensorFlow runs its first op;
+TensorFlow is only imported when it is applied.
+"""
+
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_PATH = os.environ.get(
+    "BIOPRINT_INFERENCE_CONFIG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "inference_config.json"),
+)
+
+
+def parse_cpus(value: str) -> List[int]:
+    """Parse a CPU list such as "0-3,8" """
+    cpus = set()
+    for part in value.replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def available_cpus() -> List[int]:
+    """CPU ids this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cpus(cpus: List[int], parts: int) -> List[List[int]]:
+    """Split cpus into contiguous, non-overlapping sets (sets are reused when parts > cpus)"""
+    if parts >= len(cpus):
+        return [[cpus[index % len(cpus)]] for index in range(parts)]
+    size, extra = divmod(len(cpus), parts)
+    sets = []
+    start = 0
+    for index in range(parts):
+        end = start + size + (1 if index < extra else 0)
+        sets.append(cpus[start:end])
+        start = end
+    return sets
+
+
+class InferenceConfig:
+    """Thread pool sizes and CPU pinning for one inference process"""
+
+    def __init__(self, intra_op_threads: int = 0, inter_op_threads: int = 0, cpus: Optional[List[int]] = None):
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.cpus = cpus
+
+    @classmethod
+    def from_environment(cls, calibration_path: str = CALIBRATION_PATH) -> "InferenceConfig":
+        """Calibration file values overridden by BIOPRINT_* environment variables"""
+        config = cls()
+        if calibration_path and os.path.exists(calibration_path):
+            try:
+                with open(calibration_path) as f:
+                    selected = json.load(f).get("selected", {})
+                config.intra_op_threads = int(selected.get("intra_op_threads", 0))
+                config.inter_op_threads = int(selected.get("inter_op_threads", 0))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable calibration file {calibration_path}: {e}")
+
+        if os.environ.get("BIOPRINT_INTRA_OP_THREADS"):
+            config.intra_op_threads = int(os.environ["BIOPRINT_INTRA_OP_THREADS"])
+        if os.environ.get("BIOPRINT_INTER_OP_THREADS"):
+            config.inter_op_threads = int(os.environ["BIOPRINT_INTER_OP_THREADS"])
+        if os.environ.get("BIOPRINT_PIN_CPUS"):
+            config.cpus = parse_cpus(os.environ["BIOPRINT_PIN_CPUS"])
+        return config
+
+    def to_dict(self) -> Dict:
+        return {
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "cpus": self.cpus,
+        }
+
+
+# Configuration applied in this process, if any
+_active: Optional[InferenceConfig] = None
+
+
+def configure(config: Optional[InferenceConfig] = None) -> InferenceConfig:
+    """Apply config (default: from the environment) once per process; later calls return the active one"""
+    global _active
+    if _active is not None:
+        return _active
+    config = config or InferenceConfig.from_environment()
+
+    if config.cpus:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, config.cpus)
+        else:
+            logger.warning("CPU pinning is not supported on this platform, ignoring it")
+            config.cpus = None
+
+    if config.intra_op_threads or config.inter_op_threads:
+        import tensorflow as tf
+        try:
+            if config.intra_op_threads:
+                tf.config.threading.set_intra_op_parallelism_threads(config.intra_op_threads)
+            if config.inter_op_threads:
+                tf.config.threading.set_inter_op_parallelism_threads(config.inter_op_threads)
+        except RuntimeError as e:
+            # TensorFlow already ran an op in this process
+            logger.warning(f"TensorFlow threading could not be configured: {e}")
+
+    logger.info(f"Inference configuration: {config.to_dict()}")
+    _active = config
+    return config
+
+
+def active_config() -> Optional[InferenceConfig]:
+    return _active
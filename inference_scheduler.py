@@ -0,0 +1,250 @@
+"""
+Priority scheduling of model inference
+
+Live scanner requests and bulk scoring share the same models. Run in arrival
+order, a kiosk's /capture-and-predict waits behind every /predict-batch image
+queued before it. InferenceScheduler runs all inference on one worker thread
+fed by a queue per priority class:
+
+- interactive: a patient is waiting (/capture-and-predict, /predict by default)
+- bulk: batch and offline scoring (/predict-batch by default)
+
+Requests are cut into batches of at most max_batch images (consecutive small
+requests of the same class, TTA setting, source and run function are merged
+into one batch). Before every batch the worker picks the class to serve with
+smooth weighted round-robin over the classes that have work waiting: with the
+default weights 8:1 interactive work gets 8 of every 9 batches while both
+are busy, and bulk work keeps flowing instead of starving. With preempt=True
+a bulk request that is partway through yields at its next batch boundary, so
+interactive work waits for at most one bulk batch; with preempt=False a
+started request runs to completion first.
+
+submit() returns a concurrent.futures.Future of the request's predictions
+(predict_many() awaits it from the event loop). A request can bring its own
+run function with the same signature (e.g. embedding extraction), so every
+model pass goes through the same queues. The request's contextvars are
+kept, so its inference spans still land in its trace. Queue wait per request
+is recorded on /metrics as bioprint_scheduler_wait_seconds{priority}.
+"""
+
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from metrics import observe_scheduler_wait
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+
+# predict_many(images, tta_views, source, keys) -> predictions, e.g. PredictionService.predict_many
+PredictMany = Callable[[Sequence, int, str, Optional[Sequence[Optional[str]]]], List]
+
+
+class _Request:
+    """One submitted request and how far its images have been dispatched"""
+
+    def __init__(self, images: Sequence, tta_views: int, source: str, keys: Optional[Sequence[Optional[str]]],
+                 priority: str, run: PredictMany):
+        self.images = list(images)
+        self.tta_views = tta_views
+        self.source = source
+        self.keys = list(keys) if keys is not None else [None] * len(self.images)
+        self.priority = priority
+        self.run = run
+        self.future: Future = Future()
+        self.results: List = [None] * len(self.images)
+        self.dispatched = 0  # Images handed to the worker so far
+        self.completed = 0
+        self.submitted = time.perf_counter()
+        self.started: Optional[float] = None
+        self.context = contextvars.copy_context()
+
+
+class _ClassStats:
+    def __init__(self):
+        self.requests = 0
+        self.images = 0
+        self.batches = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+
+class InferenceScheduler:
+    """Single inference worker serving interactive and bulk queues by weighted round-robin"""
+
+    def __init__(self, predict_many: PredictMany, weights: Optional[Dict[str, int]] = None, max_batch: int = 8,
+                 preempt: bool = True):
+        self.predict_many_fn = predict_many
+        self.weights = {INTERACTIVE: 8, BULK: 1, **(weights or {})}
+        if any(self.weights[priority] < 1 for priority in PRIORITIES):
+            raise ValueError("Scheduler weights must be at least 1")
+        self.max_batch = max_batch
+        self.preempt = preempt
+        self.queues: Dict[str, Deque[_Request]] = {priority: deque() for priority in PRIORITIES}
+        self._credits = {priority: 0 for priority in PRIORITIES}
+        self._stats = {priority: _ClassStats() for priority in PRIORITIES}
+        self.preemptions = 0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Finish the queued requests, then stop the worker"""
+        with self._condition:
+            thread, self._thread = self._thread, None
+            self._running = False
+            self._condition.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+    def submit(self, images: Sequence, tta_views: int = 1, source: str = "upload",
+               keys: Optional[Sequence[Optional[str]]] = None, priority: str = INTERACTIVE,
+               run: Optional[PredictMany] = None) -> Future:
+        """Queue a request; the future resolves with one result of run (default predict_many) per image"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}; expected one of {', '.join(PRIORITIES)}")
+        request = _Request(images, tta_views, source, keys, priority, run or self.predict_many_fn)
+        if not request.images:
+            request.future.set_result([])
+            return request.future
+        self.start()
+        with self._condition:
+            self.queues[priority].append(request)
+            self._condition.notify()
+        return request.future
+
+    async def predict_many(self, images: Sequence, tta_views: int = 1, source: str = "upload",
+                           keys: Optional[Sequence[Optional[str]]] = None, priority: str = INTERACTIVE,
+                           run: Optional[PredictMany] = None) -> List:
+        """submit() awaited without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(images, tta_views, source, keys, priority, run))
+
+    def _choose(self) -> str:
+        """Smooth weighted round-robin over the classes with work waiting"""
+        waiting = [priority for priority in PRIORITIES if self.queues[priority]]
+        for priority in waiting:
+            self._credits[priority] += self.weights[priority]
+        chosen = max(waiting, key=lambda priority: self._credits[priority])
+        self._credits[chosen] -= sum(self.weights[priority] for priority in waiting)
+        return chosen
+
+    def _next_batch(self) -> List[Tuple[_Request, int, int]]:
+        """(request, start, end) image ranges for the next batch; called with the condition held"""
+        started = [queue[0] for queue in self.queues.values() if queue and queue[0].dispatched]
+        if started and not self.preempt:
+            priority = started[0].priority
+        else:
+            priority = self._choose()
+            if self.preempt and priority == INTERACTIVE and self.queues[BULK] and self.queues[BULK][0].dispatched:
+                self.preemptions += 1
+
+        queue = self.queues[priority]
+        head = queue[0]
+        batch = []
+        room = self.max_batch
+        while queue and room > 0:
+            request = queue[0]
+            same_kind = (request.tta_views, request.source, request.run) == (head.tta_views, head.source, head.run)
+            if request is not head and not same_kind:
+                break
+            start = request.dispatched
+            end = min(len(request.images), start + room)
+            request.dispatched = end
+            batch.append((request, start, end))
+            room -= end - start
+            if end == len(request.images):
+                queue.popleft()
+            else:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not any(self.queues.values()):
+                    self._condition.wait()
+                if not any(self.queues.values()):
+                    return
+                batch = self._next_batch()
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List[Tuple[_Request, int, int]]):
+        now = time.perf_counter()
+        head = batch[0][0]
+        stats = self._stats[head.priority]
+        for request, start, _ in batch:
+            if request.started is None:
+                request.started = now
+                wait = now - request.submitted
+                stats.requests += 1
+                stats.wait_seconds += wait
+                stats.max_wait_seconds = max(stats.max_wait_seconds, wait)
+                observe_scheduler_wait(request.priority, wait)
+
+        images = [image for request, start, end in batch for image in request.images[start:end]]
+        keys = [key for request, start, end in batch for key in request.keys[start:end]]
+        try:
+            # Run in the first request's context so the inference spans land in its trace
+            predictions = head.context.run(head.run, images, head.tta_views, head.source, keys)
+        except Exception as e:
+            for request, _, _ in batch:
+                self._fail(request, e)
+            return
+        stats.images += len(images)
+        stats.batches += 1
+
+        offset = 0
+        for request, start, end in batch:
+            request.results[start:end] = predictions[offset:offset + end - start]
+            offset += end - start
+            request.completed += end - start
+            if request.completed == len(request.images) and not request.future.done():
+                request.future.set_result(request.results)
+
+    def _fail(self, request: _Request, error: Exception):
+        """Fail the whole request and drop the images it still has queued"""
+        with self._condition:
+            queue = self.queues[request.priority]
+            if request in queue:
+                queue.remove(request)
+        if not request.future.done():
+            request.future.set_exception(error)
+
+    def stats(self) -> Dict:
+        with self._condition:
+            queued = {priority: sum(len(request.images) - request.dispatched for request in queue)
+                      for priority, queue in self.queues.items()}
+        return {
+            "running": self._thread is not None,
+            "weights": dict(self.weights),
+            "max_batch": self.max_batch,
+            "preempt": self.preempt,
+            "preemptions": self.preemptions,
+            "classes": {
+                priority: {
+                    "queued_images": queued[priority],
+                    "requests": stats.requests,
+                    "images": stats.images,
+                    "batches": stats.batches,
+                    "mean_wait_ms": round(stats.wait_seconds / stats.requests * 1000, 1) if stats.requests else None,
+                    "max_wait_ms": round(stats.max_wait_seconds * 1000, 1),
+                }
+                for priority, stats in self._stats.items()
+            },
+        }
@@ -0,0 +1,229 @@
+"""
+Prometheus-style metrics for the BioPrint API
+
+Counters and fixed-bucket histograms that are cheap enough to leave on in
+production: an observation is a bisect over the bucket bounds plus a couple of
+integer increments under a per-metric lock. The registry renders the Prometheus
+text exposition format served by GET /metrics.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import tracing
+
+# Bucket bounds in seconds, covering sub-millisecond decode up to slow serial transfers
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: str = "") -> str:
+    """Render a Prometheus label set such as {stage="preprocess"}"""
+    parts = []
+    for name, value in zip(labelnames, labelvalues):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    """Render a sample value the way Prometheus expects"""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram with optional labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the wrapped block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(series[0]), series[1])) for key, series in self._series.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together by the /metrics endpoint"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Default registry and the metrics shared by app.py and the scanner library
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "bioprint_stage_duration_seconds",
+    "Time spent in each stage of the prediction and capture pipeline",
+    labelnames=("stage",),
+)
+PREDICTIONS = REGISTRY.counter(
+    "bioprint_predictions_total",
+    "Completed dual-model predictions",
+    labelnames=("source",),
+)
+DISAGREEMENTS = REGISTRY.counter(
+    "bioprint_model_disagreements_total",
+    "Predictions where VGG16 and MobileNetV2 returned different blood groups",
+    labelnames=("source",),
+)
+INFERENCE_SECONDS = REGISTRY.histogram(
+    "bioprint_inference_duration_seconds",
+    "Time to run both models for one prediction, by number of test-time augmentation views",
+    labelnames=("views",),
+)
+ERRORS = REGISTRY.counter(
+    "bioprint_errors_total",
+    "Errors returned by the API, by endpoint and mapped error type",
+    labelnames=("endpoint", "error"),
+)
+SCHEDULER_WAIT_SECONDS = REGISTRY.histogram(
+    "bioprint_scheduler_wait_seconds",
+    "Time inference requests wait in the scheduler queue before their first batch runs, by priority",
+    labelnames=("priority",),
+)
+COALESCED = REGISTRY.counter(
+    "bioprint_coalesced_requests_total",
+    "Requests answered with another request's result, by endpoint, key (idempotency_key or image_hash) "
+    "and outcome (coalesced while in flight or replayed from the completed-result table)",
+    labelnames=("endpoint", "key", "outcome"),
+)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    Time a pipeline stage into bioprint_stage_duration_seconds and record it
+    as a span of the current request trace. Yields the span's attribute dict.
+    """
+    with tracing.span(stage) as attributes, STAGE_SECONDS.time(stage=stage):
+        yield attributes
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Record a stage duration measured by the caller"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    tracing.record_span(stage, time.perf_counter() - seconds, seconds)
+
+
+def observe_inference(views: int, seconds: float) -> None:
+    """Record the duration of both models' inference for a prediction with `views` TTA views"""
+    INFERENCE_SECONDS.observe(seconds, views=views)
+
+
+def observe_scheduler_wait(priority: str, seconds: float) -> None:
+    """Record how long a request waited for the inference scheduler"""
+    SCHEDULER_WAIT_SECONDS.observe(seconds, priority=priority)
+
+
+def record_prediction(source: str, agree: bool) -> None:
+    """Count a prediction and whether the two models disagreed"""
+    PREDICTIONS.inc(source=source)
+    if not agree:
+        DISAGREEMENTS.inc(source=source)
+
+
+def record_error(endpoint: str, error: str) -> None:
+    """Count an error mapped in an endpoint's exception handling"""
+    ERRORS.inc(endpoint=endpoint, error=error)
+
+
+def record_coalesced(endpoint: str, key: str, outcome: str) -> None:
+    """Count a request that shared an in-flight computation or replayed a completed result"""
+    COALESCED.inc(endpoint=endpoint, key=key, outcome=outcome)
@@ -0,0 +1,376 @@
+"""
+Model loading for the BioPrint API
+
+load_model() returns a regular Keras model, unless the model's weights were
+preloaded with preload_weights(). Preloading reads the .h5 weights with h5py into
+64-byte aligned NumPy arrays without initializing TensorFlow, so a parent process
+can preload once and fork workers (TensorFlow itself is not fork-safe). Each worker
+then builds the model architecture without allocating variables and runs
+inference statelessly on tensors that alias the inherited arrays through DLPack,
+so the weight pages stay shared copy-on-write between all workers.
+
+Models can also be converted (convert_weights.py) into a flat weight file next to
+the .h5 (VGG16.h5 -> VGG16.bpw): a small JSON header followed by every weight
+tensor at a 64-byte aligned offset. load_model() prefers an up-to-date weight file
+and memory-maps it, so weights are paged in from the page cache on demand rather
+than parsed and copied, and all processes on the host share the same pages.
+
+Weight file layout (little endian):
+  8 bytes  magic b"BPWEIGHT"
+  uint32   format version
+  uint64   header length
+  header   UTF-8 JSON: {"model_config": {...}, "layers": {name: [{"dtype", "shape", "offset"}, ...]}}
+  data     tensors at the header's offsets, each aligned to TENSOR_ALIGNMENT
+
+Quantized or otherwise converted variants saved as TensorFlow Lite flatbuffers
+(.tflite) are loaded into a TFLiteModel with the same predict() interface.
+
+SharedWeightsModel relies on Keras internals (legacy model_from_config, variable
+initializers, deferred-variable bookkeeping), so requirements.txt pins keras. If
+they are missing in the installed Keras, load_model() logs a warning and loads
+the .h5 with tf.keras instead, without shared weights.
+
+TensorFlow is imported lazily so that importing this module never initializes it.
+"""
+
+import copy
+import json
+import logging
+import os
+import struct
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# TensorFlow requires tensor buffers aligned to 64 bytes
+TENSOR_ALIGNMENT = 64
+PREDICT_BATCH_SIZE = 32
+
+WEIGHT_FILE_EXTENSION = ".bpw"
+WEIGHT_FILE_MAGIC = b"BPWEIGHT"
+WEIGHT_FILE_VERSION = 1
+_PREAMBLE = struct.Struct("<8sIQ")
+
+
+class ModelWeights:
+    """Architecture config and per-layer weight arrays read from a Keras .h5 file"""
+
+    def __init__(self, path: str, config: Dict, layers: Dict[str, List[np.ndarray]]):
+        self.path = path
+        self.config = config
+        self.layers = layers
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for arrays in self.layers.values() for array in arrays)
+
+
+# Weights preloaded in this process, by absolute model path
+_preloaded: Dict[str, ModelWeights] = {}
+
+
+def aligned_copy(array: np.ndarray, alignment: int = TENSOR_ALIGNMENT) -> np.ndarray:
+    """C-contiguous copy of array whose data starts on an alignment boundary"""
+    raw = np.empty(array.nbytes + alignment, dtype=np.uint8)
+    offset = (-raw.ctypes.data) % alignment
+    copy = raw[offset:offset + array.nbytes].view(array.dtype).reshape(array.shape)
+    copy[...] = array
+    return copy
+
+
+def _decode(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def read_h5_weights(path: str) -> ModelWeights:
+    """Read a Keras .h5 model's config and weights without TensorFlow"""
+    import h5py
+
+    with h5py.File(path, "r") as f:
+        config = json.loads(_decode(f.attrs["model_config"]))
+        group = f["model_weights"] if "model_weights" in f else f
+        layers = {}
+        for layer_name in group.attrs["layer_names"]:
+            layer_name = _decode(layer_name)
+            layer_group = group[layer_name]
+            layers[layer_name] = [
+                aligned_copy(np.asarray(layer_group[_decode(weight_name)]))
+                for weight_name in layer_group.attrs.get("weight_names", [])
+            ]
+    return ModelWeights(path, config, layers)
+
+
+def _align(offset: int, alignment: int = TENSOR_ALIGNMENT) -> int:
+    return offset + (-offset) % alignment
+
+
+def write_weight_file(weights: ModelWeights, path: str) -> int:
+    """Write weights in the flat weight file format; returns the file size"""
+    layers = {}
+    relative_offsets = []
+    offset = 0
+    for layer_name, arrays in weights.layers.items():
+        entries = []
+        for array in arrays:
+            dtype = np.asarray(array).dtype.newbyteorder("<")
+            entries.append({"dtype": dtype.str, "shape": list(np.shape(array)), "offset": 0})
+            relative_offsets.append(offset)
+            offset = _align(offset + np.asarray(array).nbytes)
+        layers[layer_name] = entries
+    entries = [entry for layer_entries in layers.values() for entry in layer_entries]
+
+    # The data section starts after the header, whose length depends on the offsets it stores
+    header = {"model_config": weights.config, "layers": layers}
+    data_start = 0
+    while True:
+        for entry, relative_offset in zip(entries, relative_offsets):
+            entry["offset"] = data_start + relative_offset
+        encoded = json.dumps(header).encode("utf-8")
+        required = _align(_PREAMBLE.size + len(encoded))
+        if required <= data_start:
+            break
+        data_start = required
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(_PREAMBLE.pack(WEIGHT_FILE_MAGIC, WEIGHT_FILE_VERSION, len(encoded)))
+        f.write(encoded)
+        for layer_name, arrays in weights.layers.items():
+            for array, entry in zip(arrays, layers[layer_name]):
+                f.seek(entry["offset"])
+                f.write(np.ascontiguousarray(array, dtype=entry["dtype"]).tobytes())
+        size = f.tell()
+    os.replace(temporary_path, path)
+    return size
+
+
+def read_weight_file(path: str) -> ModelWeights:
+    """Memory-map a flat weight file; the returned arrays are views of the mapping"""
+    with open(path, "rb") as f:
+        magic, version, header_length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != WEIGHT_FILE_MAGIC:
+            raise ValueError(f"{path} is not a BioPrint weight file")
+        if version != WEIGHT_FILE_VERSION:
+            raise ValueError(f"{path} has unsupported weight file version {version}")
+        header = json.loads(f.read(header_length).decode("utf-8"))
+
+    # Copy-on-write mapping: TensorFlow needs writable buffers, but nothing is ever written,
+    # so the pages stay shared with the page cache
+    mapping = np.memmap(path, dtype=np.uint8, mode="c")
+    layers = {}
+    for layer_name, entries in header["layers"].items():
+        arrays = []
+        for entry in entries:
+            dtype = np.dtype(entry["dtype"])
+            count = int(np.prod(entry["shape"], dtype=np.int64))
+            start = entry["offset"]
+            arrays.append(mapping[start:start + count * dtype.itemsize].view(dtype).reshape(entry["shape"]))
+        layers[layer_name] = arrays
+    return ModelWeights(path, header["model_config"], layers)
+
+
+def weight_file_for(path: str) -> Optional[str]:
+    """The up-to-date converted weight file for a model path, if there is one"""
+    if path.endswith(WEIGHT_FILE_EXTENSION):
+        return path
+    candidate = os.path.splitext(path)[0] + WEIGHT_FILE_EXTENSION
+    if not os.path.exists(candidate):
+        return None
+    if os.path.exists(path) and os.path.getmtime(candidate) < os.path.getmtime(path):
+        logger.warning(f"{candidate} is older than {path}, ignoring it; re-run convert_weights.py")
+        return None
+    return candidate
+
+
+def read_weights(path: str) -> ModelWeights:
+    """Weights of a model, from its converted weight file when available"""
+    weight_file = weight_file_for(path)
+    if weight_file:
+        return read_weight_file(weight_file)
+    return read_h5_weights(path)
+
+
+def preload_weights(paths: List[str]) -> int:
+    """Preload model weights in this process; returns the total bytes preloaded"""
+    total = 0
+    for path in paths:
+        weights = read_weights(path)
+        _preloaded[os.path.abspath(path)] = weights
+        total += weights.nbytes
+        logger.info(f"Preloaded {weights.path} ({weights.nbytes / (1024 * 1024):.1f} MB of weights)")
+    return total
+
+
+class SharedWeightsModel:
+    """
+    Inference-only Keras model whose weights are tensors aliasing NumPy arrays.
+    predict() mirrors keras.Model.predict; other attributes (layers, inputs, name...)
+    are those of the underlying Keras model.
+    """
+
+    def __init__(self, weights: ModelWeights):
+        import tensorflow as tf
+        import keras
+        from keras.src.legacy.saving.saving_utils import model_from_config
+
+        self.path = weights.path
+        # Build the architecture with deferred variables: no weight memory is allocated
+        with keras.StatelessScope(initialize_variables=False):
+            # model_from_config consumes the config it is given; copy it so the weights can build more models
+            self.model = model_from_config(copy.deepcopy(weights.config))
+
+        # Same weight order as Keras' own .h5 loader: per layer, trainable then non-trainable
+        arrays_by_variable = {}
+        for layer in self.model.layers:
+            arrays = weights.layers.get(layer.name, [])
+            variables = layer.trainable_weights + layer.non_trainable_weights
+            if len(arrays) != len(variables):
+                raise ValueError(
+                    f"Layer {layer.name} of {weights.path} expects {len(variables)} weights, file has {len(arrays)}"
+                )
+            for variable, array in zip(variables, arrays):
+                arrays_by_variable[id(variable)] = array
+
+        def as_tensor(variable):
+            array = arrays_by_variable.get(id(variable))
+            if array is None:
+                # State that is not saved in the file, such as dropout seed generators
+                return tf.convert_to_tensor(variable._initializer(variable.shape, dtype=variable.dtype))
+            return tf.experimental.dlpack.from_dlpack(array.__dlpack__())
+
+        self.trainable_values = [as_tensor(variable) for variable in self.model.trainable_variables]
+        self.non_trainable_values = [as_tensor(variable) for variable in self.model.non_trainable_variables]
+
+        # Keras initializes deferred variables when any stateless scope exits (stateless_call included),
+        # which would allocate a second copy of every weight; these variables are never read
+        from keras.src.backend.common import global_state
+        ours = {id(variable) for variable in self.model.trainable_variables + self.model.non_trainable_variables}
+        pending = global_state.get_global_attribute("uninitialized_variables") or []
+        global_state.set_global_attribute("uninitialized_variables", [v for v in pending if id(v) not in ours])
+        self._arrays = arrays_by_variable  # Keep the aliased arrays alive
+
+        self._forward = _stateless_forward(self.model)
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["model"], name)
+
+    def truncated(self, layer_name: str) -> "SharedWeightsModel":
+        """A model sharing these weight tensors whose output is that of layer_name"""
+        import keras
+
+        view = object.__new__(SharedWeightsModel)
+        view.path = self.path
+        view.model = keras.Model(self.model.inputs, self.model.get_layer(layer_name).output)
+        values = dict(zip(
+            [id(variable) for variable in self.model.trainable_variables + self.model.non_trainable_variables],
+            self.trainable_values + self.non_trainable_values,
+        ))
+        view.trainable_values = [values[id(variable)] for variable in view.model.trainable_variables]
+        view.non_trainable_values = [values[id(variable)] for variable in view.model.non_trainable_variables]
+        view._arrays = self._arrays
+        view._forward = _stateless_forward(view.model)
+        return view
+
+    def predict(self, x, batch_size: Optional[int] = None, verbose="auto", **kwargs) -> np.ndarray:
+        import tensorflow as tf
+
+        batch_size = batch_size or PREDICT_BATCH_SIZE
+        x = np.asarray(x)
+        outputs = []
+        for start in range(0, len(x), batch_size):
+            batch = tf.convert_to_tensor(x[start:start + batch_size], dtype=tf.float32)
+            outputs.append(self._forward(self.trainable_values, self.non_trainable_values, batch).numpy())
+        return np.concatenate(outputs)
+
+
+def _stateless_forward(model):
+    """Compiled inference of model on explicit weight tensors"""
+    import tensorflow as tf
+
+    @tf.function(reduce_retracing=True)
+    def forward(trainable_values, non_trainable_values, inputs):
+        outputs, _ = model.stateless_call(trainable_values, non_trainable_values, inputs, training=False)
+        return outputs
+
+    return forward
+
+
+class TFLiteModel:
+    """TensorFlow Lite model (e.g. a quantized variant) with a keras.Model-like predict()"""
+
+    def __init__(self, path: str):
+        import tensorflow as tf
+        from inference_config import active_config
+
+        config = active_config()
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.interpreter = tf.lite.Interpreter(
+            model_path=path, num_threads=(config.intra_op_threads or None) if config else None
+        )
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = None
+
+    def _invoke(self, batch: np.ndarray) -> np.ndarray:
+        if self._batch_size != len(batch):
+            self.interpreter.resize_tensor_input(self._input["index"], batch.shape)
+            self.interpreter.allocate_tensors()
+            self._batch_size = len(batch)
+
+        # Integer-quantized inputs and outputs carry their (scale, zero point)
+        scale, zero_point = self._input["quantization"]
+        if scale:
+            batch = np.round(batch / scale + zero_point)
+        self.interpreter.set_tensor(self._input["index"], batch.astype(self._input["dtype"]))
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self._output["index"])
+        scale, zero_point = self._output["quantization"]
+        if scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output.astype(np.float32)
+
+    def predict(self, x, batch_size: Optional[int] = None, verbose="auto", **kwargs) -> np.ndarray:
+        batch_size = batch_size or PREDICT_BATCH_SIZE
+        x = np.asarray(x, dtype=np.float32)
+        return np.concatenate([self._invoke(x[start:start + batch_size]) for start in range(0, len(x), batch_size)])
+
+
+def load_model(path: str):
+    """Load a model for inference from preloaded weights, a converted weight file, the .h5 or a .tflite"""
+    if path.endswith(".tflite"):
+        return TFLiteModel(path)
+
+    weights = _preloaded.get(os.path.abspath(path))
+    if weights is None:
+        weight_file = weight_file_for(path)
+        if weight_file:
+            weights = read_weight_file(weight_file)
+    import tensorflow as tf
+    if weights is not None:
+        try:
+            return SharedWeightsModel(weights)
+        except (ImportError, AttributeError) as e:
+            # The Keras internals SharedWeightsModel builds on moved or changed in this Keras version
+            logger.warning(
+                f"Shared-weights loading is unavailable with Keras {tf.keras.__version__} ({e}); "
+                f"loading {path} with tf.keras instead, without shared weights"
+            )
+
+    return tf.keras.models.load_model(path)
+
+
+def truncated_model(model, layer_name: str):
+    """
+    Inference model sharing the weights of a model returned by load_model() whose output is
+    the output of layer_name. TensorFlow Lite models only expose their final output.
+    """
+    if isinstance(model, TFLiteModel):
+        raise ValueError(f"{model.path} is a TensorFlow Lite model; intermediate layers need the .h5 or weight file")
+    if isinstance(model, SharedWeightsModel):
+        return model.truncated(layer_name)
+
+    import keras
+    return keras.Model(model.inputs, model.get_layer(layer_name).output)
@@ -0,0 +1,226 @@
+"""
+Prediction service for the BioPrint models
+
+PredictionService owns the whole prediction pipeline shared by the API
+endpoints and the offline tools: preprocessing, test-time augmentation, running
+every model on one batch, post-processing the softmax outputs into labels and
+confidences, and building the API response (including the legacy raw_result and
+agreement strings).
+
+The API is batch-first: predict_many() runs each model once for a whole batch of
+images (times the number of TTA views). Models are pluggable backends: anything
+with a keras.Model-like predict(batch, verbose=0) returning class probabilities,
+such as the models returned by model_loader.load_model (Keras, memory-mapped
+weights or TensorFlow Lite).
+
+Post-processing is vectorized per batch: rank_classes() sorts every image's
+classes and computes all rounded confidences in one NumPy pass, so building a
+response only reads precomputed Python lists (top-1 or top-k labels and, on
+request, the full probability vector).
+
+Hooks (PredictionHook subclasses) plug in caching and metrics without touching
+the pipeline: lookup()/store() can serve predictions by image key, and
+on_inference()/on_prediction() observe every batch and result.
+"""
+
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from metrics import stage_timer, observe_stage, observe_inference, record_prediction
+from preprocessing import CLASS_LABELS, preprocess
+from tta import augment as tta_augment
+
+# Display names used in the response and raw_result, in the order the models are reported
+MODEL_NAMES = {"vgg16": "VGG16", "mobilenetv2": "MobileNetV2"}
+
+AGREE = "✅ Both models agree!"
+DISAGREE = "⚠️ Models disagree."
+NEEDS_VERIFICATION = "Needs verification"
+
+_LABELS = np.array(CLASS_LABELS)
+
+
+def rank_classes(probabilities: np.ndarray):
+    """Per image: labels sorted by probability and their confidences in percent rounded to 2 decimals, as lists"""
+    order = np.argsort(-probabilities, axis=1, kind="stable")
+    confidences = np.round(np.take_along_axis(probabilities, order, axis=1).astype(np.float64) * 100, 2)
+    return _LABELS[order].tolist(), confidences.tolist()
+
+
+class InferenceError(Exception):
+    """A model failed to run on the batch"""
+
+
+class Prediction:
+    """Both models' probabilities for one image, with the derived labels and confidences"""
+
+    def __init__(self, probabilities: Dict[str, np.ndarray], tta_views: int = 1, key: Optional[str] = None,
+                 ranking: Optional[Dict[str, tuple]] = None):
+        self.probabilities = probabilities
+        self.tta_views = tta_views
+        self.key = key
+        if ranking is None:
+            ranking = {}
+            for name, probs in probabilities.items():
+                labels, confidences = rank_classes(np.asarray(probs)[None])
+                ranking[name] = (labels[0], confidences[0])
+        # Per model: (labels by decreasing probability, their confidences in percent)
+        self.ranking = ranking
+        self.labels = {name: labels[0] for name, (labels, _) in ranking.items()}
+        self.confidences = {name: confidences[0] for name, (_, confidences) in ranking.items()}
+
+    @property
+    def agree(self) -> bool:
+        return len(set(self.labels.values())) == 1
+
+    @property
+    def agreement(self) -> str:
+        return AGREE if self.agree else DISAGREE
+
+    @property
+    def final_prediction(self) -> str:
+        return next(iter(self.labels.values())) if self.agree else NEEDS_VERIFICATION
+
+    def model_result(self, name: str, position: int) -> str:
+        return f"Model {position} ({MODEL_NAMES.get(name, name)}): {self.labels[name]} ({self.confidences[name]}%)"
+
+    @property
+    def raw_result(self) -> str:
+        lines = [self.model_result(name, position) for position, name in enumerate(self.labels, 1)]
+        return "\n".join(lines) + f"\n\n{self.agreement}"
+
+
+class PredictionHook:
+    """Extension point of PredictionService; override the methods needed"""
+
+    def lookup(self, key: str, tta_views: int) -> Optional[Prediction]:
+        """A cached prediction for the image key, or None to run the models"""
+        return None
+
+    def store(self, prediction: Prediction) -> None:
+        """Called with every freshly computed prediction that has a key"""
+
+    def on_inference(self, batch_size: int, tta_views: int, seconds: float) -> None:
+        """Called after all models ran on a batch"""
+
+    def on_prediction(self, prediction: Prediction, source: str) -> None:
+        """Called for every prediction returned, cached or not"""
+
+
+class MetricsHook(PredictionHook):
+    """Inference latency per TTA setting and prediction/disagreement counters on /metrics"""
+
+    def on_inference(self, batch_size: int, tta_views: int, seconds: float) -> None:
+        # Per image, so batched and single predictions stay comparable
+        observe_inference(tta_views, seconds / batch_size)
+
+    def on_prediction(self, prediction: Prediction, source: str) -> None:
+        record_prediction(source, prediction.agree)
+
+
+class PredictionService:
+    """Preprocessing, batched inference, post-processing and response building for a set of models"""
+
+    def __init__(self, models: Dict[str, object], hooks: Sequence[PredictionHook] = ()):
+        self.models = dict(models)
+        self.hooks = list(hooks)
+
+    def add_hook(self, hook: PredictionHook):
+        self.hooks.append(hook)
+
+    def predict_many(self, images: Sequence, tta_views: int = 1, source: str = "upload",
+                     keys: Optional[Sequence[Optional[str]]] = None) -> List[Prediction]:
+        """Predictions for a batch of PIL images; keys (e.g. image hashes) enable the caching hooks"""
+        keys = list(keys) if keys is not None else [None] * len(images)
+        predictions: List[Optional[Prediction]] = [None] * len(images)
+        for position, key in enumerate(keys):
+            if key is not None:
+                predictions[position] = self._lookup(key, tta_views)
+
+        pending = [position for position, prediction in enumerate(predictions) if prediction is None]
+        if pending:
+            with stage_timer("preprocess"):
+                processed = np.concatenate([preprocess(images[position]) for position in pending])
+            computed = self.predict_processed(processed, tta_views)
+            for position, prediction in zip(pending, computed):
+                prediction.key = keys[position]
+                predictions[position] = prediction
+                if prediction.key is not None:
+                    for hook in self.hooks:
+                        hook.store(prediction)
+
+        for prediction in predictions:
+            for hook in self.hooks:
+                hook.on_prediction(prediction, source)
+        return predictions
+
+    def predict(self, image, tta_views: int = 1, source: str = "upload", key: Optional[str] = None) -> Prediction:
+        return self.predict_many([image], tta_views, source, [key])[0]
+
+    def predict_processed(self, processed: np.ndarray, tta_views: int = 1) -> List[Prediction]:
+        """Predictions for an already preprocessed (N, H, W, C) batch"""
+        count = len(processed)
+        if tta_views > 1:
+            with stage_timer("tta_augment"):
+                processed = np.concatenate([tta_augment(processed[i:i + 1], tta_views) for i in range(count)])
+
+        probabilities = {}
+        inference_start = time.perf_counter()
+        try:
+            for name, model in self.models.items():
+                with stage_timer(f"{name}_inference"):
+                    output = np.asarray(model.predict(processed, verbose=0))
+                # Average each image's augmented views (they are consecutive in the batch)
+                probabilities[name] = output.reshape(count, tta_views, -1).mean(axis=1) if tta_views > 1 else output
+        except Exception as e:
+            raise InferenceError(str(e)) from e
+        seconds = time.perf_counter() - inference_start
+        for hook in self.hooks:
+            hook.on_inference(count, tta_views, seconds)
+
+        rankings = {name: rank_classes(probs) for name, probs in probabilities.items()}
+        return [
+            Prediction(
+                {name: probs[i] for name, probs in probabilities.items()},
+                tta_views,
+                ranking={name: (labels[i], confidences[i]) for name, (labels, confidences) in rankings.items()},
+            )
+            for i in range(count)
+        ]
+
+    def _lookup(self, key: str, tta_views: int) -> Optional[Prediction]:
+        for hook in self.hooks:
+            prediction = hook.lookup(key, tta_views)
+            if prediction is not None:
+                return prediction
+        return None
+
+    def build_response(self, prediction: Prediction, top_k: int = 1, include_probabilities: bool = False,
+                       **extra) -> Dict:
+        """
+        The /predict response for a prediction; extra keys (source, image_path...) are appended.
+        top_k > 1 adds each model's k most likely blood groups, include_probabilities its 8-class vector.
+        """
+        start = time.perf_counter()
+        predictions = {}
+        for name, (labels, confidences) in prediction.ranking.items():
+            result = {"blood_group": labels[0], "confidence": confidences[0], "model": MODEL_NAMES.get(name, name)}
+            if top_k > 1:
+                result["top_k"] = [
+                    {"blood_group": label, "confidence": confidence}
+                    for label, confidence in zip(labels[:top_k], confidences[:top_k])
+                ]
+            if include_probabilities:
+                probs = np.round(np.asarray(prediction.probabilities[name], dtype=np.float64), 6)
+                result["probabilities"] = dict(zip(CLASS_LABELS, probs.tolist()))
+            predictions[name] = result
+        predictions["agreement"] = prediction.agreement
+        predictions["final_prediction"] = prediction.final_prediction
+        response = {"success": True, "predictions": predictions, "raw_result": prediction.raw_result}
+        response.update(extra)
+        if prediction.tta_views > 1:
+            response["tta_views"] = prediction.tta_views
+        observe_stage("response_build", time.perf_counter() - start)
+        return response
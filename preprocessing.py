@@ -0,0 +1,22 @@
+"""
+Image preprocessing shared by the API and the offline tools
+
+Kept free of TensorFlow and FastAPI imports so that tools can decode and
+preprocess images (e.g. in worker threads) without loading the app.
+"""
+
+import numpy as np
+
+# Blood group labels, in the order of the models' outputs
+CLASS_LABELS = ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]
+
+# Model input size
+IMAGE_SIZE = (128, 128)
+
+
+def preprocess(image):
+    """PIL image -> (1, 128, 128, 3) array scaled to [0, 1]"""
+    image = image.convert("RGB").resize(IMAGE_SIZE)
+    image = np.array(image) / 255.0
+    image = np.expand_dims(image, axis=0)
+    return image
@@ -0,0 +1,112 @@
+"""
+Idempotency keys and in-flight request coalescing
+
+Clients on flaky networks retry requests whose response they never saw, and a
+retry of /predict or /capture-and-predict repeats the inference (and, for a
+capture, asks the patient for another capture). RequestCoalescer.run(key,
+compute) makes those retries cheap:
+
+- while a computation for `key` is in flight, later requests with the same key
+  wait for it instead of starting their own (coalesced)
+- with store=True (idempotency keys), a successful result is kept in a bounded
+  table for ttl_seconds, and requests with the same key get it back without
+  computing anything (replayed)
+
+The computation runs as its own asyncio task, so a client that disconnects
+does not cancel it for the requests waiting on it. Failures are shared with
+the requests waiting at the time but not stored, so a later retry computes
+again. A key can carry a fingerprint of the request it was first used with
+(e.g. the image hash); reusing the key with another fingerprint raises
+IdempotencyConflict.
+
+State is per process; with several serving workers, retries coalesce when
+they reach the same worker.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+COMPUTED = "computed"
+COALESCED = "coalesced"
+REPLAYED = "replayed"
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different fingerprint"""
+
+
+class _InFlight:
+    def __init__(self, task: asyncio.Task, fingerprint: Optional[str]):
+        self.task = task
+        self.fingerprint = fingerprint
+
+
+class RequestCoalescer:
+    """In-flight computations and completed results by key, with LRU and TTL eviction of the results"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._inflight: Dict[str, _InFlight] = {}
+        # key -> (expiry, fingerprint, result), oldest first
+        self._completed: "OrderedDict[str, Tuple[float, Optional[str], Any]]" = OrderedDict()
+        self.counts = {COMPUTED: 0, COALESCED: 0, REPLAYED: 0}
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[Any]],
+                  fingerprint: Optional[str] = None, store: bool = True) -> Tuple[Any, str]:
+        """
+        The result of compute() for key, and whether it was computed, coalesced or replayed.
+        With store=False the key is only shared while the computation is in flight.
+        """
+        self._evict_expired()
+        completed = self._completed.get(key)
+        if completed is not None:
+            _, stored_fingerprint, result = completed
+            self._check_fingerprint(stored_fingerprint, fingerprint)
+            self._completed.move_to_end(key)
+            self.counts[REPLAYED] += 1
+            return result, REPLAYED
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._check_fingerprint(inflight.fingerprint, fingerprint)
+            self.counts[COALESCED] += 1
+            return await asyncio.shield(inflight.task), COALESCED
+
+        task = asyncio.ensure_future(compute())
+        self._inflight[key] = _InFlight(task, fingerprint)
+        task.add_done_callback(lambda done: self._finished(key, fingerprint, store, done))
+        self.counts[COMPUTED] += 1
+        return await asyncio.shield(task), COMPUTED
+
+    def _finished(self, key: str, fingerprint: Optional[str], store: bool, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not store or task.cancelled() or task.exception() is not None or self.ttl_seconds <= 0 or self.max_entries <= 0:
+            return
+        self._completed[key] = (time.monotonic() + self.ttl_seconds, fingerprint, task.result())
+        self._completed.move_to_end(key)
+        while len(self._completed) > self.max_entries:
+            self._completed.popitem(last=False)
+
+    @staticmethod
+    def _check_fingerprint(stored: Optional[str], fingerprint: Optional[str]):
+        if stored is not None and fingerprint is not None and stored != fingerprint:
+            raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        # Entries are ordered by last use, not by expiry, so check them all
+        expired = [key for key, (expiry, _, _) in self._completed.items() if expiry <= now]
+        for key in expired:
+            del self._completed[key]
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._inflight),
+            "completed_entries": len(self._completed),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            **self.counts,
+        }
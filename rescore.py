@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Offline bulk re-scoring of fingerprint image directories
+
+Walks a directory tree, decodes and preprocesses images in a thread pool while
+the previous batch runs through the models, and appends one CSV row per image
+with both models' predictions (the same preprocessing, models and prediction
+service as app.py).
+
+When an image's parent folder is a blood group (e.g. Sample dataset/A+/1.jpg),
+the folder is used as its label, and accuracy plus a confusion matrix per model
+are printed and written to <output>.summary.json.
+
+The CSV doubles as the checkpoint: re-running with the same output skips images
+already scored with the same size and modification time, so an interrupted run
+over a large archive resumes where it stopped.
+
+Examples:
+  python rescore.py "Sample dataset"
+  python rescore.py Images/ --output images_scores.csv --batch-size 32 --workers 8
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import CLASS_LABELS, preprocess
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+MODELS = ("vgg16", "mobilenetv2")
+FIELDS = ["path", "size", "mtime", "label",
+          "vgg16", "vgg16_confidence", "mobilenetv2", "mobilenetv2_confidence",
+          "agreement", "final_prediction", "error"]
+PROBABILITY_FIELDS = [f"{model}_p_{label}" for model in MODELS for label in CLASS_LABELS]
+
+
+def find_images(root: str) -> List[str]:
+    """Image files below root, in a stable order"""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(dirpath, filename))
+    return paths
+
+
+def folder_label(path: str) -> str:
+    """Blood group named by the image's parent folder, or "" """
+    label = os.path.basename(os.path.dirname(path))
+    return label if label in CLASS_LABELS else ""
+
+
+def file_key(path: str) -> Tuple[str, str]:
+    stat = os.stat(path)
+    return str(stat.st_size), str(int(stat.st_mtime))
+
+
+def load_checkpoint(output: str) -> Dict[str, Tuple[str, str]]:
+    """Path -> (size, mtime) of images already scored without error (last row per path wins)"""
+    done = {}
+    if os.path.exists(output):
+        with open(output, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if row.get("error"):
+                    done.pop(row["path"], None)
+                else:
+                    done[row["path"]] = (row["size"], row["mtime"])
+    return done
+
+
+def decode(path: str) -> Tuple[str, Optional[np.ndarray], str]:
+    """Runs in the worker pool: (path, preprocessed float32 image or None, error)"""
+    try:
+        with Image.open(path) as image:
+            return path, preprocess(image)[0].astype(np.float32), ""
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def decoded_batches(paths: List[str], workers: int, batch_size: int) -> Iterator[List[Tuple[str, Optional[np.ndarray], str]]]:
+    """Decode in a thread pool with a bounded prefetch window, yielding batches in input order"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        remaining = iter(paths)
+        batch = []
+        while True:
+            # Keep a few batches decoding ahead of inference, without decoding the whole archive at once
+            while len(pending) < batch_size * 4:
+                path = next(remaining, None)
+                if path is None:
+                    break
+                pending.append(executor.submit(decode, path))
+            if not pending:
+                break
+            batch.append(pending.popleft().result())
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def confusion_matrix(labels: List[str], predictions: List[str]) -> np.ndarray:
+    """Rows: true label, columns: predicted label, in CLASS_LABELS order"""
+    index = {label: position for position, label in enumerate(CLASS_LABELS)}
+    matrix = np.zeros((len(CLASS_LABELS), len(CLASS_LABELS)), dtype=np.int64)
+    pairs = [(index[label], index[prediction]) for label, prediction in zip(labels, predictions)
+             if label in index and prediction in index]
+    if pairs:
+        rows, columns = np.array(pairs).T
+        np.add.at(matrix, (rows, columns), 1)
+    return matrix
+
+
+def print_confusion(name: str, matrix: np.ndarray, labeled: int):
+    print(f"\n{name}: accuracy {np.trace(matrix) / labeled:.2%} over {labeled} labeled image(s)")
+    print("  true \\ pred " + " ".join(f"{label:>5}" for label in CLASS_LABELS))
+    for label, row in zip(CLASS_LABELS, matrix):
+        if row.sum():
+            print(f"  {label:>11} " + " ".join(f"{count:>5}" for count in row))
+
+
+def summarize(output: str) -> Dict:
+    """Accuracy and confusion matrices over the labeled images of the CSV"""
+    with open(output, newline="", encoding="utf-8") as f:
+        # An image re-scored after it changed has several rows; the last one is current
+        latest = {row["path"]: row for row in csv.DictReader(f)}
+    rows = [row for row in latest.values() if row["label"] and not row["error"]]
+    summary = {"labeled_images": len(rows), "class_labels": CLASS_LABELS, "models": {}}
+    if not rows:
+        return summary
+    labels = [row["label"] for row in rows]
+    for name in MODELS + ("final_prediction",):
+        matrix = confusion_matrix(labels, [row[name] for row in rows])
+        summary["models"][name] = {
+            "accuracy": round(float(np.trace(matrix) / len(rows)), 4),
+            "confusion_matrix": matrix.tolist(),
+        }
+        print_confusion(name, matrix, len(rows))
+    # Images where the models disagree have no final prediction and count as misses above
+    summary["needs_verification"] = sum(row["final_prediction"] == "Needs verification" for row in rows)
+    print(f"\nNeeds verification: {summary['needs_verification']} of {len(rows)}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score a directory tree of fingerprint images with both models")
+    parser.add_argument('directory', help='Directory to walk (e.g. "Sample dataset" or Images/)')
+    parser.add_argument('--output', type=str, default='rescore_results.csv',
+                        help='CSV of per-image predictions, also the resume checkpoint (default: rescore_results.csv)')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Images per model call (default: 32)')
+    parser.add_argument('--workers', type=int, default=min(8, os.cpu_count() or 1),
+                        help='Decode/preprocess threads (default: min(8, CPUs))')
+    parser.add_argument('--probabilities', action='store_true',
+                        help='Also write every class probability of both models (only for a new output file)')
+    parser.add_argument('--restart', action='store_true',
+                        help='Ignore and overwrite an existing output instead of resuming')
+    parser.add_argument('--vgg16', type=str, default='VGG16.h5', help='VGG16 model path (default: VGG16.h5)')
+    parser.add_argument('--mobilenetv2', type=str, default='MobileNetV2.h5',
+                        help='MobileNetV2 model path (default: MobileNetV2.h5)')
+    args = parser.parse_args()
+
+    paths = find_images(args.directory)
+    if not paths:
+        print(f"❌ No images found in {args.directory}")
+        return False
+
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = load_checkpoint(args.output)
+    todo = [path for path in paths if done.get(path) != file_key(path)]
+    print(f"Found {len(paths)} image(s); {len(paths) - len(todo)} already scored, {len(todo)} to score")
+
+    if todo:
+        # Same model loading and thread configuration as the API
+        import inference_config
+        from model_loader import load_model
+        from prediction_service import PredictionService
+        inference_config.configure()
+        service = PredictionService({"vgg16": load_model(args.vgg16), "mobilenetv2": load_model(args.mobilenetv2)})
+
+        new_file = not os.path.exists(args.output)
+        if new_file:
+            fields = FIELDS + (PROBABILITY_FIELDS if args.probabilities else [])
+        else:
+            with open(args.output, newline="", encoding="utf-8") as f:
+                fields = next(csv.reader(f))
+
+        start = time.perf_counter()
+        scored = 0
+        with open(args.output, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            for batch in decoded_batches(todo, args.workers, args.batch_size):
+                valid = [(path, image) for path, image, error in batch if image is not None]
+                predictions = service.predict_processed(np.stack([image for _, image in valid])) if valid else []
+                prediction_of = {path: prediction for (path, _), prediction in zip(valid, predictions)}
+
+                for path, image, error in batch:
+                    size, mtime = file_key(path)
+                    row = {"path": path, "size": size, "mtime": mtime, "label": folder_label(path), "error": error}
+                    if image is not None:
+                        prediction = prediction_of[path]
+                        for name in MODELS:
+                            row[name] = prediction.labels[name]
+                            row[f"{name}_confidence"] = prediction.confidences[name]
+                            for label, probability in zip(CLASS_LABELS, prediction.probabilities[name]):
+                                row[f"{name}_p_{label}"] = round(float(probability), 6)
+                        row["agreement"] = prediction.agree
+                        row["final_prediction"] = prediction.final_prediction
+                    writer.writerow(row)
+                # Checkpoint: every completed batch is on disk before the next one starts
+                f.flush()
+                scored += len(batch)
+                elapsed = time.perf_counter() - start
+                print(f"  {scored}/{len(todo)} scored ({scored / elapsed:.1f} images/s)", end="\r")
+
+        print(f"\n✅ Scored {scored} image(s) in {time.perf_counter() - start:.1f} s -> {args.output}")
+
+    summary = summarize(args.output)
+    if summary["labeled_images"]:
+        summary_path = os.path.splitext(args.output)[0] + ".summary.json"
+        with open(summary_path, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"\n📊 Summary written to {summary_path}")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
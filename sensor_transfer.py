@@ -0,0 +1,231 @@
+"""
+R307S serial transfer helpers
+
+The image download is most of a capture's latency: 36,864 bytes of 4-bit
+pixels in 128-byte data packets, about 6.5 s at the default 57600 baud.
+PyFingerprint's downloadImage() also reads the stream one byte at a time into
+Python lists and sets the 73,728 pixels one by one. This module provides:
+
+- negotiate_baudrate(): switch the module to a faster baud rate with
+  setSystemParameter(4, N), probe the link at the new rate and fall back to
+  the previous rate when it is unreliable
+- download_image_into(): the raw UpImage (0x0A) transfer, reading every data
+  packet straight from the serial port into a preallocated buffer (readinto
+  on a memoryview), verifying checksums, with the transfer timing returned
+- unpack_image(): the 4-bit packed buffer to a 256x288 grayscale image in
+  two NumPy operations
+
+The packet format (start code 0xEF01, address, type, length, payload,
+checksum) is the one documented for the R30x family and used by PyFingerprint.
+"""
+
+import logging
+import struct
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+START_CODE = 0xEF01
+COMMAND_PACKET = 0x01
+DATA_PACKET = 0x02
+ACK_PACKET = 0x07
+END_DATA_PACKET = 0x08
+UPLOAD_IMAGE = 0x0A  # Module-to-host image transfer (PyFingerprint's FINGERPRINT_DOWNLOADIMAGE)
+BAUDRATE_PARAMETER = 4  # setSystemParameter register holding the baud rate as a multiple of 9600
+
+HEADER_BYTES = 9  # start code, address, packet type, length
+IMAGE_WIDTH = 256
+IMAGE_HEIGHT = 288
+IMAGE_BYTES = IMAGE_WIDTH * IMAGE_HEIGHT // 2  # Two 4-bit pixels per byte
+
+# Commands that must all succeed at a new baud rate before it is kept, and attempts to restore the old one
+PROBES = 5
+RESTORE_ATTEMPTS = 5
+
+# Rates the R307 family accepts (N x 9600 for N = 1..12)
+SUPPORTED_BAUDRATES = tuple(9600 * n for n in range(1, 13))
+
+
+class TransferStats:
+    """Timing of one image transfer"""
+
+    def __init__(self, payload_bytes: int, packets: int, seconds: float, baudrate: int):
+        self.payload_bytes = payload_bytes
+        self.packets = packets
+        self.seconds = seconds
+        self.baudrate = baudrate
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.payload_bytes / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def link_efficiency(self) -> float:
+        """Payload throughput relative to the line rate (10 bits per byte on the wire)"""
+        return self.bytes_per_second * 10 / self.baudrate if self.baudrate else 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "payload_bytes": self.payload_bytes,
+            "packets": self.packets,
+            "transfer_ms": round(self.seconds * 1000, 1),
+            "baudrate": self.baudrate,
+            "bytes_per_second": round(self.bytes_per_second),
+            "link_efficiency": round(self.link_efficiency, 3),
+        }
+
+
+def build_packet(address: int, packet_type: int, payload: bytes) -> bytes:
+    length = len(payload) + 2
+    checksum = (packet_type + (length >> 8) + (length & 0xFF) + sum(payload)) & 0xFFFF
+    return struct.pack(">HIBH", START_CODE, address, packet_type, length) + payload + struct.pack(">H", checksum)
+
+
+def _read_exact(serial, view: memoryview):
+    received = 0
+    while received < len(view):
+        count = serial.readinto(view[received:])
+        if not count:
+            raise TimeoutError("Serial read timeout during image transfer")
+        received += count
+
+
+def _read_header(serial, header: bytearray) -> Tuple[int, int]:
+    """Packet type and length (payload plus checksum) of the next packet"""
+    _read_exact(serial, memoryview(header))
+    start_code, _, packet_type, length = struct.unpack(">HIBH", header)
+    if start_code != START_CODE:
+        raise Exception('The received packet do not begin with a valid header!')
+    return packet_type, length
+
+
+def _checksum_ok(packet_type: int, length: int, payload: memoryview, checksum: bytes) -> bool:
+    expected = (packet_type + (length >> 8) + (length & 0xFF) + sum(payload)) & 0xFFFF
+    return expected == struct.unpack(">H", checksum)[0]
+
+
+def download_image_into(serial, address: int, buffer: bytearray) -> TransferStats:
+    """
+    Raw UpImage transfer of the image in the module's image buffer into `buffer` (IMAGE_BYTES long).
+    `serial` is the open pyserial port of the sensor connection.
+    """
+    start = time.perf_counter()
+    serial.write(build_packet(address, COMMAND_PACKET, bytes([UPLOAD_IMAGE])))
+
+    header = bytearray(HEADER_BYTES)
+    checksum = bytearray(2)
+    packet_type, length = _read_header(serial, header)
+    acknowledgement = bytearray(length)
+    _read_exact(serial, memoryview(acknowledgement))
+    if packet_type != ACK_PACKET:
+        raise Exception('The received packet is no ack packet!')
+    if acknowledgement[0] != 0x00:
+        raise Exception(f'Could not download image (confirmation code {hex(acknowledgement[0])})')
+
+    view = memoryview(buffer)
+    offset = 0
+    packets = 0
+    while True:
+        packet_type, length = _read_header(serial, header)
+        if packet_type not in (DATA_PACKET, END_DATA_PACKET):
+            raise Exception('The received packet is no data packet!')
+        payload_length = length - 2
+        if offset + payload_length > len(buffer):
+            raise Exception(f'The module sent more than {len(buffer)} bytes of image data')
+        payload = view[offset:offset + payload_length]
+        _read_exact(serial, payload)
+        _read_exact(serial, memoryview(checksum))
+        if not _checksum_ok(packet_type, length, payload, checksum):
+            raise Exception('The received packet is corrupted (the checksum is wrong)!')
+        offset += payload_length
+        packets += 1
+        if packet_type == END_DATA_PACKET:
+            break
+
+    if offset != len(buffer):
+        raise Exception(f'Incomplete image transfer: {offset} of {len(buffer)} bytes')
+    return TransferStats(offset, packets, time.perf_counter() - start, getattr(serial, "baudrate", 0))
+
+
+def unpack_image(buffer, width: int = IMAGE_WIDTH, height: int = IMAGE_HEIGHT) -> Image.Image:
+    """4-bit packed pixels (left pixel in the high nibble) to an 8-bit grayscale image"""
+    packed = np.frombuffer(buffer, dtype=np.uint8, count=width * height // 2)
+    pixels = np.empty(width * height, dtype=np.uint8)
+    # x17 maps 0..15 onto 0..255, as PyFingerprint does
+    pixels[0::2] = (packed >> 4) * 17
+    pixels[1::2] = (packed & 0x0F) * 17
+    return Image.fromarray(pixels.reshape(height, width), "L")
+
+
+def pack_image(image: Image.Image) -> bytes:
+    """Inverse of unpack_image: the module's 4-bit wire format of a 256x288 grayscale image"""
+    pixels = np.asarray(image.convert("L"), dtype=np.uint8).ravel() >> 4
+    return ((pixels[0::2] << 4) | pixels[1::2]).astype(np.uint8).tobytes()
+
+
+def serial_port(sensor):
+    """The pyserial port of a PyFingerprint connection, or None (e.g. for the simulated sensor)"""
+    return getattr(sensor, "_PyFingerprint__serial", None)
+
+
+def close_sensor(sensor):
+    """Release the serial port so the sensor can be reopened at another baud rate"""
+    port = serial_port(sensor)
+    if port is not None and port.isOpen():
+        port.close()
+
+
+def _probe(sensor, probes: int):
+    for _ in range(probes):
+        if not sensor.verifyPassword():
+            raise Exception("The sensor rejected the password")
+
+
+def negotiate_baudrate(sensor, open_sensor: Callable[[int], object], current: int, candidates: Sequence[int],
+                       probes: int = PROBES) -> Tuple[object, int]:
+    """
+    Switch the module from `current` to the fastest candidate rate at which the link holds up.
+
+    For each faster candidate, in decreasing order: setSystemParameter(4, rate / 9600), reopen the
+    port at that rate with open_sensor(rate) and run `probes` commands. When a probe fails, the
+    module is switched back to `current`. Returns the open sensor and its baud rate.
+    """
+    for rate in sorted(set(candidates), reverse=True):
+        if rate <= current:
+            break
+        if rate not in SUPPORTED_BAUDRATES:
+            raise ValueError(f"Unsupported baud rate {rate}; the R307 accepts multiples of 9600 up to 115200")
+        try:
+            sensor.setSystemParameter(BAUDRATE_PARAMETER, rate // 9600)
+        except Exception as e:
+            logger.warning(f"Could not switch the module to {rate} baud: {e}")
+            continue
+
+        close_sensor(sensor)
+        faster: Optional[object] = None
+        try:
+            faster = open_sensor(rate)
+            _probe(faster, probes)
+            logger.info(f"✅ Serial link switched to {rate} baud")
+            return faster, rate
+        except Exception as e:
+            logger.warning(f"Link unreliable at {rate} baud ({e}); falling back to {current} baud")
+
+        # The module is at `rate` now; ask it to go back (the link may drop some attempts), then reopen
+        for attempt in range(1, RESTORE_ATTEMPTS + 1):
+            try:
+                if faster is None:
+                    faster = open_sensor(rate)
+                faster.setSystemParameter(BAUDRATE_PARAMETER, current // 9600)
+                break
+            except Exception as e:
+                logger.warning(f"Could not switch the module back to {current} baud (attempt {attempt}): {e}")
+        if faster is not None:
+            close_sensor(faster)
+        sensor = open_sensor(current)
+        _probe(sensor, 1)
+    return sensor, current
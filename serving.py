@@ -0,0 +1,200 @@
+"""
+Multi-process serving for the BioPrint API
+
+With --workers 1 (the default) this is plain `uvicorn.run(app)`. With more workers
+a supervisor process binds the listening socket, preloads the model weights
+without initializing TensorFlow (see model_loader.py), and forks the workers, which
+share the weight pages copy-on-write instead of each loading its own copy. Each
+worker gets its own TensorFlow thread pools, sized so that the workers together
+do not oversubscribe the CPU cores, and can optionally be pinned to its own cores.
+Workers that exit unexpectedly are restarted.
+
+Platforms without os.fork (Windows) fall back to a single process.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Callable, List, Optional
+
+import uvicorn
+
+import model_loader
+from inference_config import InferenceConfig, available_cpus, configure, split_cpus
+
+logger = logging.getLogger(__name__)
+
+MODEL_PATHS = ["VGG16.h5", "MobileNetV2.h5"]
+# Give up when workers keep dying this soon after being started
+FAST_EXIT_SECONDS = 10.0
+MAX_FAST_EXITS = 5
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """Listening socket shared by all workers"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def inference_config_for(args, cpus: Optional[List[int]] = None) -> InferenceConfig:
+    """Environment/calibration configuration overridden by the command line"""
+    config = InferenceConfig.from_environment()
+    if args.intra_op_threads is not None:
+        config.intra_op_threads = args.intra_op_threads
+    if args.inter_op_threads is not None:
+        config.inter_op_threads = args.inter_op_threads
+    if cpus:
+        config.cpus = cpus
+
+    # Unless configured, workers split the cores between them
+    if args.workers > 1:
+        if not config.intra_op_threads:
+            config.intra_op_threads = max(1, len(config.cpus or available_cpus()) // args.workers)
+        if not config.inter_op_threads:
+            config.inter_op_threads = 1
+    return config
+
+
+def run_worker(app, load_models: Callable[[], None], sock: socket.socket, args, cpus: Optional[List[int]]):
+    """Body of a forked worker process; never returns"""
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        configure(inference_config_for(args, cpus))
+        load_models()
+
+        config = uvicorn.Config(app, log_level=args.log_level)
+        uvicorn.Server(config).run(sockets=[sock])
+    except Exception:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def run_single(app, load_models: Callable[[], None], args) -> bool:
+    """Serve from this process"""
+    configure(inference_config_for(args))
+    load_models()
+    uvicorn.run(app, host=args.host, port=args.port, log_level=args.log_level)
+    return True
+
+
+def run_prefork(app, load_models: Callable[[], None], args) -> bool:
+    """Bind, preload and fork args.workers workers, then supervise them until SIGINT/SIGTERM"""
+    sock = bind_socket(args.host, args.port)
+    config = inference_config_for(args)
+    print(f"🚀 Serving on http://{args.host}:{args.port} with {args.workers} workers "
+          f"(intra-op threads {config.intra_op_threads}, inter-op threads {config.inter_op_threads})")
+
+    if args.preload:
+        start = time.perf_counter()
+        total = model_loader.preload_weights(MODEL_PATHS)
+        print(f"✅ Preloaded {total / (1024 * 1024):.1f} MB of model weights in {time.perf_counter() - start:.2f} s, "
+              f"shared by all workers")
+
+    cpu_sets = split_cpus(config.cpus or available_cpus(), args.workers) if args.pin_cores else [None] * args.workers
+    workers = {}  # pid -> (worker index, start time)
+    stopping = False
+    fast_exits = 0
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(app, load_models, sock, args, cpu_sets[index])
+        workers[pid] = (index, time.monotonic())
+        cpus = f" on CPUs {cpu_sets[index]}" if cpu_sets[index] else ""
+        print(f"Worker {index} started (pid {pid}){cpus}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for index in range(args.workers):
+        spawn(index)
+
+    success = True
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid not in workers:
+            continue
+        index, started = workers.pop(pid)
+        if stopping:
+            continue
+
+        print(f"⚠️  Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+        if time.monotonic() - started < FAST_EXIT_SECONDS:
+            fast_exits += 1
+            if fast_exits >= MAX_FAST_EXITS:
+                print("❌ Workers keep exiting right after start, shutting down")
+                success = False
+                stop(signal.SIGTERM, None)
+                continue
+            time.sleep(1)
+        spawn(index)
+
+    sock.close()
+    return success
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the BioPrint API")
+    parser.add_argument('--host', type=str, default='0.0.0.0',
+                        help='Bind address (default: 0.0.0.0)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='Bind port (default: 8000)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get("BIOPRINT_WORKERS", "1")),
+                        help='Worker processes sharing the preloaded model weights (default: 1)')
+    parser.add_argument('--intra-op-threads', type=int,
+                        help='TensorFlow threads per op in each worker (default: see inference_config.py, CPUs / workers when workers > 1)')
+    parser.add_argument('--inter-op-threads', type=int,
+                        help='TensorFlow ops run concurrently in each worker (default: see inference_config.py, 1 when workers > 1)')
+    parser.add_argument('--pin-cores', action='store_true',
+                        help='Pin each worker to its own subset of the CPUs, or of BIOPRINT_PIN_CPUS (Linux only)')
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        help='Let each worker load its own copy of the models')
+    parser.add_argument('--log-level', type=str, default='info',
+                        help='Uvicorn log level (default: info)')
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and not hasattr(os, "fork"):
+        print("⚠️  Multiple workers need os.fork, which this platform lacks; serving from a single process")
+        args.workers = 1
+    if args.pin_cores and not hasattr(os, "sched_setaffinity"):
+        print("⚠️  Core pinning is not supported on this platform, ignoring --pin-cores")
+        args.pin_cores = False
+    return args
+
+
+def main(app, load_models: Callable[[], None], argv=None) -> bool:
+    """Entry point used by `python app.py`; load_models is called in every serving process"""
+    args = parse_args(argv)
+    if args.workers == 1:
+        return run_single(app, load_models, args)
+    return run_prefork(app, load_models, args)
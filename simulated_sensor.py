@@ -0,0 +1,377 @@
+"""
+Simulated R307S fingerprint sensor
+
+Software stand-in for the parts of the PyFingerprint interface used by
+R307FingerprintCaptureLibrary and clearModuleSlots.py, so the scanner endpoints
+can be load-tested without hardware. Select it with BIOPRINT_SCANNER=simulated.
+
+- Finger images are served from Images/ and Sample dataset/ (resized to the
+  sensor's 256x288 grayscale format)
+- Serial latency model: a fixed round trip per command plus the packet bytes
+  transferred at the configured baud rate (10 bits per byte), so a full image
+  download at 57600 baud costs about 7 seconds like the real module
+- Virtual slot database per port, shared by all connections in the process
+- The module's baud rate is per port too: setSystemParameter(4, N) switches it,
+  a connection opened at another rate fails every command, and one above the
+  configured reliable rate fails half of them, like a noisy serial link
+- download_image_into() fills a buffer with the 4-bit wire format, for the raw
+  transfer path of sensor_transfer.py
+- Commands on one port are serialized, like the single physical serial link
+
+Environment configuration:
+  BIOPRINT_SIM_IMAGE_DIRS        os.pathsep-separated image directories (default: Images, Sample dataset)
+  BIOPRINT_SIM_FINGER_DELAY      seconds until a finger is detected by readImage (default: 0.5)
+  BIOPRINT_SIM_COMMAND_LATENCY   fixed seconds per command round trip (default: 0.005)
+  BIOPRINT_SIM_PROCESSING_DELAY  seconds the module spends in convertImage/searchTemplate (default: 0.3)
+  BIOPRINT_SIM_TIME_SCALE        multiplier for all simulated delays, 0 disables them (default: 1.0)
+  BIOPRINT_SIM_MAX_BAUDRATE      highest baud rate at which the simulated link is reliable; above it half
+                                 of the commands fail with a checksum error (default: 115200)
+  BIOPRINT_SIM_SEED              random seed for finger selection (default: unseeded)
+"""
+
+import functools
+import hashlib
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from sensor_transfer import BAUDRATE_PARAMETER, pack_image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# R307 image and packet geometry
+IMAGE_WIDTH = 256
+IMAGE_HEIGHT = 288
+IMAGE_BYTES = IMAGE_WIDTH * IMAGE_HEIGHT // 2  # 4 bits per pixel on the wire
+DATA_PACKET_SIZE = 128
+PACKET_OVERHEAD = 11  # header, address, type, length and checksum
+COMMAND_PACKET_BYTES = 12
+STORAGE_CAPACITY = 1000
+DEFAULT_BAUDRATE = 57600
+SECURITY_LEVEL = 3
+PACKET_SIZE_CODE = 2  # 128-byte data packets
+INDEX_PAGE_SIZE = 256
+TEMPLATE_SIDE = 16
+MATCH_THRESHOLD = 0.8
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class SimulationConfig:
+    """Latency model and image sources of the simulated sensor"""
+
+    def __init__(self, image_dirs: Optional[List[str]] = None, finger_delay: Optional[float] = None,
+                 command_latency: Optional[float] = None, processing_delay: Optional[float] = None,
+                 time_scale: Optional[float] = None, seed: Optional[int] = None,
+                 max_baudrate: Optional[int] = None):
+        if image_dirs is None:
+            configured = os.environ.get("BIOPRINT_SIM_IMAGE_DIRS")
+            if configured:
+                image_dirs = configured.split(os.pathsep)
+            else:
+                image_dirs = [os.path.join(BASE_DIR, "Images"), os.path.join(BASE_DIR, "Sample dataset")]
+        self.image_dirs = image_dirs
+        self.finger_delay = finger_delay if finger_delay is not None else _env_float("BIOPRINT_SIM_FINGER_DELAY", 0.5)
+        self.command_latency = (command_latency if command_latency is not None
+                                else _env_float("BIOPRINT_SIM_COMMAND_LATENCY", 0.005))
+        self.processing_delay = (processing_delay if processing_delay is not None
+                                 else _env_float("BIOPRINT_SIM_PROCESSING_DELAY", 0.3))
+        self.time_scale = time_scale if time_scale is not None else _env_float("BIOPRINT_SIM_TIME_SCALE", 1.0)
+        if seed is None and os.environ.get("BIOPRINT_SIM_SEED"):
+            seed = int(os.environ["BIOPRINT_SIM_SEED"])
+        self.seed = seed
+        self.max_baudrate = (max_baudrate if max_baudrate is not None
+                             else int(_env_float("BIOPRINT_SIM_MAX_BAUDRATE", 115200)))
+
+    def image_paths(self) -> List[str]:
+        return list(_list_images(tuple(self.image_dirs)))
+
+
+@functools.lru_cache(maxsize=8)
+def _list_images(image_dirs: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Finger images in the given directories, listed once per process"""
+    paths = []
+    for directory in image_dirs:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            if "index.sqlite" in filenames:
+                # An image_store.ImageStore: its files are renamed and evicted while we run
+                dirnames[:] = []
+                continue
+            for filename in filenames:
+                if filename.lower().endswith((".bmp", ".jpg", ".jpeg", ".png")):
+                    paths.append(os.path.join(dirpath, filename))
+    return tuple(sorted(paths))
+
+
+class VirtualSlotDatabase:
+    """Template storage and persistent settings of one simulated module"""
+
+    def __init__(self, capacity: int = STORAGE_CAPACITY):
+        self.capacity = capacity
+        self.slots: Dict[int, np.ndarray] = {}
+        self.baudrate = DEFAULT_BAUDRATE
+        self.lock = threading.RLock()
+
+
+# Per-port state shared by every connection in this process
+_databases: Dict[str, VirtualSlotDatabase] = {}
+_port_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def _port_state(port: str) -> Tuple[VirtualSlotDatabase, threading.Lock]:
+    with _registry_lock:
+        if port not in _databases:
+            _databases[port] = VirtualSlotDatabase()
+            _port_locks[port] = threading.Lock()
+        return _databases[port], _port_locks[port]
+
+
+def reset_simulated_devices():
+    """Forget all virtual slot databases"""
+    with _registry_lock:
+        _databases.clear()
+        _port_locks.clear()
+
+
+def _load_finger_image(path: str) -> Image.Image:
+    image = Image.open(path).convert("L")
+    if image.size != (IMAGE_WIDTH, IMAGE_HEIGHT):
+        image = image.resize((IMAGE_WIDTH, IMAGE_HEIGHT))
+    return image
+
+
+def _extract_template(image: Image.Image) -> np.ndarray:
+    """Binary ridge pattern thumbnail standing in for the module's characteristics"""
+    thumbnail = np.asarray(image.resize((TEMPLATE_SIDE, TEMPLATE_SIDE)), dtype=np.float32)
+    return (thumbnail > thumbnail.mean()).ravel()
+
+
+def _match_score(template1: np.ndarray, template2: np.ndarray) -> int:
+    """Similarity on the module's 0-300ish accuracy scale, 0 when not matching"""
+    similarity = float(np.mean(template1 == template2))
+    return int(similarity * 300) if similarity >= MATCH_THRESHOLD else 0
+
+
+class SimulatedPyFingerprint:
+    """Drop-in replacement for pyfingerprint.PyFingerprint backed by image files"""
+
+    def __init__(self, port: str = '/dev/ttyUSB0', baudRate: int = 57600, address: int = 0xFFFFFFFF,
+                 password: int = 0x00000000, config: Optional[SimulationConfig] = None):
+        if baudRate < 9600 or baudRate > 115200 or baudRate % 9600 != 0:
+            raise ValueError('The given baud rate is invalid!')
+        self.port = port
+        self.baudrate = baudRate
+        self.address = address
+        self.password = password
+        self.config = config or SimulationConfig()
+        self.database, self._port_lock = _port_state(port)
+        self._random = random.Random(self.config.seed)
+        self._link_noise = random.Random(self.config.seed)
+        self._images = self.config.image_paths()
+        if not self._images:
+            raise Exception(f"Simulated sensor has no finger images in {self.config.image_dirs}")
+
+        # Finger currently on the sensor; kept for the whole connection so enrollment captures match
+        self._finger_path: Optional[str] = None
+        self._finger_since: Optional[float] = None
+        self._finger_lifted = False
+        self._image_buffer: Optional[Image.Image] = None
+        self._char_buffers: Dict[int, Optional[np.ndarray]] = {1: None, 2: None}
+
+    # Simulation controls
+
+    def present_finger(self, path: str):
+        """Use a specific image as the finger for the following captures"""
+        self._finger_path = path
+        self._finger_since = None
+
+    def _sleep(self, seconds: float):
+        if seconds > 0 and self.config.time_scale > 0:
+            time.sleep(seconds * self.config.time_scale)
+
+    def _transfer_seconds(self, payload_bytes: int) -> float:
+        return payload_bytes * 10 / self.baudrate
+
+    def _command(self, response_bytes: int = COMMAND_PACKET_BYTES, processing: float = 0.0):
+        """Serial round trip of one command packet and its acknowledgement"""
+        if self.baudrate != self.database.baudrate:
+            raise Exception('The received packet do not begin with a valid header!')
+        if self.baudrate > self.config.max_baudrate and self._link_noise.random() < 0.5:
+            raise Exception('The received packet is corrupted (the checksum is wrong)!')
+        with self._port_lock:
+            self._sleep(self.config.command_latency + processing
+                        + self._transfer_seconds(COMMAND_PACKET_BYTES + response_bytes))
+
+    # PyFingerprint interface
+
+    def verifyPassword(self) -> bool:
+        self._command()
+        return True
+
+    def readImage(self) -> bool:
+        self._command()
+        if self._finger_lifted:
+            # The first poll after convertImage sees the finger lifted off the sensor
+            self._finger_lifted = False
+            return False
+        now = time.monotonic()
+        if self._finger_since is None:
+            self._finger_since = now
+        if (now - self._finger_since) < self.config.finger_delay * max(self.config.time_scale, 0):
+            return False
+        if self._finger_path is None:
+            self._finger_path = self._random.choice(self._images)
+        self._image_buffer = _load_finger_image(self._finger_path)
+        return True
+
+    def finger_removed(self):
+        """Simulate lifting the finger; the next readImage waits for the finger delay again"""
+        self._finger_since = None
+
+    def downloadImage(self, imageDestination: str):
+        if self._image_buffer is None:
+            raise Exception('The image buffer is empty')
+        packets = -(-IMAGE_BYTES // DATA_PACKET_SIZE)
+        self._command(response_bytes=IMAGE_BYTES + packets * PACKET_OVERHEAD)
+        self._image_buffer.save(imageDestination)
+
+    def download_image_into(self, buffer: bytearray) -> int:
+        """Image buffer in the 4-bit wire format into `buffer`; returns the number of data packets"""
+        if self._image_buffer is None:
+            raise Exception('The image buffer is empty')
+        packets = -(-IMAGE_BYTES // DATA_PACKET_SIZE)
+        self._command(response_bytes=IMAGE_BYTES + packets * PACKET_OVERHEAD)
+        buffer[:IMAGE_BYTES] = pack_image(self._image_buffer)
+        return packets
+
+    def convertImage(self, charBufferNumber: int = 0x01) -> bool:
+        if self._image_buffer is None:
+            raise Exception('The image contains too few feature points')
+        self._command(processing=self.config.processing_delay)
+        self._char_buffers[charBufferNumber] = _extract_template(self._image_buffer)
+        # The finger has to be placed again for the next capture
+        self._finger_since = None
+        self._finger_lifted = True
+        return True
+
+    def compareCharacteristics(self) -> int:
+        self._command()
+        first, second = self._char_buffers.get(1), self._char_buffers.get(2)
+        if first is None or second is None:
+            return 0
+        return _match_score(first, second)
+
+    def createTemplate(self) -> bool:
+        self._command()
+        first, second = self._char_buffers.get(1), self._char_buffers.get(2)
+        if first is None or second is None or _match_score(first, second) == 0:
+            return False
+        return True
+
+    def storeTemplate(self, positionNumber: int = -1, charBufferNumber: int = 0x01) -> int:
+        self._command()
+        template = self._char_buffers.get(charBufferNumber)
+        if template is None:
+            raise Exception('The template buffer is empty')
+        with self.database.lock:
+            if positionNumber == -1:
+                free = [slot for slot in range(self.database.capacity) if slot not in self.database.slots]
+                if not free:
+                    raise Exception('The storage is full')
+                positionNumber = free[0]
+            if positionNumber < 0 or positionNumber >= self.database.capacity:
+                raise ValueError('The given position number is invalid!')
+            self.database.slots[positionNumber] = template.copy()
+        return positionNumber
+
+    def searchTemplate(self, charBufferNumber: int = 0x01, positionStart: int = 0, count: int = -1) -> Tuple[int, int]:
+        self._command(processing=self.config.processing_delay)
+        template = self._char_buffers.get(charBufferNumber)
+        if template is None:
+            return (-1, -1)
+        end = self.database.capacity if count < 0 else positionStart + count
+        with self.database.lock:
+            candidates = sorted((slot, stored) for slot, stored in self.database.slots.items()
+                                if positionStart <= slot < end)
+        best_slot, best_score = -1, -1
+        for slot, stored in candidates:
+            score = _match_score(template, stored)
+            if score > best_score and score > 0:
+                best_slot, best_score = slot, score
+        return (best_slot, best_score) if best_slot >= 0 else (-1, -1)
+
+    def setSystemParameter(self, parameterNumber: int, parameterValue: int) -> bool:
+        if parameterNumber == BAUDRATE_PARAMETER:
+            if parameterValue < 1 or parameterValue > 12:
+                raise ValueError('The given baudrate parameter is invalid!')
+            # Acknowledged at the old rate; the module then listens at the new one
+            self._command()
+            self.database.baudrate = parameterValue * 9600
+            return True
+        if parameterNumber in (5, 6):
+            self._command()
+            return True
+        raise ValueError('The given parameter number is invalid!')
+
+    def getSystemParameters(self) -> Tuple[int, int, int, int, int, int, int]:
+        self._command(response_bytes=28)
+        return (0, 0, self.database.capacity, SECURITY_LEVEL, self.address, PACKET_SIZE_CODE,
+                self.database.baudrate // 9600)
+
+    def getTemplateCount(self) -> int:
+        self._command()
+        with self.database.lock:
+            return len(self.database.slots)
+
+    def getStorageCapacity(self) -> int:
+        self._command()
+        return self.database.capacity
+
+    def loadTemplate(self, positionNumber: int, charBufferNumber: int = 0x01) -> bool:
+        self._command()
+        with self.database.lock:
+            template = self.database.slots.get(positionNumber)
+        if template is None:
+            raise Exception('The template could not be read')
+        self._char_buffers[charBufferNumber] = template.copy()
+        return True
+
+    def deleteTemplate(self, positionNumber: int, count: int = 1) -> bool:
+        self._command()
+        if positionNumber < 0 or positionNumber + count > self.database.capacity:
+            raise ValueError('The given position number is invalid!')
+        with self.database.lock:
+            for slot in range(positionNumber, positionNumber + count):
+                self.database.slots.pop(slot, None)
+        return True
+
+    def clearDatabase(self) -> bool:
+        self._command()
+        with self.database.lock:
+            self.database.slots.clear()
+        return True
+
+    def getTemplateIndex(self, page: int) -> List[bool]:
+        self._command(response_bytes=INDEX_PAGE_SIZE // 8)
+        start = page * INDEX_PAGE_SIZE
+        with self.database.lock:
+            return [slot in self.database.slots for slot in range(start, start + INDEX_PAGE_SIZE)]
+
+    def downloadCharacteristics(self, charBufferNumber: int = 0x01) -> List[int]:
+        template = self._char_buffers.get(charBufferNumber)
+        if template is None:
+            raise Exception('The template buffer is empty')
+        self._command(response_bytes=512)
+        return list(hashlib.sha256(np.packbits(template).tobytes()).digest())
+
@@ -0,0 +1,202 @@
+"""
+Streaming image uploads
+
+FastAPI's UploadFile parameters make Starlette buffer the whole request body
+before the endpoint runs, so a 50 MB upload is fully read before anything but
+its declared content type is checked. read_image_upload() instead parses the
+multipart body chunk by chunk as it arrives:
+- a Content-Length above the limit is rejected before reading anything, and the
+  body is counted as it streams in, so oversized uploads stop at the limit
+- each chunk of the image part is fed to an incremental decoder (PIL's
+  ImageFile.Parser), which identifies the format and dimensions from the first
+  few KB; unsupported formats, bogus data and oversized images are rejected
+  there, without reading the rest of the body
+- the SHA-256 of the image bytes is computed while streaming
+
+read_image_uploads() does the same for several files sent in one field (batch
+uploads), with a per-file and a total size limit.
+
+Rejections are raised as UploadRejected with the HTTP status to return and an
+error type for the error metrics.
+"""
+
+import hashlib
+from typing import List, Optional
+
+from PIL import Image, ImageFile
+from multipart.multipart import MultipartParser, parse_options_header
+
+# Formats the models have been used with; anything else is rejected on its header
+SUPPORTED_FORMATS = {"JPEG", "PNG", "BMP", "TIFF", "WEBP"}
+# Bytes of the image after which an unrecognized header is treated as bogus data
+SNIFF_BYTES = 64 * 1024
+
+
+class UploadRejected(Exception):
+    """An upload rejected while streaming; status_code is the HTTP status to return"""
+
+    def __init__(self, status_code: int, error: str, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.error = error
+        self.detail = detail
+
+
+class ImageUpload:
+    """Decoded image of an upload with its metadata"""
+
+    def __init__(self, image: Image.Image, filename: Optional[str], content_type: str, size: int, sha256: str):
+        self.image = image
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.sha256 = sha256
+
+
+class _ImagePart:
+    """Incremental decoder and hash of one file part"""
+
+    def __init__(self, filename: Optional[str], content_type: str):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.done = False
+        self.decoder = ImageFile.Parser()
+        self.digest = hashlib.sha256()
+
+    def upload(self) -> ImageUpload:
+        if not self.done or self.decoder.image is None:
+            raise UploadRejected(400, "invalid_image", "File is not a recognized image")
+        try:
+            image = self.decoder.close()
+        except Exception as e:
+            raise UploadRejected(400, "invalid_image", f"Invalid image data: {e}")
+        return ImageUpload(image, self.filename, self.content_type, self.size, self.digest.hexdigest())
+
+
+class _ImageParts:
+    """Multipart callbacks feeding each `field` part into its own incremental image decoder"""
+
+    def __init__(self, field: str, max_files: int, max_file_bytes: int, max_side: int):
+        self.field = field
+        self.max_files = max_files
+        self.max_file_bytes = max_file_bytes
+        self.max_side = max_side
+        self.parts: List[_ImagePart] = []
+        self._current: Optional[_ImagePart] = None
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field_data,
+            "on_header_value": self._header_value_data,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _part_begin(self):
+        self._headers = {}
+        self._current = None
+
+    def _header_field_data(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _header_value_data(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if options.get(b"name", b"").decode("latin-1") != self.field:
+            return
+        if len(self.parts) == self.max_files:
+            if self.max_files == 1:
+                return  # Single-file uploads ignore repeated fields
+            raise UploadRejected(413, "too_many_files", f"At most {self.max_files} files per request")
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1")
+        if not content_type.startswith("image/"):
+            raise UploadRejected(400, "invalid_file_type", "File must be an image")
+        filename = options.get(b"filename")
+        self._current = _ImagePart(filename.decode("utf-8", "replace") if filename is not None else None, content_type)
+        self.parts.append(self._current)
+
+    def _part_data(self, data: bytes, start: int, end: int):
+        part = self._current
+        if part is None:
+            return
+        chunk = data[start:end]
+        part.size += len(chunk)
+        if part.size > self.max_file_bytes:
+            raise UploadRejected(413, "upload_too_large",
+                                 f"File exceeds the {self.max_file_bytes / (1024 * 1024):g} MB limit")
+        part.digest.update(chunk)
+
+        header_known = part.decoder.image is not None
+        try:
+            part.decoder.feed(chunk)
+        except Exception as e:
+            raise UploadRejected(400, "invalid_image", f"Invalid image data: {e}")
+        if not header_known:
+            self._check_header(part)
+
+    def _check_header(self, part: _ImagePart):
+        image = part.decoder.image
+        if image is None:
+            if part.size > SNIFF_BYTES:
+                raise UploadRejected(400, "invalid_image", "File is not a recognized image")
+            return
+        if image.format not in SUPPORTED_FORMATS:
+            raise UploadRejected(400, "unsupported_format",
+                                 f"Unsupported image format {image.format}; use JPEG, PNG or BMP")
+        width, height = image.size
+        if width > self.max_side or height > self.max_side:
+            raise UploadRejected(413, "image_too_large",
+                                 f"Image is {width}x{height}; the maximum is {self.max_side} pixels per side")
+
+    def _part_end(self):
+        if self._current is not None:
+            self._current.done = True
+            self._current = None
+
+
+async def read_image_uploads(request, field: str = "files", max_files: int = 32, max_bytes: int = 50 * 1024 * 1024,
+                             max_file_bytes: Optional[int] = None, max_side: int = 4096) -> List[ImageUpload]:
+    """Stream every multipart `field` part of a request into decoded images, enforcing the limits"""
+    too_large = UploadRejected(413, "upload_too_large", f"Upload exceeds the {max_bytes / (1024 * 1024):g} MB limit")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise too_large
+
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadRejected(400, "invalid_upload", f"Upload must be multipart/form-data with a '{field}' field")
+
+    parts = _ImageParts(field, max_files, max_file_bytes or max_bytes, max_side)
+    parser = MultipartParser(boundary, parts.callbacks())
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise too_large
+        parser.write(chunk)
+    parser.finalize()
+
+    if not parts.parts:
+        raise UploadRejected(422, "missing_file", f"Field '{field}' is required")
+    return [part.upload() for part in parts.parts]
+
+
+async def read_image_upload(request, field: str = "file", max_bytes: int = 10 * 1024 * 1024,
+                            max_side: int = 4096) -> ImageUpload:
+    """Stream the multipart `field` of a request into a decoded image, enforcing the limits"""
+    return (await read_image_uploads(request, field, 1, max_bytes, max_side=max_side))[0]
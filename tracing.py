@@ -0,0 +1,375 @@
+"""
+Per-request tracing and slow-request profiling for the BioPrint API
+
+Every HTTP request gets a request id (taken from an incoming X-Request-ID header
+or generated) and a Trace that collects timed spans from app.py and the R307S
+capture library. The id and the span timings are returned in the X-Request-ID and
+Server-Timing response headers.
+
+A sampling profiler thread records Python stacks while requests are in flight.
+A sample only goes to the request the thread is working for: on the event loop,
+the request whose handler is running; on a worker thread, the request whose
+span is open there. Threads blocked waiting, and scanner polls for a finger,
+are skipped; serial reads and writes are kept under a "serial I/O" root. When a request takes
+longer than the configured threshold, its collapsed stacks and spans are
+written to a rotating local directory by the profiler thread; the samples of
+fast requests are discarded.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("bioprint_trace", default=None)
+
+# Worker thread id -> trace of the span open on it, for the profiler (event loop spans are not recorded here)
+_thread_traces: Dict[int, "Trace"] = {}
+
+# Innermost frames of a thread that is blocked, not working: (file, function)
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+}
+# Calls anywhere on a stack that mean the request is waiting for a person: polling for a finger
+IDLE_CALLS = {("fingerprint-scanner.py", "_wait_for_finger")}
+# Stacks inside pyserial are kept under a "serial I/O" root, so image downloads show up as one block
+SERIAL_IO_FILES = ("serialposix.py", "serialwin32.py", "serialutil.py")
+SERIAL_IO_ROOT = "serial I/O"
+
+
+class Trace:
+    """Spans recorded for a single request"""
+
+    def __init__(self, request_id: str, method: str = "", path: str = ""):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.spans: List[Dict] = []
+        self._depth = 0
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def add_span(self, name: str, start: float, duration: float, attributes: Optional[Dict] = None, depth: int = 0):
+        span = {
+            "name": name,
+            "start_ms": round((start - self.start) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            "depth": depth,
+        }
+        if attributes:
+            span["attributes"] = attributes
+        with self._lock:
+            self.spans.append(span)
+
+    def stage_durations(self) -> Dict[str, float]:
+        """Total seconds spent per span name"""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for span in self.spans:
+                totals[span["name"]] = totals.get(span["name"], 0.0) + span["duration_ms"] / 1000
+        return totals
+
+    def server_timing(self) -> str:
+        """Render top-level spans as a Server-Timing header value"""
+        with self._lock:
+            spans = [span for span in self.spans if span["depth"] == 0]
+        entries = [f'{span["name"]};dur={span["duration_ms"]}' for span in spans]
+        entries.append(f"total;dur={round(self.duration * 1000, 3)}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        return {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "duration_ms": round(self.duration * 1000, 3),
+            "spans": spans,
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    """Trace of the request being handled, if any"""
+    return _current_trace.get()
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+
+@contextmanager
+def _working_for(trace: Optional[Trace]):
+    """Attribute this thread's profiler samples to trace; a no-op on the event loop thread"""
+    if trace is None or asyncio._get_running_loop() is not None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    previous = _thread_traces.get(thread_id)
+    _thread_traces[thread_id] = trace
+    try:
+        yield
+    finally:
+        if previous is None:
+            _thread_traces.pop(thread_id, None)
+        else:
+            _thread_traces[thread_id] = previous
+
+
+@contextmanager
+def use_trace(trace: Optional[Trace]):
+    """Make trace current, e.g. in a worker thread handling part of a request"""
+    token = _current_trace.set(trace)
+    try:
+        with _working_for(trace):
+            yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a block as a span of the current request.
+    Yields a dict that the block can fill with extra attributes.
+    Outside a request this only costs a context variable lookup.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield attributes
+        return
+
+    depth = trace._depth
+    trace._depth = depth + 1
+    start = time.perf_counter()
+    try:
+        with _working_for(trace):
+            yield attributes
+    finally:
+        trace._depth = depth
+        trace.add_span(name, start, time.perf_counter() - start, attributes, depth)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator recording each call of a function as a span"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_span(name: str, start: float, duration: float) -> None:
+    """Record an already-timed block (perf_counter start, seconds) on the current trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, start, duration, depth=trace._depth)
+
+
+class SlowRequestProfiler:
+    """
+    Sampling stack profiler that keeps profiles of slow requests only.
+    The sampler thread sleeps while no request is in flight. Requests whose path
+    starts with one of exclude_paths (event streams, waits on the scanner) are not
+    profiled.
+    """
+
+    def __init__(self, output_dir: str = "profiles", threshold_ms: float = 5000,
+                 interval: float = 0.01, keep: int = 50, max_depth: int = 64, exclude_paths: Sequence[str] = ()):
+        self.output_dir = output_dir
+        self.threshold_ms = threshold_ms
+        self.interval = interval
+        self.keep = keep
+        self.max_depth = max_depth
+        self.exclude_paths = tuple(path for path in exclude_paths if path)
+        self._active: Dict[int, Counter] = {}
+        self._handler_frames: Dict[object, int] = {}  # Request handler frame on the event loop -> id(trace)
+        self._pending: List = []  # (trace, samples) of slow requests waiting to be written
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+        self._thread.start()
+
+    def begin(self, trace: Trace, frame=None):
+        """Start sampling for trace; frame is its handler's frame on the event loop"""
+        if not self.enabled or (self.exclude_paths and trace.path.startswith(self.exclude_paths)):
+            return
+        with self._lock:
+            self._active[id(trace)] = Counter()
+            if frame is not None:
+                self._handler_frames[frame] = id(trace)
+            self._wakeup.set()
+
+    def finish(self, trace: Trace):
+        if not self.enabled:
+            return
+        with self._lock:
+            samples = self._active.pop(id(trace), None)
+            for frame in [frame for frame, key in self._handler_frames.items() if key == id(trace)]:
+                del self._handler_frames[frame]
+            if samples is not None and trace.duration * 1000 >= self.threshold_ms:
+                # Written by the profiler thread, off the event loop
+                self._pending.append((trace, samples))
+                self._wakeup.set()
+
+    def _sample(self, own_id: int):
+        frames = sys._current_frames()
+        with self._lock:
+            handler_frames = dict(self._handler_frames)
+        stacks = []
+        for thread_id, frame in frames.items():
+            if thread_id == own_id:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            worker_trace = _thread_traces.get(thread_id)
+            key = id(worker_trace) if worker_trace is not None else None
+            names = []
+            serial_io = idle = False
+            while frame is not None:
+                if key is None:
+                    key = handler_frames.get(frame)
+                code = frame.f_code
+                filename = os.path.basename(code.co_filename)
+                if (filename, code.co_name) in IDLE_CALLS:
+                    idle = True
+                    break
+                serial_io = serial_io or filename in SERIAL_IO_FILES
+                if len(names) < self.max_depth:
+                    names.append(f"{code.co_name} ({filename})")
+                frame = frame.f_back
+            if key is not None and not idle:  # Otherwise not working for a profiled request
+                stack = ";".join(reversed(names))
+                stacks.append((key, f"{SERIAL_IO_ROOT};{stack}" if serial_io else stack))
+        del frames
+        with self._lock:
+            for key, stack in stacks:
+                samples = self._active.get(key)
+                if samples is not None:
+                    samples[stack] += 1
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                pending, self._pending = self._pending, []
+                sampling = bool(self._active)
+                if not sampling:
+                    self._wakeup.clear()
+            for trace, samples in pending:
+                try:
+                    self._write_profile(trace, samples)
+                except Exception as e:
+                    logger.error(f"Failed to write slow request profile: {e}")
+            if sampling:
+                self._sample(own_id)
+                time.sleep(self.interval)
+
+    def _write_profile(self, trace: Trace, samples: Counter):
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        filename = os.path.join(self.output_dir, f"profile_{timestamp}_{trace.request_id}.json")
+        profile = trace.to_dict()
+        profile["sample_interval_ms"] = self.interval * 1000
+        profile["folded"] = [f"{stack} {count}" for stack, count in samples.most_common()]
+        with open(filename, "w") as f:
+            json.dump(profile, f, indent=2)
+        logger.warning(
+            f"Slow request {trace.method} {trace.path} took {profile['duration_ms']:.0f} ms, "
+            f"profile saved as {filename}"
+        )
+        self._rotate()
+
+    def _rotate(self):
+        """Keep only the newest profiles"""
+        profiles = sorted(
+            (entry for entry in os.scandir(self.output_dir) if entry.name.startswith("profile_")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in profiles[:-self.keep] if self.keep > 0 else []:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+class TracingMiddleware:
+    """ASGI middleware that opens a Trace per HTTP request and returns its id and timings"""
+
+    def __init__(self, app, profiler: Optional[SlowRequestProfiler] = None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                candidate = value.decode("latin-1")
+                if _VALID_REQUEST_ID.match(candidate):
+                    request_id = candidate
+                break
+        trace = Trace(request_id or uuid.uuid4().hex, scope.get("method", ""), scope.get("path", ""))
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER.lower().encode(), trace.request_id.encode()))
+                headers.append((b"server-timing", trace.server_timing().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = _current_trace.set(trace)
+        if self.profiler:
+            # This coroutine's frame is on the event loop's stack whenever the request's handler runs
+            self.profiler.begin(trace, sys._getframe())
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            trace.end = time.perf_counter()
+            _current_trace.reset(token)
+            if self.profiler:
+                self.profiler.finish(trace)
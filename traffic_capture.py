@@ -0,0 +1,185 @@
+"""
+Live traffic capture for the BioPrint API
+
+ASGI middleware that records every HTTP request as one JSON line in the
+requests.jsonl replay format read by benchmarks/replay.py:
+
+  {"t": 0.0, "method": "POST", "endpoint": "/send-otp", "json": {"email": "patient@example.com"}}
+  {"t": 1.52, "method": "POST", "endpoint": "/predict", "body_file": "captured_bodies/<sha256>.bin",
+   "content_type": "multipart/form-data; boundary=..."}
+
+"t" is the request start in seconds relative to the first captured request.
+Hand-written files can reference an image instead of a raw body:
+
+  {"t": 2.0, "method": "POST", "endpoint": "/predict", "image": "Sample dataset/A+/1.jpg"}
+
+Non-JSON bodies (image uploads) are stored once per content hash under the body
+directory, next to the capture file. Records are queued by the middleware and
+written by a background thread, so capturing never blocks the event loop on disk. Note that captured JSON bodies contain patient
+emails and OTPs, so capture files must be handled like any other patient data.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TrafficRecorder:
+    """Appends request records to a JSONL capture file from a background thread"""
+
+    def __init__(self, path: str, body_dir: Optional[str] = None, max_body_bytes: int = 20 * 1024 * 1024,
+                 flush_seconds: float = 1.0):
+        self.path = path
+        base_dir = os.path.dirname(os.path.abspath(path))
+        self.body_dir = body_dir or os.path.join(base_dir, "captured_bodies")
+        self.max_body_bytes = max_body_bytes
+        self.flush_seconds = flush_seconds
+        self._base_dir = base_dir
+        self._origin: Optional[float] = None
+        self._lock = threading.Lock()
+        self._buffer: List[Dict] = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="traffic-capture-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the writer and write what is queued"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            self._wake.set()
+            thread.join()
+        self.flush()
+
+    def relative_time(self, timestamp: float) -> float:
+        with self._lock:
+            if self._origin is None:
+                self._origin = timestamp
+            return round(timestamp - self._origin, 6)
+
+    def _store_body(self, body: bytes) -> str:
+        digest = hashlib.sha256(body).hexdigest()
+        os.makedirs(self.body_dir, exist_ok=True)
+        filename = os.path.join(self.body_dir, f"{digest}.bin")
+        if not os.path.exists(filename):
+            with open(filename, "wb") as f:
+                f.write(body)
+        return os.path.relpath(filename, self._base_dir).replace(os.sep, "/")
+
+    def record(self, t: float, method: str, endpoint: str, content_type: str, body: bytes,
+               status: Optional[int], duration: float, truncated: bool = False):
+        """Queue one request record; never blocks on disk"""
+        entry = {"t": t, "method": method, "endpoint": endpoint, "content_type": content_type, "body": body,
+                 "truncated": truncated, "status": status, "duration": duration}
+        self.start()
+        with self._lock:
+            self._buffer.append(entry)
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write captured requests: {e}")
+
+    def flush(self):
+        """Write the queued records (and their bodies) in arrival order"""
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+        if not entries:
+            return
+        lines = [json.dumps(self._to_line(entry), ensure_ascii=False) + "\n" for entry in entries]
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    def _to_line(self, entry: Dict) -> Dict:
+        body, content_type = entry["body"], entry["content_type"]
+        line = {"t": entry["t"], "method": entry["method"], "endpoint": entry["endpoint"]}
+        if body and not entry["truncated"]:
+            if content_type.startswith("application/json"):
+                try:
+                    line["json"] = json.loads(body)
+                except ValueError:
+                    line["body_file"] = self._store_body(body)
+                    line["content_type"] = content_type
+            else:
+                line["body_file"] = self._store_body(body)
+                line["content_type"] = content_type
+        elif entry["truncated"]:
+            line["body_truncated"] = True
+        line["status"] = entry["status"]
+        line["duration_ms"] = round(entry["duration"] * 1000, 3)
+        return line
+
+
+class TrafficCaptureMiddleware:
+    """ASGI middleware that tees request bodies into a TrafficRecorder"""
+
+    def __init__(self, app, recorder: TrafficRecorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        t = self.recorder.relative_time(time.monotonic())
+        chunks = []
+        size = 0
+        truncated = False
+        status = None
+
+        async def receive_and_record():
+            nonlocal size, truncated
+            message = await receive()
+            if message["type"] == "http.request" and not truncated:
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size > self.recorder.max_body_bytes:
+                    truncated = True
+                    chunks.clear()
+                else:
+                    chunks.append(chunk)
+            return message
+
+        async def send_and_record(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_record, send_and_record)
+        finally:
+            content_type = ""
+            for name, value in scope.get("headers", []):
+                if name == b"content-type":
+                    content_type = value.decode("latin-1")
+                    break
+            path = scope.get("path", "")
+            if scope.get("query_string"):
+                path += "?" + scope["query_string"].decode("latin-1")
+            try:
+                self.recorder.record(t, scope.get("method", ""), path, content_type, b"".join(chunks),
+                                     status, time.perf_counter() - start, truncated)
+            except Exception as e:
+                logger.error(f"Failed to record captured request: {e}")
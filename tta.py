@@ -0,0 +1,69 @@
+"""
+Test-time augmentation (TTA) for the BioPrint models
+
+R307S captures vary in finger placement and pressure. With TTA a preprocessed
+image is expanded into K augmented views (flips, small shifts and a centre crop),
+each model runs once on the whole batch of views, and the softmax outputs are
+averaged.
+
+Every view is a separable pixel remapping (a row index map and a column index
+map into the original image, clipped at the borders), so the K views are built
+by a single NumPy gather with no Python loop over pixels or views.
+"""
+
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+
+# Shift in pixels of the shifted views and fraction of the image kept by the centre crop
+SHIFT_PIXELS = 6
+CROP_FRACTION = 0.9
+
+# (name, horizontal flip, row shift, column shift, zoom) in the order views are added
+VIEWS: List[Tuple[str, bool, int, int, float]] = [
+    ("original", False, 0, 0, 1.0),
+    ("flip", True, 0, 0, 1.0),
+    ("shift_right", False, 0, SHIFT_PIXELS, 1.0),
+    ("shift_left", False, 0, -SHIFT_PIXELS, 1.0),
+    ("shift_down", False, SHIFT_PIXELS, 0, 1.0),
+    ("shift_up", False, -SHIFT_PIXELS, 0, 1.0),
+    ("crop", False, 0, 0, CROP_FRACTION),
+    ("flip_crop", True, 0, 0, CROP_FRACTION),
+]
+MAX_VIEWS = len(VIEWS)
+
+
+def _axis_map(size: int, shift: int, zoom: float, flip: bool) -> np.ndarray:
+    """Source index along one axis for each output index"""
+    centre = (size - 1) / 2
+    positions = centre + (np.arange(size) - centre) * zoom - shift
+    indices = np.clip(np.rint(positions), 0, size - 1).astype(np.intp)
+    return indices[::-1] if flip else indices
+
+
+@lru_cache(maxsize=32)
+def _index_maps(height: int, width: int, views: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row maps (views, height, 1) and column maps (views, 1, width)"""
+    rows = np.stack([_axis_map(height, row_shift, zoom, False) for _, _, row_shift, _, zoom in VIEWS[:views]])
+    cols = np.stack([_axis_map(width, col_shift, zoom, flip) for _, flip, _, col_shift, zoom in VIEWS[:views]])
+    return rows[:, :, None], cols[:, None, :]
+
+
+def augment(processed: np.ndarray, views: int) -> np.ndarray:
+    """Batch of the first `views` augmented views of a preprocessed (1, H, W, C) image"""
+    if not 1 <= views <= MAX_VIEWS:
+        raise ValueError(f"TTA views must be between 1 and {MAX_VIEWS}, got {views}")
+    image = processed[0]
+    if views == 1:
+        return processed
+    rows, cols = _index_maps(image.shape[0], image.shape[1], views)
+    return image[rows, cols]
+
+
+def predict(model, batch: np.ndarray) -> np.ndarray:
+    """Model softmax output averaged over a batch of views"""
+    predictions = model.predict(batch, verbose=0)
+    if len(predictions) == 1:
+        return predictions[0]
+    return predictions.mean(axis=0)